@@ -1,16 +1,32 @@
 """Tool used for the calculation of the launcher cost. There are three contributors. These are the engines,
 the propellant and the head structure."""
 
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from launcher import worker_client
+
+if __name__ == '__main__':    # Run by the warm worker if there is one (see launcher.worker)
+    worker_client.forward("Cost")
+
 from lxml import etree
+import numpy as np
+
+from launcher import catalog
+from launcher import model
+from launcher import profiling
 
 
 def read_input(path):
     """Inputs from the XML file are read."""
 
-    tree = etree.parse(path)
-    root = tree.getroot()
+    return read_model(model.read(path))
+
 
-    stages = root.xpath("Stage")
+def read_model(launcher):
+    """Inputs from a launcher model (launcher.model) are read."""
 
     n_engines_list = []
     m_engine_list = []
@@ -19,52 +35,34 @@ def read_input(path):
     m_lox_list = []
     structure_mass_list = []
 
-    for stage in stages:
+    for stage in launcher.stages:
 
-        engines_solid = 0
-        engines_liquid = 0
+        # Only the solid engines are counted in a stage that has solid ones
+        engines_solid = sum(1 for code in stage.engine_codes if catalog.KIND[code] == catalog.SOLID)
+        n_engines_list.append(engines_solid if engines_solid > 0 else stage.engines)
 
-        try:
-            engines_solid = len(stage.xpath("Engines/Solid")[0].getchildren())
-        except IndexError:
-            engines_liquid = len(stage.xpath("Engines/Liquid")[0].getchildren())
-
-        n_engines = engines_solid + engines_liquid
-        n_engines_list.append(n_engines)
-
-        try:    # Solid
-            m_engine = float(stage.xpath("Mass/Casing/text()")[0])
-            m_solid = float(stage.xpath("Mass/Propellant/text()")[0])
+        if stage.casing is not None:    # Solid
+            m_engine = stage.casing
+            m_solid = stage.propellant
             m_h2 = 0
             m_lox = 0
-        except IndexError:    # Liquid
-            m_engine = float(stage.xpath("Mass/Tanks/text()")[0]) + \
-                       float(stage.xpath("Mass/Insulation/text()")[0]) + float(stage.xpath("Mass/Pumps/text()")[0])
+        else:    # Liquid
+            m_engine = stage.tanks + stage.insulation + stage.pumps
             m_solid = 0
-            m_h2 = float(stage.xpath("Mass/Hydrogen/text()")[0])
-            m_lox = float(stage.xpath("Mass/LOX/text()")[0])
-
-        try:
-            structure_mass = float(stage.xpath("Mass/Structure/text()")[0])
-        except IndexError:
-            structure_mass = 0
+            m_h2 = stage.hydrogen
+            m_lox = stage.lox
 
         m_engine_list.append(m_engine)
         m_solid_list.append(m_solid)
         m_h2_list.append(m_h2)
         m_lox_list.append(m_lox)
-        structure_mass_list.append(structure_mass)
+        structure_mass_list.append(stage.structure if stage.structure is not None else 0)
 
     return n_engines_list, m_engine_list, m_solid_list, m_h2_list, m_lox_list, structure_mass_list
 
 
 def calculate(n_engines_list, m_engine_list, m_solid_list, m_h2_list, m_lox_list, structure_mass_list):
-    """Calculation of the launcher cost."""
-
-    # Fuel costs
-    fuel_cost_per_kg = {"Solid": 5,
-                        "LOX": 0.27,
-                        "LH2": 6.1}
+    """Calculation of the launcher cost (engine cost coefficients and propellant costs from launcher.catalog)."""
 
     total_cost = 0
 
@@ -78,18 +76,20 @@ def calculate(n_engines_list, m_engine_list, m_solid_list, m_h2_list, m_lox_list
 
         # Engine cost
         if m_solid > 0:  # Solid
-            production_cost_engines_stage = 0.85 * n_engines * 2.3 * (m_engine + m_solid) ** 0.399  # page 125 TRANSCOST
+            production_cost_engines_stage = 0.85 * n_engines * catalog.COST_FACTOR[catalog.SOLID] * \
+                (m_engine + m_solid) ** catalog.COST_EXPONENT[catalog.SOLID]
         else:    # Liquid
-            production_cost_engines_stage = 0.85 * n_engines * 5.16 * m_engine ** 0.45  # page 129 TRANSCOST
+            production_cost_engines_stage = 0.85 * n_engines * catalog.COST_FACTOR[catalog.LIQUID] * \
+                m_engine ** catalog.COST_EXPONENT[catalog.LIQUID]
 
         engine_cost_years = production_cost_engines_stage
         engine_cost_stage = engine_cost_years * 366518  # Conversion to dollars
 
         # Propellant cost
         if m_h2 > 0:
-            fuel_cost_stage = m_h2 * fuel_cost_per_kg["LH2"] + m_lox * fuel_cost_per_kg["LOX"]
-        else:
-            fuel_cost_stage = m_solid * fuel_cost_per_kg["Solid"]
+            fuel_cost_stage = m_h2 * catalog.PROPELLANT_COST[catalog.LH2] + m_lox * catalog.PROPELLANT_COST[catalog.LOX]
+        else:    # The solid propellants have the same cost
+            fuel_cost_stage = m_solid * catalog.PROPELLANT_COST[catalog.PBAN]
 
         # Structure cost
         if structure_mass > 0:
@@ -103,6 +103,35 @@ def calculate(n_engines_list, m_engine_list, m_solid_list, m_h2_list, m_lox_list
     return total_cost
 
 
+def calculate_batch(n_engines, m_engine, m_solid, m_h2, m_lox, structure_mass):
+    """Vectorized calculate: the inputs are arrays (N, S) of the stages of N designs, zero for the stages a
+    design does not have, and the output is the total cost of each design (N,). Complex masses give a complex
+    cost, for complex-step derivatives (launcher.sensitivity)."""
+
+    dtype = complex if any(np.iscomplexobj(mass) for mass in (m_engine, m_solid, m_h2, m_lox, structure_mass)) \
+        else float
+    n_engines = np.asarray(n_engines)
+    m_engine = np.asarray(m_engine, dtype=dtype)
+    m_solid = np.asarray(m_solid, dtype=dtype)
+    m_h2 = np.asarray(m_h2, dtype=dtype)
+    structure_mass = np.asarray(structure_mass, dtype=dtype)
+
+    # Engine cost (TRANSCOST), in dollars
+    production_cost_engines = np.where(
+        m_solid > 0, 0.85 * n_engines * catalog.COST_FACTOR[catalog.SOLID] *
+        (m_engine + m_solid) ** catalog.COST_EXPONENT[catalog.SOLID],
+        0.85 * n_engines * catalog.COST_FACTOR[catalog.LIQUID] * m_engine ** catalog.COST_EXPONENT[catalog.LIQUID])
+    engine_cost = production_cost_engines * 366518
+
+    # Propellant and structure cost
+    fuel_cost = np.where(m_h2 > 0, m_h2 * catalog.PROPELLANT_COST[catalog.LH2] +
+                         np.asarray(m_lox) * catalog.PROPELLANT_COST[catalog.LOX],
+                         m_solid * catalog.PROPELLANT_COST[catalog.PBAN])
+    structure_cost = np.where(structure_mass > 0, 3 * structure_mass, 0)
+
+    return np.sum(engine_cost + fuel_cost + structure_cost, axis=-1)
+
+
 def write_output(path, total_cost):
     """Generation of the output XML file"""
 
@@ -117,13 +146,23 @@ def write_output(path, total_cost):
     pass
 
 
+def write_model(launcher, total_cost):
+    """Outputs are written to a launcher model."""
+
+    launcher.cost = total_cost
+
+
 def run():
     """Execution of the tool"""
     
-    n_engines_list, m_engine_list, m_solid_list, m_h2_list, m_lox_list, structure_mass_list = \
-        read_input('ToolInput/toolinput.xml')
-    total_cost = calculate(n_engines_list, m_engine_list, m_solid_list, m_h2_list, m_lox_list, structure_mass_list)
-    write_output('ToolOutput/toolOutput.xml', total_cost)
+    with profiling.span("Cost.read_input"):
+        n_engines_list, m_engine_list, m_solid_list, m_h2_list, m_lox_list, structure_mass_list = \
+            read_input('ToolInput/toolinput.xml')
+    with profiling.span("Cost.calculate"):
+        total_cost = calculate(n_engines_list, m_engine_list, m_solid_list, m_h2_list, m_lox_list,
+                               structure_mass_list)
+    with profiling.span("Cost.write_output"):
+        write_output('ToolOutput/toolOutput.xml', total_cost)
 
 
 if __name__ == '__main__':
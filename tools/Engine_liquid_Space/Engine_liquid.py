@@ -4,57 +4,68 @@ XML file containing the engines used in a certain stage. It provides as output t
 
  More information about the references used can be found in the following link:"""
 
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from launcher import worker_client
+
+if __name__ == '__main__':    # Run by the warm worker if there is one (see launcher.worker)
+    worker_client.forward("Engine_liquid")
+
 import xml.etree.ElementTree as ET
+import numpy as np
+
+from launcher import catalog
+from launcher import model
+from launcher import profiling
 
 
 def read_input(path):
-    """Inputs from the XML file are read."""
+    """Inputs from the XML file are read. The file holds the stage (the first one is used)."""
+
+    return read_model(model.read(path).stages[0])
 
-    tree = ET.parse(path)
-    root = tree.getroot()
 
-    # The number of engines of each possible stage are taken from the XML input file.
-    vulcain = len(root.findall("Stage/Engines/Liquid/VULCAIN"))
-    rs68 = len(root.findall("Stage/Engines/Liquid/RS68"))
-    s_ivb = len(root.findall("Stage/Engines/Liquid/SIVB"))
+def read_model(stage):
+    """Inputs from a stage of a launcher model (launcher.model) are read."""
 
-    return vulcain, rs68, s_ivb
+    counts = stage.engine_counts()    # Number of engines of each type
+
+    return counts[catalog.VULCAIN], counts[catalog.RS68], counts[catalog.SIVB]
 
 
 def calculate(vulcain, rs68, s_ivb):
-    """Calculation of the stage propulsion properties."""
+    """Calculation of the stage propulsion properties (engine data from launcher.catalog). With several engine
+    types the expansion ratio and mass flow are the ones of the last type (S_IVB, then RS68, then VULCAIN)."""
 
     thrust = 0
     expansion_ratio = 0
     mdot = 0
 
-    expansion_ratios = {"VULCAIN": 45,
-                        "RS68": 21.5,
-                        "S_IVB": 28}
-
-    mdot_dic = {"VULCAIN": 188.33,    # Mass flow in kg/s
-                "RS68": 807.39,
-                "S_IVB": 247}
+    for code, number in zip((catalog.VULCAIN, catalog.RS68, catalog.SIVB), (vulcain, rs68, s_ivb)):
+        if number > 0:
+            thrust = thrust + number * catalog.THRUST[code]
+            expansion_ratio = catalog.EXPANSION_RATIO[code]
+            mdot = catalog.MDOT[code] * number
 
-    thrust_per_engine = {"VULCAIN": 0.8e6,    # Thrust in N
-                         "RS68": 2.891e6,
-                         "S_IVB": 0.486e6}
+    return thrust, expansion_ratio, mdot
 
-    if vulcain + rs68 + s_ivb > 0:
-        thrust = vulcain * thrust_per_engine["VULCAIN"] + rs68 * thrust_per_engine["RS68"] + s_ivb * thrust_per_engine[
-            "S_IVB"]
 
-    if vulcain > 0:
-        expansion_ratio = expansion_ratios["VULCAIN"]
-        mdot = mdot_dic["VULCAIN"] * vulcain
+def calculate_batch(vulcain, rs68, s_ivb):
+    """Vectorized calculate: the numbers of engines are arrays of the same shape (for example designs x stages)
+    and so are the outputs."""
 
-    if rs68 > 0:
-        expansion_ratio = expansion_ratios["RS68"]
-        mdot = mdot_dic["RS68"] * rs68
+    thrust = 0
+    expansion_ratio = 0
+    mdot = 0
 
-    if s_ivb > 0:
-        expansion_ratio = expansion_ratios["S_IVB"]
-        mdot = mdot_dic["S_IVB"] * s_ivb
+    for code, number in zip((catalog.VULCAIN, catalog.RS68, catalog.SIVB), (vulcain, rs68, s_ivb)):
+        number = np.asarray(number)
+        thrust = thrust + number * catalog.THRUST[code]
+        expansion_ratio = np.where(number > 0, catalog.EXPANSION_RATIO[code], expansion_ratio)
+        mdot = np.where(number > 0, catalog.MDOT[code] * number, mdot)
 
     return thrust, expansion_ratio, mdot
 
@@ -79,12 +90,23 @@ def write_output(path, thrust, expansion_ratio, mdot):
     pass
 
 
+def write_model(stage, thrust, expansion_ratio, mdot):
+    """Outputs are written to a stage of a launcher model."""
+
+    stage.thrust = thrust
+    stage.expansion_ratio = expansion_ratio
+    stage.mdot = mdot
+
+
 def run():
     """Execution of the tool"""
 
-    vulcain, rs68, s_ivb = read_input('ToolInput/toolinput.xml')
-    thrust, expansion_ratio, mdot = calculate(vulcain, rs68, s_ivb)
-    write_output('ToolOutput/toolOutput.xml', thrust, expansion_ratio, mdot)
+    with profiling.span("Engine_liquid.read_input"):
+        vulcain, rs68, s_ivb = read_input('ToolInput/toolinput.xml')
+    with profiling.span("Engine_liquid.calculate"):
+        thrust, expansion_ratio, mdot = calculate(vulcain, rs68, s_ivb)
+    with profiling.span("Engine_liquid.write_output"):
+        write_output('ToolOutput/toolOutput.xml', thrust, expansion_ratio, mdot)
 
 
 if __name__ == '__main__':
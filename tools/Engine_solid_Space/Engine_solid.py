@@ -4,45 +4,64 @@ XML file containing the engines used in a certain stage. It provides as output t
 
  More information about the references used can be found in the following link:"""
 
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from launcher import worker_client
+
+if __name__ == '__main__':    # Run by the warm worker if there is one (see launcher.worker)
+    worker_client.forward("Engine_solid")
+
 import xml.etree.ElementTree as ET
+import numpy as np
+
+from launcher import catalog
+from launcher import model
+from launcher import profiling
 
 
 def read_input(path):
-    """Inputs from the XML file are read."""
+    """Inputs from the XML file are read. The file holds the stage (the first one is used)."""
+
+    return read_model(model.read(path).stages[0])
 
-    tree = ET.parse(path)
-    root = tree.getroot()
 
-    # The number of engines of each possible stage are taken from the XML input file.
-    srb = len(root.findall("Stage/Engines/Solid/SRB"))
-    p80 = len(root.findall("Stage/Engines/Solid/P80"))
-    gem60 = len(root.findall("Stage/Engines/Solid/GEM60"))
+def read_model(stage):
+    """Inputs from a stage of a launcher model (launcher.model) are read."""
 
-    return srb, p80, gem60
+    counts = stage.engine_counts()    # Number of engines of each type
+
+    return counts[catalog.SRB], counts[catalog.P80], counts[catalog.GEM60]
 
 
 def calculate(srb, p80, gem60):
-    """Calculation of the stage propulsion properties."""
+    """Calculation of the stage propulsion properties (engine data from launcher.catalog). With several engine
+    types the mass flow is the one of the last type (GEM60, then P80, then SRB)."""
 
     thrust = 0
     mdot = 0
 
-    mdot_dic = {"SRB": 5290,    # Mass flow in kg/s
-                "P80": 764,
-                "GEM60": 463.18}
+    for code, number in zip((catalog.SRB, catalog.P80, catalog.GEM60), (srb, p80, gem60)):
+        if number > 0:
+            thrust = thrust + number * catalog.THRUST[code]
+            mdot = catalog.MDOT[code] * number
+
+    return thrust, mdot
+
 
-    thrust_per_engine = {"SRB": 12.45e6,    # Thrust in N
-                         "P80": 2.1e6,
-                         "GEM60": 1.245e6}
+def calculate_batch(srb, p80, gem60):
+    """Vectorized calculate: the numbers of engines are arrays of the same shape (for example designs x stages)
+    and so are the outputs."""
+
+    thrust = 0
+    mdot = 0
 
-    if srb + p80 + gem60 > 0:
-        thrust = srb * thrust_per_engine["SRB"] + p80 * thrust_per_engine["P80"] + gem60 * thrust_per_engine["GEM60"]
-    if srb > 0:
-        mdot = mdot_dic["SRB"] * srb
-    if p80 > 0:
-        mdot = mdot_dic["P80"] * p80
-    if gem60 > 0:
-        mdot = mdot_dic["GEM60"] * gem60
+    for code, number in zip((catalog.SRB, catalog.P80, catalog.GEM60), (srb, p80, gem60)):
+        number = np.asarray(number)
+        thrust = thrust + number * catalog.THRUST[code]
+        mdot = np.where(number > 0, catalog.MDOT[code] * number, mdot)
 
     return thrust, mdot
 
@@ -65,12 +84,22 @@ def write_output(path, thrust, mdot):
     pass
 
 
+def write_model(stage, thrust, mdot):
+    """Outputs are written to a stage of a launcher model."""
+
+    stage.thrust = thrust
+    stage.mdot = mdot
+
+
 def run():
     """Execution of the tool"""
 
-    srb, p80, gem60 = read_input('ToolInput/toolinput.xml')
-    thrust, mdot = calculate(srb, p80, gem60)
-    write_output('ToolOutput/toolOutput.xml', thrust, mdot)
+    with profiling.span("Engine_solid.read_input"):
+        srb, p80, gem60 = read_input('ToolInput/toolinput.xml')
+    with profiling.span("Engine_solid.calculate"):
+        thrust, mdot = calculate(srb, p80, gem60)
+    with profiling.span("Engine_solid.write_output"):
+        write_output('ToolOutput/toolOutput.xml', thrust, mdot)
 
 
 if __name__ == '__main__':
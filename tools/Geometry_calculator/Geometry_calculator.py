@@ -1,63 +1,46 @@
 """Tool used for the calculation of geometric properties later used by other disciplines."""
 
-from lxml import etree
-from math import tan, pi
-import numpy as np
+import os
+import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
 
-def read_input(path):
-    """Inputs from the XML file are read."""
+from launcher import worker_client
+
+if __name__ == '__main__':    # Run by the warm worker if there is one (see launcher.worker)
+    worker_client.forward("Geometry_calculator")
 
-    tree = etree.parse(path)
-    root = tree.getroot()
+from lxml import etree
+from math import tan, pi
+import numpy as np
 
-    stages = root.xpath("Stage")
-    l_d = float(root.xpath("Geometry/L_D/text()")[0])
+from launcher import catalog
+from launcher import model
+from launcher import profiling
 
-    length_stages_list = []  # The length of each stage is stored in a list
+HEAD_SHAPES = ("Cone", "Sphere", "Elliptical")    # Integer codes of the head shapes in calculate_batch
 
-    for stage in stages:
-        length_stage = float(stage.xpath("Geometry/Length/text()")[0])
-        length_stages_list.append(length_stage)
 
-    head_shape = root.xpath("Geometry/Head_shape/text()")[0]
+def read_input(path):
+    """Inputs from the XML file are read."""
 
-    try:  # Conical head
-        cone_angle = float(root.xpath("Geometry/Cone_angle/text()")[0])
-    except IndexError:
-        cone_angle = 0
+    return read_model(model.read(path))
 
-    try:  # Elliptical head
-        l_ratio = float(root.xpath("Geometry/L_ratio_ellipse/text()")[0])
-    except IndexError:
-        l_ratio = 0
 
-    engines_stages = []  # The engines of each stage are stored in a list
+def read_model(launcher):
+    """Inputs from a launcher model (launcher.model) are read."""
 
-    for stage in stages:
-        if len(stage.xpath("Engines/Solid/SRB")) > 0:
-            engine_stage = "srb" * len(stage.xpath("Engines/Solid/SRB"))
-        if len(stage.xpath("Engines/Solid/P80")) > 0:
-            engine_stage = "p80" * len(stage.xpath("Engines/Solid/P80"))
-        if len(stage.xpath("Engines/Solid/GEM60")) > 0:
-            engine_stage = "gem60" * len(stage.xpath("Engines/Solid/GEM60"))
-        if len(stage.xpath("Engines/Liquid/VULCAIN")) > 0:
-            engine_stage = "vulcain" * len(stage.xpath("Engines/Liquid/VULCAIN"))
-        if len(stage.xpath("Engines/Liquid/RS68")) > 0:
-            engine_stage = "rs68" * len(stage.xpath("Engines/Liquid/RS68"))
-        if len(stage.xpath("Engines/Liquid/SIVB")) > 0:
-            engine_stage = "s_ivb" * len(stage.xpath("Engines/Liquid/SIVB"))
-        engines_stages.append(engine_stage)
+    length_stages_list = [stage.length for stage in launcher.stages]  # The length of each stage is stored in a list
+    cone_angle = launcher.cone_angle if launcher.cone_angle is not None else 0  # Conical head
+    l_ratio = launcher.l_ratio if launcher.l_ratio is not None else 0  # Elliptical head
+    engines_stages = [stage.engine for stage in launcher.stages]  # Engine code of each stage
 
-    return l_d, length_stages_list, head_shape, cone_angle, l_ratio, engines_stages
+    return launcher.l_d, length_stages_list, launcher.head_shape, cone_angle, l_ratio, engines_stages
 
 
 def calculate(l_d, length_stages_list, head_shape, cone_angle, l_ratio, engines_stages):
-    """Calculation of the launcher geometric properties."""
-
-    ratio_o_f = 7.937  # Stoichiometric oxidizer to fuel ratio
-    densities_per_material = {"LOX": 1140,
-                              "LH2": 71}
+    """Calculation of the launcher geometric properties. engines_stages is the engine code (launcher.catalog) of
+    each stage, which gives the propellants of its tanks."""
 
     total_length = sum(length_stages_list)
     diameter = total_length / l_d
@@ -91,12 +74,12 @@ def calculate(l_d, length_stages_list, head_shape, cone_angle, l_ratio, engines_
         volume_stage = pi * diameter ** 2 / 4 * length_stage
         stages_volume.append(volume_stage)
 
-        vulcain = engines_stages[stage].count("vulcain")
-        rs68 = engines_stages[stage].count("rs68")
-        s_ivb = engines_stages[stage].count("s_ivb")
+        engine = engines_stages[stage]
 
-        if vulcain + rs68 + s_ivb > 0:
-            volume_h2 = volume_stage / (densities_per_material["LH2"] * ratio_o_f / densities_per_material["LOX"] + 1)
+        if engine >= 0 and catalog.KIND[engine] == catalog.LIQUID:
+            # Oxidizer to fuel mass ratio and densities of the propellants
+            volume_h2 = volume_stage / (catalog.DENSITY[catalog.FUEL[engine]] * catalog.MIXTURE_RATIO[engine] /
+                                        catalog.DENSITY[catalog.OXIDIZER[engine]] + 1)
             volume_lox = volume_stage - volume_h2
             height_oxidizer = volume_lox / pi / radius / radius
             height_fuel = volume_h2 / pi / radius / radius
@@ -120,6 +103,53 @@ def calculate(l_d, length_stages_list, head_shape, cone_angle, l_ratio, engines_
            oxidizer_surfaces
 
 
+def calculate_batch(l_d, lengths, head_shape, cone_angle, l_ratio, engines):
+    """Vectorized calculate for N designs of up to S stages:
+
+    - l_d, cone_angle and l_ratio: arrays (N,). head_shape: integer codes (N,) of HEAD_SHAPES.
+    - lengths: array (N, S), zero for the stages a design does not have.
+    - engines: engine codes (N, S) of launcher.catalog, -1 for the stages a design does not have.
+
+    The outputs are the ones of calculate, arrays (N,) for the launcher and (N, S) for the stages. Complex
+    inputs give complex outputs, for complex-step derivatives (launcher.sensitivity)."""
+
+    dtype = complex if any(np.iscomplexobj(values) for values in (l_d, lengths, cone_angle, l_ratio)) else float
+    lengths = np.asarray(lengths, dtype=dtype)
+    head_shape = np.asarray(head_shape)
+    total_length = lengths.sum(axis=1)
+    diameter = total_length / np.asarray(l_d, dtype=dtype)
+    radius = diameter / 2
+
+    # Head geometric properties. The formulas of the other shapes are not defined for every design
+    with np.errstate(divide="ignore", invalid="ignore"):
+        h_cone = radius / np.tan(np.asarray(cone_angle, dtype=dtype) * pi / 180)
+        l_ellipse = np.asarray(l_ratio, dtype=dtype) * total_length
+        eps = np.sqrt(l_ellipse ** 2 - radius ** 2) / l_ellipse
+        volume_available = np.select([head_shape == 0, head_shape == 1],
+                                     [1 / 3 * pi * h_cone * radius ** 2, 4 / 3 * pi * radius ** 3 / 2],
+                                     2 / 3 * pi * l_ellipse * radius ** 2)
+        surface_tip = np.select([head_shape == 0, head_shape == 1],
+                                [pi * radius * np.sqrt(radius ** 2 + h_cone ** 2), 2 * pi * radius ** 2],
+                                pi * l_ellipse ** 2 + (np.log((1 + eps) / (1 - eps)) * pi / eps * radius ** 2) / 2)
+
+    # Propellant related geometric properties
+    engines = np.asarray(engines)
+    codes = np.where(engines >= 0, engines, 0)
+    liquid = (engines >= 0) & (np.asarray(catalog.KIND)[codes] == catalog.LIQUID)
+    fuel_density = np.asarray(catalog.DENSITY)[np.asarray(catalog.FUEL)[codes]]
+    oxidizer_density = np.asarray(catalog.DENSITY)[np.asarray(catalog.OXIDIZER)[codes]]
+    mixture_ratio = np.asarray(catalog.MIXTURE_RATIO)[codes]
+
+    radius = radius[:, None]
+    stages_volume = pi * diameter[:, None] ** 2 / 4 * lengths
+    volume_h2 = np.where(liquid, stages_volume / (fuel_density * mixture_ratio / oxidizer_density + 1), 0)
+    volume_lox = np.where(liquid, stages_volume - volume_h2, 0)
+    s_tank_oxidizer = np.where(liquid, pi * radius ** 2 * 2 + 2 * pi * radius * (volume_lox / pi / radius / radius), 0)
+    s_tank_fuel = np.where(liquid, pi * radius ** 2 * 2 + 2 * pi * radius * (volume_h2 / pi / radius / radius), 0)
+
+    return diameter, surface_tip, volume_available, stages_volume, volume_h2, volume_lox, s_tank_fuel, s_tank_oxidizer
+
+
 def write_output(path, diameter, surface_tip, volume_available, stages_volume, fuel_volumes, oxidizer_volumes,
                  fuel_surfaces, oxidizer_surfaces):
     """Generation of the output XML file"""
@@ -164,14 +194,35 @@ def write_output(path, diameter, surface_tip, volume_available, stages_volume, f
     pass
 
 
+def write_model(launcher, diameter, surface_tip, volume_available, stages_volume, fuel_volumes, oxidizer_volumes,
+                fuel_surfaces, oxidizer_surfaces):
+    """Outputs are written to a launcher model, as write_output writes them to the XML file."""
+
+    for stage_counter, stage in enumerate(launcher.stages):
+        stage.stage_volume = stages_volume[stage_counter]
+        if fuel_volumes[stage_counter] > 0:    # Liquid propellant
+            stage.oxidizer_tank_volume = oxidizer_volumes[stage_counter]
+            stage.fuel_tank_volume = fuel_volumes[stage_counter]
+            stage.oxidizer_tank_surface = oxidizer_surfaces[stage_counter]
+            stage.fuel_tank_surface = fuel_surfaces[stage_counter]
+
+    launcher.stages[-1].head_surface = surface_tip    # The head surface is carried by the last stage
+    launcher.available_volume = volume_available
+    launcher.diameter = diameter
+
+
 def run():
     """Execution of the tool"""
 
-    l_d, length_stages_list, head_shape, cone_angle, l_ratio, engines_stages = read_input('ToolInput/toolinput.xml')
-    diameter, surface_tip, volume_available, stages_volume, fuel_volumes, oxidizer_volumes, fuel_surfaces, \
-    oxidizer_surfaces = calculate(l_d, length_stages_list, head_shape, cone_angle, l_ratio, engines_stages)
-    write_output('ToolOutput/toolOutput.xml', diameter, surface_tip, volume_available, stages_volume, fuel_volumes,
-                 oxidizer_volumes, fuel_surfaces, oxidizer_surfaces)
+    with profiling.span("Geometry_calculator.read_input"):
+        l_d, length_stages_list, head_shape, cone_angle, l_ratio, engines_stages = \
+            read_input('ToolInput/toolinput.xml')
+    with profiling.span("Geometry_calculator.calculate"):
+        diameter, surface_tip, volume_available, stages_volume, fuel_volumes, oxidizer_volumes, fuel_surfaces, \
+        oxidizer_surfaces = calculate(l_d, length_stages_list, head_shape, cone_angle, l_ratio, engines_stages)
+    with profiling.span("Geometry_calculator.write_output"):
+        write_output('ToolOutput/toolOutput.xml', diameter, surface_tip, volume_available, stages_volume,
+                     fuel_volumes, oxidizer_volumes, fuel_surfaces, oxidizer_surfaces)
 
 
 if __name__ == '__main__':
@@ -1,57 +1,79 @@
 """Tool used for the calculation of the launcher propellant mass."""
 
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from launcher import worker_client
+
+if __name__ == '__main__':    # Run by the warm worker if there is one (see launcher.worker)
+    worker_client.forward("Mass_propellant")
+
 import xml.etree.ElementTree as ET
+import numpy as np
+
+from launcher import catalog
+from launcher import model
+from launcher import profiling
 
 
 def read_input(path):
-    """Inputs from the XML file are read."""
+    """Inputs from the XML file are read. The file holds the stage (the first one is used)."""
 
-    tree = ET.parse(path)
-    root = tree.getroot()
+    return read_model(model.read(path).stages[0])
 
-    srb = len(root.findall("Stage/Engines/Solid/SRB"))
-    p80 = len(root.findall("Stage/Engines/Solid/P80"))
-    gem60 = len(root.findall("Stage/Engines/Solid/GEM60"))
 
-    volume_tank = float(root.find("Stage/Geometry/Stage_volume").text)
+def read_model(stage):
+    """Inputs from a stage of a launcher model (launcher.model) are read."""
 
-    try:    # Liquid
-        volume_h2 = float(root.find("Stage/Geometry/Fuel_tank_volume").text)
-        volume_lox = float(root.find("Stage/Geometry/Oxidizer_tank_volume").text)
-    except AttributeError:
+    counts = stage.engine_counts()
+    srb, p80, gem60 = counts[catalog.SRB], counts[catalog.P80], counts[catalog.GEM60]
+
+    if stage.fuel_tank_volume is not None:    # Liquid
+        volume_h2 = stage.fuel_tank_volume
+        volume_lox = stage.oxidizer_tank_volume
+    else:
         volume_h2 = 0
         volume_lox = 0
 
-    return srb, p80, gem60, volume_tank, volume_h2, volume_lox
+    return srb, p80, gem60, stage.stage_volume, volume_h2, volume_lox
 
 
 def calculate(srb, p80, gem60, volume_tank, volume_h2, volume_lox):
-    """Calculation of the launcher propellant mass."""
+    """Calculation of the launcher propellant mass (densities and ullage corrections from launcher.catalog)."""
 
     propellant_mass = 0
     h2_mass = 0
     lox_mass = 0
 
-    densities_per_material = {"PBAN": 1715,    # Propellant densities in kg/m^3
-                              "HTPB1912": 1810,
-                              "HTPB_APCP": 1650,
-                              "LOX": 1140,
-                              "LH2": 71}
-
-    corrections_per_material = {"PBAN": 1,    # Correction for ullage volume
-                                "HTPB1912": 1,
-                                "HTPB_APCP": 1,
-                                "LOX": 0.94}
-
-    if srb > 0:
-        propellant_mass = densities_per_material["PBAN"] * corrections_per_material["PBAN"] * volume_tank
-    elif p80 > 0:
-        propellant_mass = densities_per_material["HTPB1912"] * corrections_per_material["HTPB1912"] * volume_tank
-    elif gem60 > 0:
-        propellant_mass = densities_per_material["HTPB_APCP"] * corrections_per_material["HTPB_APCP"] * volume_tank
-    else:
-        h2_mass = volume_h2 * densities_per_material["LH2"] * corrections_per_material["LOX"]
-        lox_mass = volume_lox * densities_per_material["LOX"] * corrections_per_material["LOX"]
+    for code, number in zip((catalog.SRB, catalog.P80, catalog.GEM60), (srb, p80, gem60)):
+        if number > 0:    # Solid
+            propellant = catalog.FUEL[code]
+            propellant_mass = catalog.DENSITY[propellant] * catalog.ULLAGE_CORRECTION[propellant] * volume_tank
+            break
+    else:    # Liquid
+        h2_mass = volume_h2 * catalog.DENSITY[catalog.LH2] * catalog.ULLAGE_CORRECTION[catalog.LH2]
+        lox_mass = volume_lox * catalog.DENSITY[catalog.LOX] * catalog.ULLAGE_CORRECTION[catalog.LOX]
+
+    return propellant_mass, h2_mass, lox_mass
+
+
+def calculate_batch(srb, p80, gem60, volume_tank, volume_h2, volume_lox):
+    """Vectorized calculate: the inputs are arrays of the same shape (for example designs x stages) and so are
+    the outputs. Stages without engines and without tank volumes have no propellant."""
+
+    numbers = [np.asarray(srb), np.asarray(p80), np.asarray(gem60)]
+    propellants = [catalog.FUEL[code] for code in (catalog.SRB, catalog.P80, catalog.GEM60)]
+    liquid = (numbers[0] <= 0) & (numbers[1] <= 0) & (numbers[2] <= 0)
+
+    propellant_mass = np.select([number > 0 for number in numbers],
+                                [catalog.DENSITY[propellant] * catalog.ULLAGE_CORRECTION[propellant] *
+                                 np.asarray(volume_tank) for propellant in propellants], 0)
+    h2_mass = np.where(liquid, np.asarray(volume_h2) * catalog.DENSITY[catalog.LH2] *
+                       catalog.ULLAGE_CORRECTION[catalog.LH2], 0)
+    lox_mass = np.where(liquid, np.asarray(volume_lox) * catalog.DENSITY[catalog.LOX] *
+                        catalog.ULLAGE_CORRECTION[catalog.LOX], 0)
 
     return propellant_mass, h2_mass, lox_mass
 
@@ -79,12 +101,26 @@ def write_output(path, propellant_mass, h2_mass, lox_mass):
     pass
 
 
+def write_model(stage, propellant_mass, h2_mass, lox_mass):
+    """Outputs are written to a stage of a launcher model, as write_output writes them to the XML file."""
+
+    if propellant_mass > 0:    # Solid
+        stage.propellant = propellant_mass
+
+    if h2_mass > 0:    # Liquid
+        stage.hydrogen = h2_mass
+        stage.lox = lox_mass
+
+
 def run():
     """Execution of the tool"""
     
-    srb, p80, gem60, volume_tank, volume_h2, volume_lox = read_input('ToolInput/toolinput.xml')
-    propellant_mass, h2_mass, lox_mass = calculate(srb, p80, gem60, volume_tank, volume_h2, volume_lox)
-    write_output('ToolOutput/toolOutput.xml', propellant_mass, h2_mass, lox_mass)
+    with profiling.span("Mass_propellant.read_input"):
+        srb, p80, gem60, volume_tank, volume_h2, volume_lox = read_input('ToolInput/toolinput.xml')
+    with profiling.span("Mass_propellant.calculate"):
+        propellant_mass, h2_mass, lox_mass = calculate(srb, p80, gem60, volume_tank, volume_h2, volume_lox)
+    with profiling.span("Mass_propellant.write_output"):
+        write_output('ToolOutput/toolOutput.xml', propellant_mass, h2_mass, lox_mass)
 
 
 if __name__ == '__main__':
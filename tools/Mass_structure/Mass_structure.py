@@ -1,46 +1,56 @@
 """Tool used for the calculation of all the components' masses contributing to the launcher total mass,
 excluding the propellant."""
 
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from launcher import worker_client
+
+if __name__ == '__main__':    # Run by the warm worker if there is one (see launcher.worker)
+    worker_client.forward("Mass_structure")
+
 import xml.etree.ElementTree as ET
+import numpy as np
 from numpy import pi
 
+from launcher import catalog
+from launcher import model
+from launcher import profiling
+
 
 def read_input(path):
-    """Inputs from the XML file are read."""
+    """Inputs from the XML file are read. The file holds the stage (the first one is used)."""
+
+    return read_model(model.read(path).stages[0])
 
-    tree = ET.parse(path)
-    root = tree.getroot()
 
-    srb = len(root.findall("Stage/Engines/Solid/SRB"))
-    p80 = len(root.findall("Stage/Engines/Solid/P80"))
-    gem60 = len(root.findall("Stage/Engines/Solid/GEM60"))
-    vulcain = len(root.findall("Stage/Engines/Liquid/VULCAIN"))
-    rs68 = len(root.findall("Stage/Engines/Liquid/RS68"))
-    s_ivb = len(root.findall("Stage/Engines/Liquid/SIVB"))
+def read_model(stage):
+    """Inputs from a stage of a launcher model (launcher.model) are read."""
 
-    try:    # Solid propellant
-        mass_propellant = float(root.find("Stage/Mass/Propellant").text)
-        thrust = float(root.find("Stage/Engines/Thrust").text)
+    counts = stage.engine_counts()
+    srb, p80, gem60 = counts[catalog.SRB], counts[catalog.P80], counts[catalog.GEM60]
+    vulcain, rs68, s_ivb = counts[catalog.VULCAIN], counts[catalog.RS68], counts[catalog.SIVB]
+
+    if stage.propellant is not None:    # Solid propellant
+        mass_propellant = stage.propellant
         expansion_ratio = 0
         oxidizer_tank_volume = 0
         fuel_tank_volume = 0
         s_tank_oxidizer = 0
         s_tank_fuel = 0
-    except AttributeError:    # Liquid propellant
+    else:    # Liquid propellant
         mass_propellant = 0
-        thrust = float(root.find("Stage/Engines/Thrust").text)
-        expansion_ratio = float(root.find("Stage/Engines/Expansion_ratio").text)
-        oxidizer_tank_volume = float(root.find("Stage/Geometry/Oxidizer_tank_volume").text)
-        fuel_tank_volume = float(root.find("Stage/Geometry/Fuel_tank_volume").text)
-        s_tank_oxidizer = float(root.find("Stage/Geometry/Oxidizer_tank_surface").text)
-        s_tank_fuel = float(root.find("Stage/Geometry/Fuel_tank_surface").text)
-
-    try:    # If last stage
-        head_surface = float(root.find("Stage/Geometry/Head_surface").text)
-    except AttributeError:
-        head_surface = 0
-
-    return mass_propellant, thrust, expansion_ratio, oxidizer_tank_volume, fuel_tank_volume, s_tank_oxidizer, \
+        expansion_ratio = stage.expansion_ratio
+        oxidizer_tank_volume = stage.oxidizer_tank_volume
+        fuel_tank_volume = stage.fuel_tank_volume
+        s_tank_oxidizer = stage.oxidizer_tank_surface
+        s_tank_fuel = stage.fuel_tank_surface
+
+    head_surface = stage.head_surface if stage.head_surface is not None else 0    # If last stage
+
+    return mass_propellant, stage.thrust, expansion_ratio, oxidizer_tank_volume, fuel_tank_volume, s_tank_oxidizer, \
            s_tank_fuel, srb, p80, gem60, vulcain, rs68, s_ivb, head_surface
 
 
@@ -76,6 +86,29 @@ def calculate(mass_propellant, thrust, expansion_ratio, oxidizer_tank_volume, fu
     return mass_casing, mass_tank, mass_insulation, pumps_mass, structure_mass
 
 
+def calculate_batch(mass_propellant, thrust, expansion_ratio, oxidizer_tank_volume, fuel_tank_volume,
+                    s_tank_oxidizer, s_tank_fuel, srb, p80, gem60, vulcain, rs68, s_ivb, head_surface):
+    """Vectorized calculate: the inputs are arrays of the same shape (for example designs x stages) and so are
+    the outputs. Stages without engines have no mass."""
+
+    solid = (np.asarray(srb) + np.asarray(p80) + np.asarray(gem60)) > 0
+    n_engines = np.asarray(vulcain) + np.asarray(rs68) + np.asarray(s_ivb)
+    liquid = ~solid & (n_engines > 0)
+
+    mass_casing = np.where(solid, 0.135 * np.asarray(mass_propellant), 0)
+    mass_tank = np.where(liquid, 12.158 * np.asarray(oxidizer_tank_volume) + 9.0911 * np.asarray(fuel_tank_volume), 0)
+    mass_insulation = np.where(liquid, 1.123 * np.asarray(s_tank_oxidizer) + 2.88 * np.asarray(s_tank_fuel), 0)
+    with np.errstate(divide="ignore", invalid="ignore"):    # Stages without engines
+        thrust_per_engine = np.asarray(thrust) / n_engines
+        pumps_mass = np.where(liquid, (7.81e-4 * thrust_per_engine + 3.37e-5 * np.sqrt(expansion_ratio) + 59) *
+                              n_engines, 0)
+
+    head_surface = np.asarray(head_surface)
+    structure_mass = np.where(head_surface > 0, head_surface * 0.005 * 2780, 0)    # Thickness and density
+
+    return mass_casing, mass_tank, mass_insulation, pumps_mass, structure_mass
+
+
 def write_output(path, mass_casing, mass_tank, mass_insulation, pumps_mass, structure_mass):
     """Generation of the output XML file"""
 
@@ -106,15 +139,33 @@ def write_output(path, mass_casing, mass_tank, mass_insulation, pumps_mass, stru
     pass
 
 
+def write_model(stage, mass_casing, mass_tank, mass_insulation, pumps_mass, structure_mass):
+    """Outputs are written to a stage of a launcher model, as write_output writes them to the XML file."""
+
+    if mass_casing > 0:    # Solid
+        stage.casing = mass_casing
+    else:    # Liquid
+        stage.tanks = mass_tank
+        stage.insulation = mass_insulation
+        stage.pumps = pumps_mass
+
+    if structure_mass > 0:     # Last stage
+        stage.structure = structure_mass
+
+
 def run():
     """Execution of the tool"""
 
-    mass_propellant, thrust, expansion_ratio, oxidizer_tank_volume, fuel_tank_volume, s_tank_oxidizer, s_tank_fuel, \
-    srb, p80, gem60, vulcain, rs68, s_ivb, head_surface = read_input('ToolInput/toolinput.xml')
-    mass_casing, mass_tank, mass_insulation, pumps_mass, structure_mass = calculate(mass_propellant, thrust,
-    expansion_ratio, oxidizer_tank_volume, fuel_tank_volume, s_tank_oxidizer, s_tank_fuel, srb, p80, gem60, vulcain,
-    rs68, s_ivb, head_surface)
-    write_output('ToolOutput/toolOutput.xml', mass_casing, mass_tank, mass_insulation, pumps_mass, structure_mass)
+    with profiling.span("Mass_structure.read_input"):
+        mass_propellant, thrust, expansion_ratio, oxidizer_tank_volume, fuel_tank_volume, s_tank_oxidizer, \
+        s_tank_fuel, srb, p80, gem60, vulcain, rs68, s_ivb, head_surface = read_input('ToolInput/toolinput.xml')
+    with profiling.span("Mass_structure.calculate"):
+        mass_casing, mass_tank, mass_insulation, pumps_mass, structure_mass = calculate(mass_propellant, thrust,
+        expansion_ratio, oxidizer_tank_volume, fuel_tank_volume, s_tank_oxidizer, s_tank_fuel, srb, p80, gem60,
+        vulcain, rs68, s_ivb, head_surface)
+    with profiling.span("Mass_structure.write_output"):
+        write_output('ToolOutput/toolOutput.xml', mass_casing, mass_tank, mass_insulation, pumps_mass,
+                     structure_mass)
 
 
 if __name__ == '__main__':
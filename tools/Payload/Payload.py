@@ -1,20 +1,32 @@
 """Tool used for the calculation of the payload constraint. It is checked if the mass of payload calculated
 in the trajectory discipline fits inside the rocket's head."""
 
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from launcher import worker_client
+
+if __name__ == '__main__':    # Run by the warm worker if there is one (see launcher.worker)
+    worker_client.forward("Payload")
+
 import xml.etree.ElementTree as ET
 
+from launcher import model
+from launcher import profiling
+
 
 def read_input(path):
     """Inputs from the XML file are read."""
 
-    tree = ET.parse(path)
-    root = tree.getroot()
+    return read_model(model.read(path))
 
-    available_volume = float(root.find("Payload/Available_volume").text)
-    mass = float(root.find("Payload/Mass").text)
-    density = float(root.find("Payload/Density").text)
 
-    return available_volume, mass, density
+def read_model(launcher):
+    """Inputs from a launcher model (launcher.model) are read."""
+
+    return launcher.available_volume, launcher.payload, launcher.payload_density
 
 
 def calculate(available_volume, mass, density):
@@ -41,12 +53,21 @@ def write_output(path, difference):
     pass
 
 
+def write_model(launcher, difference):
+    """Outputs are written to a launcher model."""
+
+    launcher.payload_constraint = difference
+
+
 def run():
     """Execution of the tool"""
 
-    available_volume, mass, density = read_input('ToolInput/toolinput.xml')
-    difference = calculate(available_volume, mass, density)
-    write_output('ToolOutput/toolOutput.xml', difference)
+    with profiling.span("Payload.read_input"):
+        available_volume, mass, density = read_input('ToolInput/toolinput.xml')
+    with profiling.span("Payload.calculate"):
+        difference = calculate(available_volume, mass, density)
+    with profiling.span("Payload.write_output"):
+        write_output('ToolOutput/toolOutput.xml', difference)
 
 
 if __name__ == '__main__':
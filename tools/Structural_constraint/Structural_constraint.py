@@ -1,44 +1,100 @@
 """Tool used for the calculation of the vehicle structural constraint. It is checked if the maximum loads
 during the trajectory phase overpass at any moment the maximum load the structure can withstand."""
 
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from launcher import worker_client
+
+if __name__ == '__main__':    # Run by the warm worker if there is one (see launcher.worker)
+    worker_client.forward("Structural_constraint")
+
 import xml.etree.ElementTree as ET
-import ast
 import numpy
-from ambiance import Atmosphere
 
+from launcher import atmosphere
+from launcher import model
+from launcher import profiling
 
-def modified_atmosphere(x):    # Atmospheric model
 
-    if 80000 > x > 0:
-        rho = Atmosphere(x).density
-    else:
-        rho = Atmosphere(80000).density
-    return rho
+def modified_atmosphere(x, atmosphere_model="table"):    # Atmospheric model
+
+    return atmosphere.density(x, atmosphere_model)
 
 
 def read_input(path):
-    """Inputs from the XML file are read."""
+    """Inputs from the XML file are read. The trajectory vectors can have any of the encodings of
+    launcher.trajectory_encoding."""
+
+    return read_model(model.read(path))
+
 
-    tree = ET.parse(path)
-    root = tree.getroot()
+def read_model(launcher):
+    """Inputs from a launcher model (launcher.model) are read."""
 
-    qmax = float(root.find("Structure/Max_q").text)    # Maximum dynamic pressure in the whole mission
-    h = ast.literal_eval(root.find("Trajectory/Height").text)
-    v = numpy.array(ast.literal_eval(root.find("Trajectory/Velocity").text))
+    qmax = launcher.max_q    # Maximum dynamic pressure in the whole mission
 
-    return qmax, h, v
+    return qmax, launcher.height, launcher.velocity
 
 
-def calculate(qmax, h, v):
+def read_max_dynamic_pressure(launcher):
+    """Peak dynamic pressure tracked by the trajectory tool in a launcher model, or None if it does not have it."""
+
+    return launcher.max_dynamic_pressure[0] if launcher.max_dynamic_pressure is not None else None
+
+
+def calculate(qmax, h, v, atmosphere_model="table"):
     """Calculation of the launcher structural constraint. It is considered to have overpassed the maximum
-    structural load if it is positive."""
+    structural load if it is positive. The density and dynamic pressure of all the trajectory points are
+    computed at once with arrays."""
+
+    h = numpy.asarray(h, dtype=float)
+    v = numpy.asarray(v, dtype=float)
+    rho = numpy.where(h < 0, 1.225, modified_atmosphere(h, atmosphere_model))
+    constraint = numpy.max(0.5 * v * v * rho) - qmax
+
+    return float(constraint)
+
+
+def calculate_batch(qmax, h, v, lengths=None, atmosphere_model="table"):
+    """Structural constraint of several trajectories at once. h and v are either padded 2-D arrays (one
+    trajectory per row, with the number of valid points of each row in lengths) or lists of 1-D vectors, which
+    are padded here. qmax is a scalar or one value per trajectory. It returns one constraint per trajectory.
+
+    The results are the ones of calculate_reference within the float rounding of the density interpolation
+    (relative differences below 1e-15)."""
+
+    if lengths is None:
+        lengths = [len(heights) for heights in h]
+        h_padded = numpy.zeros((len(lengths), max(lengths)))
+        v_padded = numpy.zeros((len(lengths), max(lengths)))
+        for row, (heights, velocities) in enumerate(zip(h, v)):
+            h_padded[row, :lengths[row]] = heights
+            v_padded[row, :lengths[row]] = velocities
+        h, v = h_padded, v_padded
+    else:
+        h = numpy.asarray(h, dtype=float)
+        v = numpy.asarray(v, dtype=float)
+
+    valid = numpy.arange(h.shape[1]) < numpy.asarray(lengths)[:, None]
+    rho = numpy.where(h < 0, 1.225, modified_atmosphere(h, atmosphere_model))
+    qvector = numpy.where(valid, 0.5 * v * v * rho, -numpy.inf)
+
+    return numpy.max(qvector, axis=1) - numpy.asarray(qmax, dtype=float)
+
+
+def calculate_reference(qmax, h, v, atmosphere_model="table"):
+    """Original point by point calculation of the structural constraint, kept as a reference for
+    regression."""
 
     rho = []
     for altitude in h:
         if altitude < 0:
             rho.append(1.225)
         else:
-            rho.append(modified_atmosphere(altitude).tolist()[0])
+            rho.append(modified_atmosphere(altitude, atmosphere_model))
 
     rho_array = numpy.array(rho)
     qvector = 0.5 * numpy.multiply(numpy.multiply(v, v), rho_array)
@@ -48,6 +104,13 @@ def calculate(qmax, h, v):
     return constraint
 
 
+def calculate_from_peak(qmax, q_peak):
+    """Structural constraint from the peak dynamic pressure of the trajectory. It is the same as calculate
+    with the exact peak instead of the maximum over the trajectory points."""
+
+    return q_peak - qmax
+
+
 def write_output(path, constraint):
     """Generation of the output XML file"""
 
@@ -63,12 +126,27 @@ def write_output(path, constraint):
     pass
 
 
-def run():
-    """Execution of the tool"""
+def write_model(launcher, constraint):
+    """Outputs are written to a launcher model."""
+
+    launcher.structural_constraint = constraint
 
-    qmax, h, v = read_input('ToolInput/toolinput.xml')
-    constraint = calculate(qmax, h, v)
-    write_output('ToolOutput/toolOutput.xml', constraint)
+
+def run():
+    """Execution of the tool. The peak dynamic pressure of the trajectory tool is used if it is in the input
+    (written only when the trajectory tool is run with TRAJECTORY_MAX_Q=1)."""
+
+    with profiling.span("Structural_constraint.read_input"):
+        launcher = model.read('ToolInput/toolinput.xml')
+        qmax, h, v = read_model(launcher)
+        q_peak = read_max_dynamic_pressure(launcher)
+    with profiling.span("Structural_constraint.calculate"):
+        if q_peak is not None:
+            constraint = calculate_from_peak(qmax, q_peak)
+        else:
+            constraint = calculate(qmax, h, v)
+    with profiling.span("Structural_constraint.write_output"):
+        write_output('ToolOutput/toolOutput.xml', constraint)
 
 
 if __name__ == '__main__':
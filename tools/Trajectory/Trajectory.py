@@ -1,92 +1,336 @@
 """Tool used for the launcher trajectory. It is calculated the maximum payload mass the rocket can lift to
 a given circular orbit."""
 
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from launcher import worker_client
+
+if __name__ == '__main__':    # Run by the warm worker if there is one (see launcher.worker)
+    worker_client.forward("Trajectory")
+
 from lxml import etree
 import numpy as np
 from scipy.integrate import solve_ivp
-from ambiance import Atmosphere
+from scipy.optimize import OptimizeResult
+
+from launcher import atmosphere
+from launcher.payload_hints import PayloadHintCache
+from launcher import model
+from launcher import profiling
+from launcher import trajectory_encoding
+from launcher import result_cache
+
+# Minimum number of solver steps per integration. The altitude events are only detected at the end of the
+# solver steps, so longer steps could step over a crossing near the apex of the trajectory.
+MIN_SOLVER_STEPS = 50
+
+# Solver tolerances of the smooth payload search. With the default ones the margin changes in small jumps with
+# the design, as the solver takes different steps, which is noise for finite differences. The absolute tolerance
+# matters near the apex of the heavy trajectories, where the velocity is close to zero
+SMOOTH_SOLVER_TOLERANCES = {"rtol": 1e-12, "atol": 1e-9}
+
+G = 9.81
+
+# Integrated flight phases: altitude at which the phase ends, angle of attack and flight path angle
+PHASES = [(10000, 0, 90 * np.pi / 180),
+          (100000, 5 * np.pi / 180, 135 * np.pi / 180)]
+
+# Orbit minimum speed
+MU = 3.986004418e14
+R_EARTH = 6378e3
+H_ORBIT = 400e3
+V_ORBIT = (MU / (R_EARTH + H_ORBIT)) ** 0.5
+
+# Drag loss of the analytic (low-fidelity) trajectory: LOW_FIDELITY_DRAG_LOSS * s * cd / m_liftoff +
+# LOW_FIDELITY_OFFSET (m/s), fitted with calibrate_low_fidelity on the three example launchers
+LOW_FIDELITY_DRAG_LOSS = 2.67e6
+LOW_FIDELITY_OFFSET = 3.76
 
 
 def read_input(path):
     """Inputs from the XML file are read."""
 
-    cone_angle = 0
-    length_ratio = 0
-
-    tree = etree.parse(path)
-    root = tree.getroot()
+    return read_model(model.read(path))
 
-    shape = root.xpath("Geometry/Head_shape/text()")[0]
 
-    if shape == "Cone":
-        cone_angle = float(root.xpath("Geometry/Cone_angle/text()")[0])
-    elif shape == "Elliptical":
-        length_ratio = float(root.xpath("Geometry/L_ratio_ellipse/text()")[0])
+def read_model(launcher):
+    """Inputs from a launcher model (launcher.model) are read."""
 
-    diameter = float(root.xpath("Geometry/Diameter/text()")[0])
+    cone_angle = 0
+    length_ratio = 0
 
-    stages = root.xpath("Stage")
+    if launcher.head_shape == "Cone":
+        cone_angle = launcher.cone_angle
+    elif launcher.head_shape == "Elliptical":
+        length_ratio = launcher.l_ratio
 
     T_stages = []
     m_structural_stages = []
     mp_stages = []
     mdot_stages = []
 
-    for stage in stages:
-        T_stages.append(float(stage.xpath("Engines/Thrust/text()")[0]))
-        mdot_stages.append(float(stage.xpath("Engines/mdot/text()")[0]))
-
-        try:  # Liquid
-            m_pumps = float(stage.xpath("Mass/Pumps/text()")[0])
-            m_hydrogen = float(stage.xpath("Mass/Hydrogen/text()")[0])
-            m_lox = float(stage.xpath("Mass/LOX/text()")[0])
-            m_tanks = float(stage.xpath("Mass/Tanks/text()")[0])
-            m_insulation = float(stage.xpath("Mass/Insulation/text()")[0])
-            m_structure = m_pumps + m_tanks + m_insulation
-            m_p = m_hydrogen + m_lox
-        except IndexError:  # solid
-            m_propellant = float(stage.xpath("Mass/Propellant/text()")[0])
-            m_casing = float(stage.xpath("Mass/Casing/text()")[0])
-            m_structure = m_casing
-            m_p = m_propellant
-
-        try:
-            m_structure = m_structure + float(stage.xpath("Mass/Structure/text()")[0])
-        except IndexError:
-            pass
+    for stage in launcher.stages:
+        T_stages.append(stage.thrust)
+        mdot_stages.append(stage.mdot)
+
+        if stage.pumps is not None:  # Liquid
+            m_structure = stage.pumps + stage.tanks + stage.insulation
+            m_p = stage.hydrogen + stage.lox
+        else:  # solid
+            m_structure = stage.casing
+            m_p = stage.propellant
+
+        if stage.structure is not None:
+            m_structure = m_structure + stage.structure
 
         m_structural_stages.append(m_structure)
         mp_stages.append(m_p)
 
-    return cone_angle, length_ratio, diameter, T_stages, m_structural_stages, mp_stages, mdot_stages
+    return cone_angle, length_ratio, launcher.diameter, T_stages, m_structural_stages, mp_stages, mdot_stages
+
+
+def calculate(cone_angle, length_ratio, diameter, T_stages, m_structural_stages, mp_stages, mdot_stages,
+              payload_search="bracket", payload_tolerance=1.0, atmosphere_model="table", hint_cache=None,
+              fidelity="ode", payload=None, track_max_q=False, max_q_abort=None, output_sampling="count",
+              output_points=500, output_spacing=1.0, output_tolerance=1e-3):
+    """Calculation of the launcher trajectory. The maximum payload mass is found as the root of the orbital
+    velocity margin (v_final - v_orbit). Two search modes are available:
+
+    - "bracket": the root is bracketed and then refined with the Illinois (regula falsi) method until the
+      bracket is narrower than payload_tolerance (kg).
+    - "scan": the payload is increased in steps of 100 kg until the orbit is no longer reached. It is kept
+      as a reference for regression.
+    - "smooth": the root of the margin itself (see smooth_payload), integrated with tight solver tolerances,
+      so that the payload is a smooth function of the design for finite differences (launcher.sensitivity).
+
+    Any number of stages is supported. The air density is taken from the shared atmosphere module, either
+    interpolated from its precomputed table (atmosphere_model="table") or from ambiance ("ambiance").
 
+    A launcher.payload_hints.PayloadHintCache can be given as hint_cache to start the bracketing search from
+    the payload of a similar design of the same architecture, and to store the result for the next ones.
 
-def calculate(cone_angle, length_ratio, diameter, T_stages, m_structural_stages, mp_stages, mdot_stages):
-    """Calculation of the launcher trajectory."""
+    With fidelity="analytic" the trajectory equations are not integrated: the low-fidelity model of
+    simulate_analytic_batch is used instead, with the bracketing search and coarse height and velocity
+    vectors. The search mode, atmosphere model and hint cache only apply to the full model ("ode").
+
+    If a payload is given the search is skipped and the trajectory is integrated for that payload only.
+
+    With track_max_q=True the peak dynamic pressure (0.5 * rho * v^2) is tracked during the integration: its
+    local maxima are located with a solver event on its time derivative. A fourth output is then returned, a
+    tuple (q_max, altitude, time) with the peak of the trajectory of the returned payload (time from lift-off).
+    The interpolated payload of the smooth search is then simulated once more, and its vectors are returned.
+    With max_q_abort (Pa) the integration stops as soon as the dynamic pressure exceeds it, which is enough
+    for feasibility-only runs with a given payload (the returned peak is then max_q_abort). In a payload
+    search the aborted trajectories count as not reaching the orbit.
+
+    The height and velocity vectors are sampled in each integration (stage burn and phase) with one of the
+    output_sampling modes:
+
+    - "count": output_points evenly spaced points (the original 500 by default).
+    - "spacing": evenly spaced points at most output_spacing seconds apart.
+    - "adaptive": points placed where the trajectory bends (see adaptive_samples), so that the linear
+      interpolation of the height, velocity and dynamic pressure is within output_tolerance of the solution,
+      relative to the largest value of each in the integration. The peak dynamic pressure of the vectors is
+      within output_tolerance of the exact one, with 5 to 10 times fewer points than the default.
+
+    The sampling does not change the solver steps, so the payload is the same in every mode."""
+
+    if fidelity == "analytic":
+        if track_max_q or max_q_abort is not None or payload is not None:
+            raise ValueError("The analytic trajectory only supports the payload search")
+        design = (cone_angle, length_ratio, diameter, T_stages, m_structural_stages, mp_stages, mdot_stages)
+        return calculate_batch([design], payload_tolerance, fidelity="analytic")[0]
+    elif fidelity != "ode":
+        raise ValueError("Unknown fidelity: {FIDELITY}".format(FIDELITY=fidelity))
 
     def modified_atmosphere(x):
 
-        if 80000 > x > 0:
-            rho = Atmosphere(x).density
-        else:
-            rho = Atmosphere(80000).density
+        return atmosphere.density(x, atmosphere_model)
 
-        return rho
+    modified_atmosphere = profiling.counted(modified_atmosphere, "Trajectory.atmosphere_lookups")
 
-    def first_stage(t, y):    # Trajectory equation
+    cd = drag_coefficient(cone_angle, length_ratio)
+    s = np.pi + diameter ** 2 / 4
+    stages_max = len(T_stages) - 1
 
-        x = y[0]
-        v = y[1]
+    def stage_properties(stage):
+        """Thrust, initial mass (without payload), mass flow and propellant mass of a stage."""
 
-        return [v, T / ((m0 + mpay) - mdot * t) * np.cos(alpha) - 1 / 2 / (
-                (m0 + mpay) - mdot * t) * s * cd * modified_atmosphere(x) * v ** 2 - g * np.sin(gamma)]
+        m0 = sum(m_structural_stages[stage:]) + sum(mp_stages[stage:])
 
-    mpay = 0
-    feasible = 1
-    h_vector = []
-    v_vector = []
+        return T_stages[stage], m0, mdot_stages[stage], mp_stages[stage]
+
+    peaks = {}    # Peak dynamic pressure of the trajectory of each simulated payload
+    solver_tolerances = SMOOTH_SOLVER_TOLERANCES if payload_search == "smooth" else {}
+
+    def simulate(mpay):
+        """Trajectory for a given payload mass. It returns the orbital velocity margin (None if the rocket
+        does not reach the altitude of every integrated phase) and the height and velocity vectors."""
+
+        def trajectory_equation(t, y):
+
+            x = y[0]
+            v = y[1]
+
+            return [v, T / ((m0 + mpay) - mdot * t) * np.cos(alpha) - 1 / 2 / (
+                    (m0 + mpay) - mdot * t) * s * cd * modified_atmosphere(x) * v ** 2 - G * np.sin(gamma)]
+
+        def altitude_reached(t, y):    # The phase ends when its altitude is crossed upwards
+
+            return y[0] - altitude
+
+        altitude_reached.terminal = True
+        altitude_reached.direction = 1
+
+        def dynamic_pressure(y):
+
+            return 0.5 * modified_atmosphere(y[0]) * y[1] ** 2
+
+        def dynamic_pressure_peak(t, y):    # Time derivative of the dynamic pressure, decreasing at its maxima
+
+            return 0.5 * modified_atmosphere(y[0]) * y[1] * (atmosphere.log_density_slope(y[0]) * y[1] ** 2 +
+                                                            2 * trajectory_equation(t, y)[1])
+
+        dynamic_pressure_peak.direction = -1
+
+        def dynamic_pressure_exceeded(t, y):
+
+            return dynamic_pressure(y) - max_q_abort
+
+        dynamic_pressure_exceeded.terminal = True
+        dynamic_pressure_exceeded.direction = 1
+
+        events = [altitude_reached]
+        if track_max_q:
+            events.append(dynamic_pressure_peak)
+        if max_q_abort is not None:
+            events.append(dynamic_pressure_exceeded)
+
+        h_vector = []
+        v_vector = []
+        peak = (0.0, 0.0, 0.0)
+        t_start = 0    # Time from lift-off at the start of the integration
+
+        stage = 0
+        T, m0, mdot, mp_remaining = stage_properties(stage)
+        y0 = [0, 0]
+
+        for phase, (altitude, alpha, gamma) in enumerate(PHASES):
+            while True:
+                # The integration ends either at the phase altitude or at the stage burnout
+                tfinal = mp_remaining / mdot - 5
+                if tfinal <= 0:    # Less than 5 s of burn left: burnout at the start of the integration
+                    sol = burnout(y0, len(events))
+                    y_output = sol.y
+                else:
+                    with profiling.span("Trajectory.integration", "trajectory", phase=phase + 1, stage=stage + 1):
+                        if output_sampling == "adaptive":
+                            sol = solve_ivp(fun=trajectory_equation, t_span=[0, tfinal], y0=y0, dense_output=True,
+                                            events=events, max_step=tfinal / MIN_SOLVER_STEPS,
+                                            **solver_tolerances)
+                            y_output = sol.sol(adaptive_samples(sol.sol, sol.t[-1], output_tolerance))
+                        else:
+                            t = output_times(tfinal, output_sampling, output_points, output_spacing)
+                            sol = solve_ivp(fun=trajectory_equation, t_span=[t[0], t[-1]], y0=y0, t_eval=t,
+                                            events=events, max_step=tfinal / MIN_SOLVER_STEPS,
+                                            **solver_tolerances)
+                            y_output = sol.y
+                    profiling.count("Trajectory.solve_ivp_calls")
+                    profiling.count("Trajectory.rhs_evaluations", sol.nfev)
+                h_vector.extend(y_output[0].tolist())
+                v_vector.extend(y_output[1].tolist())
+
+                if track_max_q or max_q_abort is not None:
+                    # The peak is either a local maximum or one of the ends of the integration
+                    candidates = [(0, y0), (sol.t[-1], sol.y[:, -1])]
+                    for t_events, y_events in zip(sol.t_events, sol.y_events):
+                        candidates.extend(zip(t_events, y_events))
+                    for t_candidate, y_candidate in candidates:
+                        q = dynamic_pressure(y_candidate)
+                        if q > peak[0]:
+                            peak = (float(q), float(y_candidate[0]), float(t_start + t_candidate))
+                    peaks[mpay] = peak
+
+                    if max_q_abort is not None and sol.t_events[-1].size > 0:    # Max dynamic pressure exceeded
+                        peaks[mpay] = (max_q_abort, float(sol.y_events[-1][0][0]),
+                                       float(t_start + sol.t_events[-1][0]))
+                        return None, h_vector, v_vector
+
+                if sol.status == 1:    # Phase altitude reached. The stage keeps burning in the next phase
+                    t_0 = sol.t_events[0][0]
+                    y0 = sol.y_events[0][0]
+                    m0 = m0 - mdot * t_0
+                    mp_remaining = mp_remaining - mdot * t_0
+                    t_start = t_start + t_0
+                    break
+
+                if sol.status != 0 or stage == stages_max:    # No more stages available
+                    return None, h_vector, v_vector
+
+                stage = stage + 1    # Staging
+                T, m0, mdot, mp_remaining = stage_properties(stage)
+                y0 = sol.y[:, -1]
+                t_start = t_start + sol.t[-1]
+
+        # Last phase. The remaining propellant of the current stage and the upper stages are burnt
+        v_0 = y0[1]
+        delta_v = T / mdot * np.log((m0 + mpay) / (m0 + mpay - mp_remaining))
+        v_final = v_0 / 2 + delta_v
+
+        for upper_stage in range(stage + 1, stages_max + 1):
+            T, m0, mdot, mp_stage = stage_properties(upper_stage)
+            tfinal = mp_stage / mdot
+            delta_v = T / ((m0 + mpay) - mdot * tfinal) * tfinal
+            v_final = v_final + delta_v
+
+        return v_final - V_ORBIT, h_vector, v_vector
+
+    simulate = profiling.counted(simulate, "Trajectory.payload_simulations")
+
+    if payload is not None:
+        mpay = payload
+        margin, h_vector, v_vector = simulate(mpay)
+    elif payload_search == "scan":
+        mpay, h_vector, v_vector = scan_payload(simulate)
+    elif payload_search == "smooth":
+        mpay, h_vector, v_vector = smooth_payload(simulate, payload_tolerance)
+    elif payload_search == "bracket" and hint_cache is None:
+        mpay, h_vector, v_vector = bracket_payload(simulate, payload_tolerance)
+    elif payload_search == "bracket":
+        design = (cone_angle, length_ratio, diameter, T_stages, m_structural_stages, mp_stages, mdot_stages)
+        bracket = hint_cache.lookup(design)
+        payloads_simulated = []
+
+        def simulate_counted(mpay):
+            payloads_simulated.append(mpay)
+            return simulate(mpay)
+
+        mpay, h_vector, v_vector = bracket_payload(simulate_counted, payload_tolerance, bracket=bracket)
+        hint_cache.store(design, mpay, len(payloads_simulated), warm=bracket is not None)
+    else:
+        raise ValueError("Unknown payload search mode: {MODE}".format(MODE=payload_search))
+
+    if track_max_q:
+        if mpay not in peaks:    # Interpolated payload of the smooth search, not simulated yet
+            margin, h_vector, v_vector = simulate(mpay)
+        return mpay, h_vector, v_vector, peaks[mpay]
+
+    return mpay, h_vector, v_vector
+
+
+def burnout(y0, n_events):
+    """Result of an integration with no burn time left (solve_ivp fields): the initial state only, no events."""
+
+    return OptimizeResult(t=np.zeros(1), y=np.array(y0, dtype=float).reshape(2, 1), status=0, nfev=0,
+                          t_events=[np.zeros(0)] * n_events, y_events=[np.zeros((0, 2))] * n_events)
+
+
+def drag_coefficient(cone_angle, length_ratio):
+    """Drag coefficient calculation depending on head shape."""
 
-    # Drag coefficient calculation depending on head shape
     if cone_angle > 0:
         cd = 0.0122 * cone_angle + 0.162
     elif length_ratio > 0:
@@ -95,217 +339,674 @@ def calculate(cone_angle, length_ratio, diameter, T_stages, m_structural_stages,
     else:
         cd = 0.42
 
-    s = np.pi + diameter ** 2 / 4
-    stages_max = len(T_stages) - 1
+    return cd
 
-    # Start of the loop for the maximum payload mass calculation
-    while feasible == 1:
-        try:
-            # First stage
-            h_first = []
-            v_first = []
-            stage = 0
-            T = T_stages[stage]
-            gamma = 90 * np.pi / 180
-            alpha = 0
-            m_unloaded = sum(m_structural_stages[stage:])
-            m0 = m_unloaded + sum(mp_stages[stage:])
-            mdot = mdot_stages[stage]
-
-            g = 9.81
-            tfinal = mp_stages[stage] / mdot - 5
-            t = np.linspace(0, tfinal, 500)
-            sol = solve_ivp(fun=first_stage, t_span=[t[0], t[-1]], y0=[0, 0], t_eval=t)
-            h = sol.y[0]
-            v = sol.y[1]
-            pos, = np.where(h > 10000)
-
-            if len(pos) == 0 and stage < stages_max:  # This means that a second rocket stage is available and needed
-                h_first.append(h.tolist())
-                v_first.append(v.tolist())
-                stage = stage + 1
-                T = T_stages[stage]
-                m_unloaded = sum(m_structural_stages[stage:])
-                m0 = m_unloaded + sum(mp_stages[stage:])
-                mdot = mdot_stages[stage]
-                tfinal = mp_stages[stage] / mdot - 5
-                t = np.linspace(0, tfinal, 500)
-                sol = solve_ivp(fun=first_stage, t_span=[t[0], t[-1]], y0=[h[-1], v[-1]], t_eval=t)
-                h = sol.y[0]
-                v = sol.y[1]
-                pos, = np.where(h > 10000)
-                if len(pos) == 0 and stage < stages_max:  # This means that a third rocket stage is available and needed
-                    h_first.append(h.tolist())
-                    v_first.append(v.tolist())
-                    stage = stage + 1
-                    T = T_stages[stage]
-                    m_unloaded = sum(m_structural_stages[stage:])
-                    m0 = m_unloaded + sum(mp_stages[stage:])
-                    mdot = mdot_stages[stage]
-                    tfinal = mp_stages[stage] / mdot - 5
-                    t = np.linspace(0, tfinal, 500)
-                    sol = solve_ivp(fun=first_stage, t_span=[t[0], t[-1]], y0=[h[-1], v[-1]], t_eval=t)
-                    h = sol.y[0]
-                    v = sol.y[1]
-                    pos, = np.where(h > 10000)
-                    if len(pos) == 0:
-                        h_first.append(h.tolist())
-                        v_first.append(v.tolist())
-                    else:
-                        h_append = h[0:pos[0]]
-                        v_append = v[0:pos[0]]
-                        h_first.append(h_append.tolist())
-                        v_first.append(v_append.tolist())
-                else:
-                    h_append = h[0:pos[0]]
-                    v_append = v[0:pos[0]]
-                    h_first.append(h_append.tolist())
-                    v_first.append(v_append.tolist())
-            elif len(pos) > 0:
-                h_append = h[0:pos[0]]
-                v_append = v[0:pos[0]]
-                h_first.append(h_append.tolist())
-                v_first.append(v_append.tolist())
-            else:
-                h_first.append(h.tolist())
-                v_first.append(v.tolist())
-
-            # Second stage
-            h_0 = h[pos[0]]
-            v_0 = v[pos[0]]
-            t_0 = t[pos[0]]
-            m0 = m0 - mdot * t_0
-            mp_remaining = mp_stages[stage] - mdot * t_0  # It could be that the previous stage did not finish
-            h_second = []
-            v_second = []
-
-            alpha = 5 * np.pi / 180
-            gamma = 135 * np.pi / 180
-
-            tfinal = mp_remaining / mdot - 5
-            t = np.linspace(0, tfinal, 500)
-            sol2 = solve_ivp(fun=first_stage, t_span=[t[0], t[-1]], y0=[h_0, v_0], t_eval=t)
-            h = sol2.y[0]
-            v = sol2.y[1]
-            pos2, = np.where(h > 100000)
-            if len(pos2) == 0 and stage < stages_max:  # This means that a second rocket stage is available and needed
-                h_second.append(h.tolist())
-                v_second.append(v.tolist())
-                stage = stage + 1
-                mp_remaining = mp_stages[stage]
-                T = T_stages[stage]
-                m_unloaded = sum(m_structural_stages[stage:])
-                m0 = m_unloaded + sum(mp_stages[stage:])
-                mdot = mdot_stages[stage]
-                tfinal = mp_stages[stage] / mdot - 5
-                t = np.linspace(0, tfinal, 500)
-                sol2 = solve_ivp(fun=first_stage, t_span=[t[0], t[-1]], y0=[h[-1], v[-1]], t_eval=t)
-                h = sol2.y[0]
-                v = sol2.y[1]
-                pos2, = np.where(h > 100000)
-                if len(pos2) == 0 and stage < stages_max:  # This means that a third rocket stage is available and needed
-                    h_second.append(h.tolist())
-                    v_second.append(v.tolist())
-                    stage = stage + 1
-                    mp_remaining = mp_stages[stage]
-                    T = T_stages[stage]
-                    m_unloaded = sum(m_structural_stages[stage:])
-                    m0 = m_unloaded + sum(mp_stages[stage:])
-                    mdot = mdot_stages[stage]
-                    tfinal = mp_stages[stage] / mdot - 5
-                    t = np.linspace(0, tfinal, 500)
-                    sol2 = solve_ivp(fun=first_stage, t_span=[t[0], t[-1]], y0=[h[-1], v[-1]], t_eval=t)
-                    h = sol2.y[0]
-                    v = sol2.y[1]
-                    pos2, = np.where(h > 100000)
-                    if len(pos2) == 0:
-                        h_second.append(h.tolist())
-                        v_second.append(v.tolist())
-                    else:
-                        h_append = h[0:pos2[0]]
-                        v_append = v[0:pos2[0]]
-                        h_second.append(h_append.tolist())
-                        v_second.append(v_append.tolist())
-                else:
-                    h_append = h[0:pos2[0]]
-                    v_append = v[0:pos2[0]]
-                    h_second.append(h_append.tolist())
-                    v_second.append(v_append.tolist())
-            elif len(pos2) > 0:
-                h_append = h[0:pos2[0]]
-                v_append = v[0:pos2[0]]
-                h_second.append(h_append.tolist())
-                v_second.append(v_append.tolist())
-            else:
-                h_second.append(h.tolist())
-                v_second.append(v.tolist())
-
-            # Third stage
-            v_0 = v[pos2[0]]
-            t_0 = t[pos2[0]]
-            m0 = m0 - mdot * t_0
-            mp_remaining = mp_remaining - mdot * t_0
-            delta_v = T / mdot * np.log((m0 + mpay) / (m0 + mpay - mp_remaining))
-            v_final = v_0 / 2 + delta_v
-
-            if stage < stages_max:
-                stage = stage + 1
-                T = T_stages[stage]
-                m_unloaded = sum(m_structural_stages[stage:])
-                m0 = m_unloaded + sum(mp_stages[stage:])
-                mdot = mdot_stages[stage]
-                tfinal = mp_stages[stage] / mdot
-                delta_v = T / ((m0 + mpay) - mdot * tfinal) * tfinal
-                v_final = v_final + delta_v
-                if stage < stages_max:    # More stages are available
-                    stage = stage + 1
-                    T = T_stages[stage]
-                    m_unloaded = sum(m_structural_stages[stage:])
-                    m0 = m_unloaded + sum(mp_stages[stage:])
-                    mdot = mdot_stages[stage]
-                    tfinal = mp_stages[stage] / mdot
-                    delta_v = T / ((m0 + mpay) - mdot * tfinal) * tfinal
-                    v_final = v_final + delta_v
-
-            # Orbit minimum speed
-            mu = 3.986004418e14
-            r_earth = 6378e3
-            h = 400e3
-            v_orbit = (mu / (r_earth + h)) ** 0.5
-
-            if v_final > v_orbit:    # It is checked if the rocket was able to reach the orbit
-                feasible = 1
-                mpay = mpay + 100
-                h1 = [item for sublist in h_first for item in sublist]
-                h2 = [item for sublist in h_second for item in sublist]
-                v1 = [item for sublist in v_first for item in sublist]
-                v2 = [item for sublist in v_second for item in sublist]
-                h_vector = h1 + h2
-                v_vector = v1 + v2
-            else:
-                feasible = 0
-        except IndexError:
-            feasible = 0
+
+def output_times(tfinal, output_sampling, output_points, output_spacing):
+    """Evenly spaced output times of an integration for the "count" and "spacing" sampling modes."""
+
+    if output_sampling == "count":
+        points = output_points
+    elif output_sampling == "spacing":
+        points = max(int(np.ceil(abs(tfinal) / output_spacing)) + 1, 2)
+    else:
+        raise ValueError("Unknown output sampling mode: {MODE}".format(MODE=output_sampling))
+
+    return np.linspace(0, tfinal, points)
+
+
+def adaptive_samples(solution, t_end, tolerance, coarse_points=9, max_levels=12):
+    """Output times of an integration between 0 and t_end chosen from its dense solution. Starting from
+    coarse_points evenly spaced times, the intervals whose midpoint is not reproduced by the linear
+    interpolation of the height, velocity and dynamic pressure (within tolerance, relative to the largest
+    value of each on the samples) are split, up to max_levels times."""
+
+    def profiles(times):
+        y = solution(times)
+        return np.vstack((y[0], y[1], 0.5 * atmosphere.density(y[0]) * y[1] ** 2))
+
+    t = np.linspace(0, t_end, coarse_points)
+    values = profiles(t)
+
+    for _ in range(max_levels):
+        scale = np.maximum(np.abs(values).max(axis=1, keepdims=True), 1e-12)
+        middle = (t[:-1] + t[1:]) / 2
+        values_middle = profiles(middle)
+        error = np.abs(values_middle - (values[:, :-1] + values[:, 1:]) / 2) / scale
+        split = (error > tolerance).any(axis=0)
+        if not split.any():
+            break
+        order = np.argsort(np.concatenate((t, middle[split])), kind="stable")
+        t = np.concatenate((t, middle[split]))[order]
+        values = np.concatenate((values, values_middle[:, split]), axis=1)[:, order]
+
+    return t
+
+
+def scan_payload(simulate):
+    """Original payload search. The payload is increased by 100 kg until the orbit is not reached. The
+    trajectory of the last attempt is returned if no payload can be lifted."""
+
+    mpay = 0
+    h_vector = []
+    v_vector = []
+
+    while True:
+        margin, h_attempt, v_attempt = simulate(mpay)
+        if margin is None or margin <= 0:
+            break
+        h_vector = h_attempt
+        v_vector = v_attempt
+        mpay = mpay + 100
 
     mpay = max(mpay - 100, 0)
 
     if mpay == 0:
-        h1 = [item for sublist in h_first for item in sublist]
-        v1 = [item for sublist in v_first for item in sublist]
-        try:
-            h2 = [item for sublist in h_second for item in sublist]
-            v2 = [item for sublist in v_second for item in sublist]
-            h_vector = h1 + h2
-            v_vector = v1 + v2
-        except:
-            h_vector = h1
-            v_vector = v1
+        h_vector = h_attempt
+        v_vector = v_attempt
 
     return mpay, h_vector, v_vector
 
 
-def write_output(path, mpay, h_vector, v_vector):
-    """Generation of the output XML file"""
+def smooth_payload(simulate, payload_tolerance):
+    """Payload search for derivatives. The bracketed payload is only known within payload_tolerance, so it
+    changes in steps with the design. The root of the margin is instead interpolated linearly in the final
+    bracket of bracket_payload, which is smooth. The vectors are the ones of the lower end of the bracket. If
+    the upper end does not reach the phase altitudes (no margin), the lower end is returned."""
+
+    margins = {}
+
+    def simulate_recorded(mpay):
+        margin, h_attempt, v_attempt = simulate(mpay)
+        margins[mpay] = margin
+        return margin, h_attempt, v_attempt
+
+    low, h_vector, v_vector = bracket_payload(simulate_recorded, payload_tolerance)
+    above = [mpay for mpay in margins if mpay > low]
+    if margins.get(low) is None or margins[low] <= 0 or not above or margins[min(above)] is None:
+        return low, h_vector, v_vector
+
+    high = min(above)
+    mpay = low + (high - low) * margins[low] / (margins[low] - margins[high])
+
+    return mpay, h_vector, v_vector
+
+
+def bracket_payload(simulate, payload_tolerance, step=1000, bracket=None):
+    """Payload search by root finding on the orbital velocity margin. The root is first bracketed
+    extrapolating the margin with secants from zero payload, and the bracket is then refined with the
+    Illinois method. Payloads for which the rocket does not reach the phase altitudes have no margin, so
+    they are bisected instead. The returned payload is always a feasible one (lower end of the bracket).
+
+    A starting bracket (low, high), for example from a similar design, can be given. If its lower end is
+    feasible the search starts from it, otherwise it starts from zero payload with the lower end as upper
+    bound."""
+
+    low = 0
+    high = step
+    bracketed = False
+
+    if bracket is not None and bracket[0] > 0:
+        margin, h_attempt, v_attempt = simulate(bracket[0])
+        if margin is not None and margin > 0:
+            low, margin_low, h_vector, v_vector = bracket[0], margin, h_attempt, v_attempt
+            high = max(bracket[1], low + payload_tolerance)
+        else:
+            high, margin_high, bracketed = bracket[0], margin, True
+
+    if low == 0:
+        margin_low, h_vector, v_vector = simulate(0)
+        if margin_low is None or margin_low <= 0:
+            return 0, h_vector, v_vector
+
+    # Bracketing of the maximum payload
+    while not bracketed:
+        margin_high, h_attempt, v_attempt = simulate(high)
+        if margin_high is None or margin_high <= 0:
+            bracketed = True
+        else:
+            slope = (margin_high - margin_low) / (high - low)
+            if slope < 0:    # Secant root estimate, overshot so that the attempt lies past the root
+                trial = high - 2 * margin_high / slope
+            else:
+                trial = high + 2 * (high - low)
+            low, margin_low, h_vector, v_vector = high, margin_high, h_attempt, v_attempt
+            high = min(max(trial, low + step), low + 8 * (low + step))
+
+    # Refinement of the bracket (Illinois method)
+    retained = None
+    while high - low > payload_tolerance:
+        if margin_high is None:
+            trial = (low + high) / 2
+        else:
+            trial = low + (high - low) * margin_low / (margin_low - margin_high)
+            trial = min(max(trial, low + payload_tolerance / 2), high - payload_tolerance / 2)
+
+        margin, h_attempt, v_attempt = simulate(trial)
+
+        if margin is not None and margin > 0:
+            if retained == "high" and margin_high is not None:
+                margin_high = margin_high / 2
+            low, margin_low, h_vector, v_vector = trial, margin, h_attempt, v_attempt
+            retained = "high"
+        else:
+            if retained == "low":
+                margin_low = margin_low / 2
+            high, margin_high = trial, margin
+            retained = "low"
+
+    return low, h_vector, v_vector
+
+
+def pack_designs(designs):
+    """Arrays with the trajectory inputs of several designs, padded to the largest number of stages. Each design
+    is a tuple with the inputs of calculate (cone_angle, length_ratio, diameter, T_stages, m_structural_stages,
+    mp_stages, mdot_stages). The initial mass of each stage (without payload) is stored instead of its
+    structural mass."""
+
+    n_designs = len(designs)
+    n_stages = np.array([len(design[3]) for design in designs])
+    stages_max = n_stages.max()
+
+    cd = np.array([drag_coefficient(design[0], design[1]) for design in designs])
+    s = np.array([np.pi + design[2] ** 2 / 4 for design in designs])
+
+    thrust = np.zeros((n_designs, stages_max))
+    m0 = np.zeros((n_designs, stages_max))
+    mdot = np.ones((n_designs, stages_max))    # Padded with ones to avoid divisions by zero
+    mp = np.zeros((n_designs, stages_max))
+
+    for row, design in enumerate(designs):
+        n = n_stages[row]
+        thrust[row, :n] = design[3]
+        mp[row, :n] = design[5]
+        mdot[row, :n] = design[6]
+        stage_masses = np.array(design[4], dtype=float) + np.array(design[5], dtype=float)
+        m0[row, :n] = np.cumsum(stage_masses[::-1])[::-1]
+
+    return n_stages, cd, s, thrust, m0, mdot, mp
+
+
+def simulate_batch(packed, mpay, steps=50, record=False):
+    """Trajectories of several designs (or payload candidates) integrated at once. All the rows advance
+    together with a fixed-step Runge-Kutta (RK4) scheme that takes the given number of steps per stage burn
+    and phase. Each row keeps its own stage, phase and step size, and masks select the rows that cross a phase
+    altitude (the crossing is located with a cubic Hermite interpolation of the step and reached with a
+    partial step), burn out (staging or end of the row) or keep integrating.
+
+    It returns the orbital velocity margin of each row (NaN if the phase altitudes are not reached) and, if
+    record is True, the height and velocity vectors of each row. With steps=499 the vectors are sampled on
+    the same 500 points per integration as the ones of calculate."""
+
+    n_stages, cd, s, thrust_table, m0_table, mdot_table, mp_table = packed
+    n_designs = len(cd)
+    mpay = np.broadcast_to(np.asarray(mpay, dtype=float), (n_designs,))
+
+    altitudes = np.array([altitude for altitude, alpha, gamma in PHASES])
+    cos_alpha = np.array([np.cos(alpha) for altitude, alpha, gamma in PHASES])
+    sin_gamma = np.array([np.sin(gamma) for altitude, alpha, gamma in PHASES])
+
+    # State of each row
+    stage = np.zeros(n_designs, dtype=int)
+    phase = np.zeros(n_designs, dtype=int)
+    h = np.zeros(n_designs)
+    v = np.zeros(n_designs)
+    t = np.zeros(n_designs)
+    step = np.zeros(n_designs, dtype=int)
+    thrust = thrust_table[:, 0].copy()
+    m0 = m0_table[:, 0].copy()
+    mdot = mdot_table[:, 0].copy()
+    mp_remaining = mp_table[:, 0].copy()
+    dt = (mp_remaining / mdot - 5) / steps
+    active = np.ones(n_designs, dtype=bool)
+
+    recorded_rows = []
+    recorded_h = []
+    recorded_v = []
+
+    while active.any():
+        rows = np.flatnonzero(active)
+        t_i, h_i, v_i, dt_i = t[rows], h[rows], v[rows], dt[rows]
+        mass_i = m0[rows] + mpay[rows]
+        mdot_i = mdot[rows]
+        thrust_i = thrust[rows] * cos_alpha[phase[rows]]
+        drag_i = 0.5 * s[rows] * cd[rows]
+        weight_i = G * sin_gamma[phase[rows]]
+
+        def acceleration(time, height, velocity, select=slice(None)):
+            return (thrust_i[select] - drag_i[select] * atmosphere.density(height) * velocity ** 2) / (
+                    mass_i[select] - mdot_i[select] * time) - weight_i[select]
+
+        def rk4_step(time, height, velocity, delta, select=slice(None)):
+            k1_h = velocity
+            k1_v = acceleration(time, height, velocity, select)
+            k2_h = velocity + delta / 2 * k1_v
+            k2_v = acceleration(time + delta / 2, height + delta / 2 * k1_h, k2_h, select)
+            k3_h = velocity + delta / 2 * k2_v
+            k3_v = acceleration(time + delta / 2, height + delta / 2 * k2_h, k3_h, select)
+            k4_h = velocity + delta * k3_v
+            k4_v = acceleration(time + delta, height + delta * k3_h, k4_h, select)
+            return height + delta / 6 * (k1_h + 2 * k2_h + 2 * k3_h + k4_h), \
+                velocity + delta / 6 * (k1_v + 2 * k2_v + 2 * k3_v + k4_v)
+
+        if record:
+            recorded_rows.append(rows)
+            recorded_h.append(h_i)
+            recorded_v.append(v_i)
+
+        h_new, v_new = rk4_step(t_i, h_i, v_i, dt_i)
+
+        altitude_i = altitudes[phase[rows]]
+        crossed = (h_i <= altitude_i) & (h_new > altitude_i)
+        burnout = ~crossed & (step[rows] + 1 >= steps)
+        advance = ~crossed & ~burnout
+
+        # Rows that keep integrating the same stage and phase
+        advancing = rows[advance]
+        h[advancing] = h_new[advance]
+        v[advancing] = v_new[advance]
+        t[advancing] = t_i[advance] + dt_i[advance]
+        step[advancing] = step[advancing] + 1
+
+        # Rows that reach the phase altitude. The stage keeps burning in the next phase
+        if crossed.any():
+            crossing = rows[crossed]
+            theta = hermite_crossing(h_i[crossed], h_new[crossed], v_i[crossed] * dt_i[crossed],
+                                     v_new[crossed] * dt_i[crossed], altitude_i[crossed])
+            t_event = t_i[crossed] + theta * dt_i[crossed]
+            h[crossing], v[crossing] = rk4_step(t_i[crossed], h_i[crossed], v_i[crossed], theta * dt_i[crossed],
+                                                crossed)
+            m0[crossing] = m0[crossing] - mdot[crossing] * t_event
+            mp_remaining[crossing] = mp_remaining[crossing] - mdot[crossing] * t_event
+            phase[crossing] = phase[crossing] + 1
+
+            finished = phase[crossing] == len(PHASES)
+            active[crossing[finished]] = False
+            next_phase = crossing[~finished]
+            t[next_phase] = 0
+            step[next_phase] = 0
+            dt[next_phase] = (mp_remaining[next_phase] / mdot[next_phase] - 5) / steps
+
+        # Rows whose stage burns out. The next stage is ignited if available
+        if burnout.any():
+            burning_out = rows[burnout]
+            h[burning_out] = h_new[burnout]
+            v[burning_out] = v_new[burnout]
+            if record:
+                recorded_rows.append(burning_out)
+                recorded_h.append(h_new[burnout])
+                recorded_v.append(v_new[burnout])
+
+            last_stage = stage[burning_out] == n_stages[burning_out] - 1
+            active[burning_out[last_stage]] = False
+
+            staging = burning_out[~last_stage]
+            stage[staging] = stage[staging] + 1
+            thrust[staging] = thrust_table[staging, stage[staging]]
+            m0[staging] = m0_table[staging, stage[staging]]
+            mdot[staging] = mdot_table[staging, stage[staging]]
+            mp_remaining[staging] = mp_table[staging, stage[staging]]
+            t[staging] = 0
+            step[staging] = 0
+            dt[staging] = (mp_remaining[staging] / mdot[staging] - 5) / steps
+
+    # Last phase. The remaining propellant of the current stage and the upper stages are burnt
+    feasible = phase == len(PHASES)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        v_final = v / 2 + thrust / mdot * np.log((m0 + mpay) / (m0 + mpay - mp_remaining))
+        for upper_stage in range(thrust_table.shape[1]):
+            burnt = feasible & (upper_stage > stage) & (upper_stage < n_stages)
+            tfinal = mp_table[:, upper_stage] / mdot_table[:, upper_stage]
+            delta_v = thrust_table[:, upper_stage] / ((m0_table[:, upper_stage] + mpay) - mdot_table[:, upper_stage]
+                                                      * tfinal) * tfinal
+            v_final = v_final + np.where(burnt, delta_v, 0)
+    margin = np.where(feasible, v_final - V_ORBIT, np.nan)
+
+    if not record:
+        return margin
+
+    rows = np.concatenate(recorded_rows)
+    order = np.argsort(rows, kind="stable")
+    splits = np.cumsum(np.bincount(rows, minlength=n_designs))[:-1]
+    h_vectors = [heights.tolist() for heights in np.split(np.concatenate(recorded_h)[order], splits)]
+    v_vectors = [velocities.tolist() for velocities in np.split(np.concatenate(recorded_v)[order], splits)]
+
+    return margin, h_vectors, v_vectors
+
+
+def hermite_crossing(h0, h1, dh0, dh1, altitude):
+    """Fraction of the step (0 to 1) at which the cubic Hermite interpolation of the height crosses the
+    altitude. dh0 and dh1 are the height derivatives multiplied by the step size."""
+
+    theta = np.clip((altitude - h0) / (h1 - h0), 0, 1)    # Linear estimate refined with Newton iterations
+    for _ in range(4):
+        theta2 = theta * theta
+        theta3 = theta2 * theta
+        height = (2 * theta3 - 3 * theta2 + 1) * h0 + (theta3 - 2 * theta2 + theta) * dh0 + \
+            (-2 * theta3 + 3 * theta2) * h1 + (theta3 - theta2) * dh1
+        slope = (6 * theta2 - 6 * theta) * h0 + (3 * theta2 - 4 * theta + 1) * dh0 + \
+            (-6 * theta2 + 6 * theta) * h1 + (3 * theta2 - 2 * theta) * dh1
+        theta = np.clip(theta - (height - altitude) / np.where(slope > 0, slope, np.inf), 0, 1)
+
+    return theta
+
+
+def segment_state(t, h0, v0, mass, mdot, exhaust_velocity, gravity):
+    """Closed-form height and velocity after burning t seconds with constant thrust direction and without
+    drag: Tsiolkovsky delta-v minus the gravity loss. mass is the initial mass, exhaust_velocity the
+    exhaust velocity projected on the trajectory and gravity the gravity component along the trajectory."""
+
+    u = 1 - mdot * t / mass
+    log_u = np.log(u)
+    v = v0 - exhaust_velocity * log_u - gravity * t
+    h = h0 + v0 * t - gravity * t ** 2 / 2 + exhaust_velocity * mass / mdot * (u * log_u - u + 1)
+
+    return h, v
+
+
+def bisect_batch(function, low, high, iterations=40):
+    """Root of an increasing function between low and high, for every row at once."""
+
+    for _ in range(iterations):
+        middle = (low + high) / 2
+        above = function(middle) > 0
+        high = np.where(above, middle, high)
+        low = np.where(above, low, middle)
+
+    return (low + high) / 2
+
+
+def simulate_analytic_batch(packed, mpay, samples=10, record=False, drag_loss=None):
+    """Low-fidelity version of simulate_batch. Every stage burn of the integrated phases is solved in closed
+    form without drag (Tsiolkovsky delta-v minus the gravity loss), the phase altitude crossings are found
+    with bisections on the closed-form height, and the drag loss is added afterwards as a correction of the
+    orbital velocity margin calibrated against the full model (see calibrate_low_fidelity). drag_loss
+    overrides the calibrated coefficients (LOW_FIDELITY_DRAG_LOSS, LOW_FIDELITY_OFFSET).
+
+    For launchers close to the examples the maximum payload is within 1 % of the full model. Launchers that barely
+    reach the phase altitudes are the least accurate (up to about 15 % too optimistic), since the drag is not
+    taken into account to reach them.
+
+    It returns the orbital velocity margin of each row (NaN if the phase altitudes are not reached) and, if
+    record is True, coarse height and velocity vectors with the given number of samples per stage burn."""
+
+    n_stages, cd, s, thrust_table, m0_table, mdot_table, mp_table = packed
+    n_designs = len(cd)
+    mpay = np.broadcast_to(np.asarray(mpay, dtype=float), (n_designs,))
+    rows = np.arange(n_designs)
+
+    stage = np.zeros(n_designs, dtype=int)
+    h = np.zeros(n_designs)
+    v = np.zeros(n_designs)
+    m0 = m0_table[:, 0].copy()
+    mp_remaining = mp_table[:, 0].copy()
+    active = np.ones(n_designs, dtype=bool)
+
+    recorded_rows = []
+    recorded_h = []
+    recorded_v = []
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for altitude, alpha, gamma in PHASES:
+            reached = ~active
+            while not reached.all():
+                thrust = thrust_table[rows, stage]
+                mdot = mdot_table[rows, stage]
+                mass = m0 + mpay
+                exhaust_velocity = thrust / mdot * np.cos(alpha)
+                gravity = G * np.sin(gamma)
+                tfinal = np.maximum(mp_remaining / mdot - 5, 0)
+
+                def height(t):
+                    return segment_state(t, h, v, mass, mdot, exhaust_velocity, gravity)[0]
+
+                def velocity(t):
+                    return segment_state(t, h, v, mass, mdot, exhaust_velocity, gravity)[1]
+
+                # The acceleration increases with time, so the velocity has its minimum at t_min. The height
+                # increases up to the first zero of the velocity and after the second one
+                t_min = np.clip((mass - exhaust_velocity * mdot / gravity) / mdot, 0, tfinal)
+                v_min = velocity(t_min)
+                t_peak = t_min
+                falling = (v > 0) & (v_min < 0)
+                if falling.any():
+                    t_peak = np.where(falling, bisect_batch(lambda t: -velocity(t), 0, t_min), t_min)
+                t_valley = np.where(v_min >= 0, t_min, tfinal)
+                rising = (v_min < 0) & (velocity(tfinal) > 0)
+                if rising.any():
+                    t_valley = np.where(rising, bisect_batch(velocity, t_min, tfinal), t_valley)
+
+                crossing_rising = (v > 0) & (height(t_peak) > altitude) & (h <= altitude)
+                crossing_late = ~crossing_rising & (height(tfinal) > altitude) & (height(t_valley) <= altitude)
+                crossed = ~reached & (crossing_rising | crossing_late)
+                t_end = tfinal
+                if crossed.any():
+                    t_cross = bisect_batch(lambda t: height(t) - altitude, np.where(crossing_rising, 0, t_valley),
+                                           np.where(crossing_rising, t_peak, tfinal))
+                    t_end = np.where(crossed, t_cross, tfinal)
+
+                if record:
+                    for fraction in np.linspace(0, 1, samples):
+                        h_sample, v_sample = segment_state(t_end * fraction, h, v, mass, mdot, exhaust_velocity,
+                                                           gravity)
+                        recorded_rows.append(rows[~reached])
+                        recorded_h.append(h_sample[~reached])
+                        recorded_v.append(v_sample[~reached])
+
+                h_end, v_end = segment_state(t_end, h, v, mass, mdot, exhaust_velocity, gravity)
+                burning = ~reached
+                h = np.where(burning, h_end, h)
+                v = np.where(burning, v_end, v)
+                m0 = np.where(crossed, m0 - mdot * t_end, m0)
+                mp_remaining = np.where(crossed, mp_remaining - mdot * t_end, mp_remaining)
+                reached = reached | crossed
+
+                burnout = ~reached
+                last_stage = burnout & (stage == n_stages - 1)
+                active = active & ~last_stage
+                reached = reached | last_stage
+                staging = burnout & ~last_stage
+                stage = np.where(staging, stage + 1, stage)
+                m0 = np.where(staging, m0_table[rows, stage], m0)
+                mp_remaining = np.where(staging, mp_table[rows, stage], mp_remaining)
+
+        # Last phase, as in simulate_batch, with the calibrated drag loss
+        thrust = thrust_table[rows, stage]
+        mdot = mdot_table[rows, stage]
+        v_final = v / 2 + thrust / mdot * np.log((m0 + mpay) / (m0 + mpay - mp_remaining))
+        for upper_stage in range(thrust_table.shape[1]):
+            burnt = active & (upper_stage > stage) & (upper_stage < n_stages)
+            tfinal = mp_table[:, upper_stage] / mdot_table[:, upper_stage]
+            delta_v = thrust_table[:, upper_stage] / ((m0_table[:, upper_stage] + mpay) - mdot_table[:, upper_stage]
+                                                      * tfinal) * tfinal
+            v_final = v_final + np.where(burnt, delta_v, 0)
+
+    if drag_loss is None:
+        drag_loss = (LOW_FIDELITY_DRAG_LOSS, LOW_FIDELITY_OFFSET)
+    v_final = v_final - drag_loss[0] * s * cd / (m0_table[:, 0] + mpay) - drag_loss[1]
+    margin = np.where(active, v_final - V_ORBIT, np.nan)
+
+    if not record:
+        return margin
+
+    rows = np.concatenate(recorded_rows)
+    order = np.argsort(rows, kind="stable")
+    splits = np.cumsum(np.bincount(rows, minlength=n_designs))[:-1]
+    h_vectors = [heights.tolist() for heights in np.split(np.concatenate(recorded_h)[order], splits)]
+    v_vectors = [velocities.tolist() for velocities in np.split(np.concatenate(recorded_v)[order], splits)]
+
+    return margin, h_vectors, v_vectors
+
+
+def calculate_batch(designs, payload_tolerance=1.0, steps=50, fidelity="ode"):
+    """Maximum payload and trajectory of several designs at once, with the batched integrator. The payload
+    search is the bracketing search of calculate, advanced for all the designs together, so every search
+    iteration is a single batched integration. The trajectories of the final payloads are recorded with 500
+    points per integration, as in calculate.
+
+    With the default 50 steps per integration the payload matches the one of calculate within 0.2 % (the
+    error of calculate itself is of that order, as solve_ivp runs with its default tolerances) and the height
+    and velocity vectors within 0.2 %. It returns a list with (mpay, h_vector, v_vector) per design.
+
+    With fidelity="analytic" the low-fidelity model (simulate_analytic_batch) is used for the search, and the
+    vectors have 10 points per stage burn."""
+
+    packed = pack_designs(designs)
+
+    if fidelity == "ode":
+        def evaluate(rows, mpay):
+            return simulate_batch(tuple(array[rows] for array in packed), mpay, steps)
+    elif fidelity == "analytic":
+        def evaluate(rows, mpay):
+            return simulate_analytic_batch(tuple(array[rows] for array in packed), mpay)
+    else:
+        raise ValueError("Unknown fidelity: {FIDELITY}".format(FIDELITY=fidelity))
+
+    mpay = bracket_payload_batch(evaluate, len(designs), payload_tolerance)
+    if fidelity == "ode":
+        margin, h_vectors, v_vectors = simulate_batch(packed, mpay, steps=499, record=True)
+
+        # Near the lift-off thrust limit a payload found with the search steps can fail with the recording
+        # steps. The payload of these rows is searched again below it with the recording steps
+        unresolved = np.flatnonzero(np.isnan(margin) & (mpay > 0))
+        if unresolved.size > 0:
+            packed_unresolved = tuple(array[unresolved] for array in packed)
+            mpay[unresolved] = refine_payload_batch(packed_unresolved, mpay[unresolved], payload_tolerance, 499)
+            margin, h_unresolved, v_unresolved = simulate_batch(packed_unresolved, mpay[unresolved], steps=499,
+                                                                record=True)
+            for index, row in enumerate(unresolved):
+                h_vectors[row] = h_unresolved[index]
+                v_vectors[row] = v_unresolved[index]
+    else:
+        margin, h_vectors, v_vectors = simulate_analytic_batch(packed, mpay, record=True)
+
+    return [(mpay[row].item(), h_vectors[row], v_vectors[row]) for row in range(len(designs))]
+
+
+def refine_payload_batch(packed, mpay_high, payload_tolerance, steps, candidates=32):
+    """Maximum payload below mpay_high of several designs (packed with pack_designs), with the given steps per
+    integration. A grid of payload candidates over the interval of every design is integrated at once, and the
+    interval shrinks to the grid cell above the last feasible candidate, until it is below payload_tolerance.
+    The payload is 0 if no candidate is feasible."""
+
+    n_designs = len(mpay_high)
+    low = np.zeros(n_designs)
+    high = np.asarray(mpay_high, dtype=float).copy()
+    fractions = np.linspace(0, 1, candidates)
+
+    refining = high - low > payload_tolerance
+    while refining.any():
+        rows = np.flatnonzero(refining)
+        grid = low[rows, None] + (high[rows] - low[rows])[:, None] * fractions
+        candidate_rows = np.repeat(rows, candidates)
+        margin = simulate_batch(tuple(array[candidate_rows] for array in packed), grid.ravel(), steps)
+        feasible = margin.reshape(len(rows), candidates) > 0
+
+        last = candidates - 1 - np.argmax(feasible[:, ::-1], axis=1)    # Last feasible candidate
+        found = feasible.any(axis=1)
+        low[rows] = np.where(found, grid[np.arange(len(rows)), last], 0)
+        high[rows] = np.where(found, grid[np.arange(len(rows)), np.minimum(last + 1, candidates - 1)], 0)
+        refining = high - low > payload_tolerance
+
+    return low
+
+
+def calibrate_low_fidelity(designs, samples=25):
+    """Least squares fit of the drag loss coefficients of the low-fidelity model (LOW_FIDELITY_DRAG_LOSS and
+    LOW_FIDELITY_OFFSET) to the difference between its orbital velocity margin without drag loss and the one
+    of the full model. The margins are compared for payloads from zero to 1.2 times the maximum payload of
+    each design. It returns the two coefficients and the root mean square error of the fit (m/s)."""
+
+    features = []
+    losses = []
+
+    for design, (mpay_max, h_vector, v_vector) in zip(designs, calculate_batch(designs)):
+        payloads = np.linspace(0, 1.2 * max(mpay_max, 100), samples)
+        packed = pack_designs([design] * samples)
+        margin_full = simulate_batch(packed, payloads)
+        margin_analytic = simulate_analytic_batch(packed, payloads, drag_loss=(0, 0))
+        calibrated = np.isfinite(margin_full) & np.isfinite(margin_analytic)
+
+        n_stages, cd, s, thrust, m0, mdot, mp = packed
+        features.append(np.column_stack([s * cd / (m0[:, 0] + payloads), np.ones(samples)])[calibrated])
+        losses.append((margin_analytic - margin_full)[calibrated])
+
+    features = np.concatenate(features)
+    losses = np.concatenate(losses)
+    coefficients = np.linalg.lstsq(features, losses, rcond=None)[0]
+    error = np.sqrt(np.mean((features @ coefficients - losses) ** 2))
+
+    return coefficients[0], coefficients[1], error
+
+
+def bracket_payload_batch(evaluate, n_designs, payload_tolerance, step=1000):
+    """Vectorized version of bracket_payload. evaluate(rows, mpay) returns the orbital velocity margins of
+    the given rows (NaN when infeasible). Only the rows whose search has not finished are evaluated."""
+
+    all_rows = np.arange(n_designs)
+    margin_low = evaluate(all_rows, np.zeros(n_designs))
+    feasible = margin_low > 0
+
+    low = np.zeros(n_designs)
+    high = np.full(n_designs, float(step))
+    margin_high = np.full(n_designs, np.nan)
+
+    # Bracketing of the maximum payload
+    expanding = feasible.copy()
+    while expanding.any():
+        rows = np.flatnonzero(expanding)
+        margin = evaluate(rows, high[rows])
+        reached = margin > 0
+
+        stopped = rows[~reached]
+        margin_high[stopped] = margin[~reached]
+        expanding[stopped] = False
+
+        rows = rows[reached]
+        margin = margin[reached]
+        slope = (margin - margin_low[rows]) / (high[rows] - low[rows])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            trial = np.where(slope < 0, high[rows] - 2 * margin / slope, high[rows] + 2 * (high[rows] - low[rows]))
+        low[rows] = high[rows]
+        margin_low[rows] = margin
+        high[rows] = np.minimum(np.maximum(trial, low[rows] + step), low[rows] + 8 * (low[rows] + step))
+
+    # Refinement of the bracket (Illinois method)
+    retained = np.zeros(n_designs, dtype=int)    # 1 if the high end was retained last, -1 if the low end was
+    refining = feasible & (high - low > payload_tolerance)
+    while refining.any():
+        rows = np.flatnonzero(refining)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            trial = low[rows] + (high[rows] - low[rows]) * margin_low[rows] / (margin_low[rows] - margin_high[rows])
+        trial = np.clip(trial, low[rows] + payload_tolerance / 2, high[rows] - payload_tolerance / 2)
+        trial = np.where(np.isnan(margin_high[rows]), (low[rows] + high[rows]) / 2, trial)
+
+        margin = evaluate(rows, trial)
+        reached = margin > 0
+
+        rows_low = rows[reached]
+        halved = rows_low[retained[rows_low] == 1]
+        margin_high[halved] = margin_high[halved] / 2
+        low[rows_low] = trial[reached]
+        margin_low[rows_low] = margin[reached]
+        retained[rows_low] = 1
+
+        rows_high = rows[~reached]
+        halved = rows_high[retained[rows_high] == -1]
+        margin_low[halved] = margin_low[halved] / 2
+        high[rows_high] = trial[~reached]
+        margin_high[rows_high] = margin[~reached]
+        retained[rows_high] = -1
+
+        refining = feasible & (high - low > payload_tolerance)
+
+    return np.where(feasible, low, 0)
+
+
+def write_output(path, mpay, h_vector, v_vector, encoding="text", max_q=None):
+    """Generation of the output XML file. The encoding of the height and velocity vectors is one of
+    launcher.trajectory_encoding.ENCODINGS ("text" writes them as Python lists). The peak dynamic pressure
+    (q_max, altitude, time) returned by calculate with track_max_q is written if given."""
 
     # Here the outputs are written in the tree
 
@@ -316,9 +1017,14 @@ def write_output(path, mpay, h_vector, v_vector):
 
     trajectory_tree = etree.SubElement(root_output, "Trajectory")
     height_tree = etree.SubElement(trajectory_tree, "Height")
-    height_tree.text = str(h_vector)
+    trajectory_encoding.encode(height_tree, h_vector, encoding, path)
     velocity_tree = etree.SubElement(trajectory_tree, "Velocity")
-    velocity_tree.text = str(v_vector)
+    trajectory_encoding.encode(velocity_tree, v_vector, encoding, path)
+
+    if max_q is not None:
+        dynamic_pressure_tree = etree.SubElement(trajectory_tree, "Max_dynamic_pressure")
+        for name, value in zip(("Value", "Altitude", "Time"), max_q):
+            etree.SubElement(dynamic_pressure_tree, name).text = str(value)
 
     tree_output = etree.ElementTree(root_output)
     tree_output.write(path)
@@ -326,14 +1032,53 @@ def write_output(path, mpay, h_vector, v_vector):
     pass
 
 
+def write_model(launcher, mpay, h_vector, v_vector, max_q=None):
+    """Outputs are written to a launcher model, as write_output writes them to the XML file."""
+
+    launcher.payload = mpay
+    launcher.height = h_vector
+    launcher.velocity = v_vector
+    if max_q is not None:
+        launcher.max_dynamic_pressure = tuple(max_q)
+
+
 def run():
-    """Execution of the tool"""
+    """Execution of the tool. If the environment variable TRAJECTORY_HINT_CACHE is set, the payload search is
+    warm started with the hint cache persisted in the file it points to. The environment variable
+    TRAJECTORY_FIDELITY selects the trajectory model ("ode" by default, or "analytic"), and
+    TRAJECTORY_ENCODING the encoding of the output vectors ("text" by default, "float64", "float32" or "npy").
+    TRAJECTORY_OUTPUT_SAMPLING selects the sampling of the vectors ("count" by default, "spacing" or
+    "adaptive", with the default settings of calculate). If TRAJECTORY_MAX_Q is set to 1, the peak dynamic
+    pressure is tracked with the full model and written to the output, where the structural constraint tool uses
+    it instead of the maximum over the trajectory points. If LAUNCHER_RESULT_CACHE is set, the calculation is memoized in the result cache stored in the file
+    it points to. If LAUNCHER_PROFILE is set, the phases and integrations are profiled (see launcher.profiling)."""
+
+    hint_cache_path = os.environ.get("TRAJECTORY_HINT_CACHE")
+    hint_cache = PayloadHintCache(hint_cache_path) if hint_cache_path else None
+
+    with profiling.span("Trajectory.read_input"):
+        cone_angle, length_ratio, diameter, t_stages, m_structural_stages, mp_stages, mdot_stages = \
+            read_input('ToolInput/toolinput.xml')
+    fidelity = os.environ.get("TRAJECTORY_FIDELITY", "ode")
+    inputs = (cone_angle, length_ratio, diameter, t_stages, m_structural_stages, mp_stages, mdot_stages)
+    track_max_q = fidelity == "ode" and os.environ.get("TRAJECTORY_MAX_Q", "0") == "1"
+    options = {"hint_cache": hint_cache, "fidelity": fidelity, "track_max_q": track_max_q,
+               "output_sampling": os.environ.get("TRAJECTORY_OUTPUT_SAMPLING", "count")}
+
+    cache = result_cache.from_environment()
+    with profiling.span("Trajectory.calculate"):
+        if cache is not None:
+            outputs = cache.call("Trajectory", calculate, *inputs, **options)
+        else:
+            outputs = calculate(*inputs, **options)
+    mpay, h_vector, v_vector = outputs[:3]
+    max_q = outputs[3] if len(outputs) > 3 else None
+    with profiling.span("Trajectory.write_output"):
+        write_output('ToolOutput/toolOutput.xml', mpay, h_vector, v_vector,
+                     encoding=os.environ.get("TRAJECTORY_ENCODING", "text"), max_q=max_q)
 
-    cone_angle, length_ratio, diameter, t_stages, m_structural_stages, mp_stages, mdot_stages = \
-        read_input('ToolInput/toolinput.xml')
-    mpay, h_vector, v_vector = calculate(cone_angle, length_ratio, diameter, t_stages, m_structural_stages, mp_stages,
-                                         mdot_stages)
-    write_output('ToolOutput/toolOutput.xml', mpay, h_vector, v_vector)
+    if hint_cache is not None:
+        hint_cache.save()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,2 @@
+"""Modules shared by the space launcher tools. The folder has to be kept next to the tool folders, as the tools
+add the tools folder to the Python path to import it."""
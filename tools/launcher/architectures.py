@@ -0,0 +1,276 @@
+"""Enumeration of the launcher architectures: number of stages, engine types and numbers of engines of each stage
+and head shape. The architectures are generated lazily, stage by stage, each stage made of types_per_stage
+slots of an engine type and a number of engines (1 by default: one engine type per stage, as the XML files).
+
+An architecture is a tuple (stages, head_shape) where each stage is a tuple of (engine code, number of
+engines) pairs of launcher.catalog. Its canonical form merges the engines of the same type of a stage and sorts
+them by code, the order of the tools (the XML orderings of the same engines collapse), and the duplicates are
+dropped. With one slot per stage every architecture is already canonical: no two engine choices give the same
+tool outputs, so the default space has no duplicates. With more slots the same engine type in several slots
+collapses into one stage (2 + 1 VULCAIN is 3 VULCAIN), which can be written as a design. The canonical
+architectures are then pruned by RULES, each with the reason of the rejection:
+
+- mixed_kinds: liquid and solid engines in the same stage (the tools size a stage as liquid or solid).
+- mixed_types: different engine types in the same stage. Engine_liquid.calculate and Engine_solid.calculate keep
+  the mass flow (and expansion ratio) of the last engine type only, so the analysis would not be consistent.
+- single_stage_delta_v: a single stage whose ideal velocity, exhaust velocity times the logarithm of the mass
+  ratio of a very large stage (the smallest structural fraction of the sizing), is below the orbital velocity
+  (solid and SIVB stages).
+
+The valid architectures are written as ready-to-run design tables (launcher.batch) in batches of batch_size
+rows, with the continuous values of a reference design or the defaults. Usage:
+
+    python architectures.py count [--stages 1 2 3] [--engine-counts 1 2 3 4] [--types-per-stage 1]
+    python architectures.py write designs [--batch-size 1000] [--reference "../../XML files/2stages.xml"]"""
+
+import argparse
+import csv
+import functools
+import itertools
+import math
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from launcher import batch
+from launcher import catalog
+from launcher import mda
+
+MAX_STAGES = 3
+MAX_ENGINES = 4
+BOUND_LENGTH = 1e4    # Stage length (m) of the velocity bound, far longer than any launcher
+DEFAULT_DESIGN = {"length": 20.0, "l_d": 12.0, "cone_angle": 20.0, "l_ratio": 0.15, "max_q": 50000.0,
+                  "payload_density": 2810.0}
+
+
+def canonical(stages, head_shape):
+    """Canonical form of an architecture: the engines of the same type of a stage merged and sorted by code."""
+
+    merged = []
+    for stage in stages:
+        counts = {}
+        for engine, engines in stage:
+            counts[engine] = counts.get(engine, 0) + engines
+        merged.append(tuple(sorted(counts.items())))
+
+    return tuple(merged), head_shape
+
+
+def mixed_kinds(architecture):
+    """Rule: the engines of a stage are all liquid or all solid."""
+
+    for index, stage in enumerate(architecture[0], start=1):
+        if len({catalog.KIND[engine] for engine, _ in stage}) > 1:
+            return "stage {INDEX} mixes liquid and solid engines".format(INDEX=index)
+
+    return None
+
+
+def mixed_types(architecture):
+    """Rule: the engines of a stage are of the same type."""
+
+    for index, stage in enumerate(architecture[0], start=1):
+        if len(stage) > 1:
+            return "stage {INDEX} mixes engine types".format(INDEX=index)
+
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def single_stage_velocity(engine):
+    """Upper bound of the velocity of a single stage of an engine type: exhaust velocity (thrust / mass flow)
+    times the logarithm of the mass ratio of a stage of BOUND_LENGTH, whose structural fraction is the smallest
+    (the surfaces grow slower than the volumes and the pumps do not grow)."""
+
+    sizing = mda.evaluate_sizing_batch([[engine]], [[1]], [[BOUND_LENGTH]], [mda.HEAD_SHAPES.index("Sphere")],
+                                       [0.0], [0.0], [1.0])
+    m_structural, m_propellant = sizing["m_structural"][0, 0], sizing["m_propellant"][0, 0]
+
+    return catalog.THRUST[engine] / catalog.MDOT[engine] * math.log((m_structural + m_propellant) / m_structural)
+
+
+def single_stage_delta_v(architecture):
+    """Rule: a single stage can reach the orbital velocity."""
+
+    stages = architecture[0]
+    if len(stages) == 1 and len(stages[0]) == 1:
+        engine = stages[0][0][0]
+        if single_stage_velocity(engine) < mda.Trajectory.V_ORBIT:
+            return "a single {ENGINE} stage reaches {VELOCITY:.0f} m/s at most".format(
+                ENGINE=catalog.ENGINE_NAMES[engine], VELOCITY=single_stage_velocity(engine))
+
+    return None
+
+
+RULES = (("mixed_kinds", mixed_kinds), ("mixed_types", mixed_types), ("single_stage_delta_v", single_stage_delta_v))
+
+
+def space_size(stage_counts=range(1, MAX_STAGES + 1), engine_types=catalog.ENGINE_NAMES,
+               engine_counts=range(1, MAX_ENGINES + 1), head_shapes=mda.HEAD_SHAPES, types_per_stage=1):
+    """Number of architectures before the canonical form and the pruning."""
+
+    stage_options = (len(engine_types) * len(engine_counts)) ** types_per_stage
+
+    return sum(stage_options ** n_stages for n_stages in stage_counts) * len(head_shapes)
+
+
+def enumerate_architectures(stage_counts=range(1, MAX_STAGES + 1), engine_types=catalog.ENGINE_NAMES,
+                            engine_counts=range(1, MAX_ENGINES + 1), head_shapes=mda.HEAD_SHAPES, types_per_stage=1,
+                            rules=RULES, statistics=None, rejections=None):
+    """Generator of the canonical architectures that pass the rules (a sequence of (name, function) pairs, each
+    function returning the reason of a rejection or None). statistics, if given, is a dictionary updated with
+    the number of generated architectures, duplicates, rejections of each rule and valid architectures, and
+    rejections a list to which the (architecture, rule, reason) of the rejected architectures are appended."""
+
+    statistics = statistics if statistics is not None else {}
+    for name in ("generated", "duplicates", "valid") + tuple(name for name, _ in rules):
+        statistics.setdefault(name, 0)
+
+    slots = list(itertools.product([catalog.ENGINE_CODES[engine] for engine in engine_types], engine_counts))
+    stage_options = list(itertools.product(slots, repeat=types_per_stage))
+    seen = set()
+
+    for n_stages in stage_counts:
+        for stages in itertools.product(stage_options, repeat=n_stages):
+            for head_shape in head_shapes:
+                statistics["generated"] += 1
+                architecture = canonical(stages, head_shape)
+                if architecture in seen:
+                    statistics["duplicates"] += 1
+                    continue
+                seen.add(architecture)
+
+                for name, rule in rules:
+                    reason = rule(architecture)
+                    if reason is not None:
+                        statistics[name] += 1
+                        if rejections is not None:
+                            rejections.append((architecture, name, reason))
+                        break
+                else:
+                    statistics["valid"] += 1
+                    yield architecture
+
+
+def label(architecture):
+    """Text of an architecture, for example "1 SRB / 2 VULCAIN + 1 RS68 / Sphere"."""
+
+    stages = [" + ".join("{ENGINES} {ENGINE}".format(ENGINES=engines, ENGINE=catalog.ENGINE_NAMES[engine])
+                         for engine, engines in stage) for stage in architecture[0]]
+
+    return " / ".join(stages + [architecture[1]])
+
+
+def design(architecture, reference=None):
+    """Design dictionary (see launcher.mda) of an architecture of one engine type per stage (mixed stages are
+    pruned by the rules), with the continuous values of a reference design (its stage lengths by index, the
+    last one for the extra stages) or DEFAULT_DESIGN."""
+
+    stages, head_shape = architecture
+    if any(len(stage) != 1 for stage in stages):
+        raise ValueError("Mixed engine stage can't be written as a design: {LABEL}".format(LABEL=label(architecture)))
+
+    values = dict(DEFAULT_DESIGN)
+    lengths = []
+    if reference is not None:
+        lengths = [stage["length"] for stage in reference["stages"]]
+        values.update((name, reference[name]) for name in batch.DESIGN_COLUMNS[1:] if reference[name] > 0)
+
+    stages = [{"engine": catalog.ENGINE_NAMES[stage[0][0]], "engines": stage[0][1],
+               "length": lengths[min(index, len(lengths) - 1)] if lengths else values["length"]}
+              for index, stage in enumerate(stages)]
+
+    return {"stages": stages, "head_shape": head_shape, "cone_angle": values["cone_angle"],
+            "l_ratio": values["l_ratio"], "l_d": values["l_d"], "max_q": values["max_q"],
+            "payload_density": values["payload_density"]}
+
+
+def write_batches(architectures, prefix, batch_size=1000, reference=None, max_stages=MAX_STAGES):
+    """Writes the designs of the architectures (an iterable, consumed as it is written) to the design tables
+    prefix_0001.csv, prefix_0002.csv... of batch_size rows, with an architecture column of their labels. It
+    returns the paths of the files."""
+
+    fieldnames = ["architecture"]
+    for index in range(1, max_stages + 1):
+        fieldnames += ["stage{INDEX}_{NAME}".format(INDEX=index, NAME=name) for name in ("engine", "engines",
+                                                                                          "length")]
+    fieldnames += batch.DESIGN_COLUMNS
+
+    paths = []
+    f = writer = None
+    try:
+        for count, architecture in enumerate(architectures):
+            if count % batch_size == 0:
+                if f is not None:
+                    f.close()
+                paths.append("{PREFIX}_{INDEX:04d}.csv".format(PREFIX=prefix, INDEX=len(paths) + 1))
+                f = open(paths[-1], "w", newline="")
+                writer = csv.DictWriter(f, fieldnames=fieldnames, restval="")
+                writer.writeheader()
+            writer.writerow(dict(batch.row_from_design(design(architecture, reference)),
+                                 architecture=label(architecture)))
+    finally:
+        if f is not None:
+            f.close()
+
+    return paths
+
+
+def report(statistics, raw, rules=RULES, stream=sys.stdout):
+    """Prints the size of the space before and after the canonical form and the pruning."""
+
+    stream.write("Architectures: {RAW}\n".format(RAW=raw))
+    stream.write("Canonical: {COUNT} ({DUPLICATES} duplicates)\n".format(
+        COUNT=statistics["generated"] - statistics["duplicates"], DUPLICATES=statistics["duplicates"]))
+    for name, _ in rules:
+        stream.write("Pruned by {NAME}: {COUNT}\n".format(NAME=name, COUNT=statistics[name]))
+    stream.write("Valid: {COUNT}\n".format(COUNT=statistics["valid"]))
+
+
+def main():
+    """Command line entry point."""
+
+    parser = argparse.ArgumentParser(description="Enumeration of the launcher architectures.")
+    parser.add_argument("command", choices=("count", "write"))
+    parser.add_argument("prefix", nargs="?", default="architectures", help="prefix of the design tables (write)")
+    parser.add_argument("--stages", type=int, nargs="+", default=list(range(1, MAX_STAGES + 1)))
+    parser.add_argument("--engine-types", nargs="+", default=list(catalog.ENGINE_NAMES))
+    parser.add_argument("--engine-counts", type=int, nargs="+", default=list(range(1, MAX_ENGINES + 1)))
+    parser.add_argument("--head-shapes", nargs="+", default=list(mda.HEAD_SHAPES))
+    parser.add_argument("--types-per-stage", type=int, default=1, help="engine type slots of each stage")
+    parser.add_argument("--batch-size", type=int, default=1000, help="designs per design table")
+    parser.add_argument("--reference", default=None, help="XML design of the continuous values")
+    parser.add_argument("--rejections", action="store_true", help="print the rejected architectures")
+    arguments = parser.parse_args()
+
+    for engine in arguments.engine_types:
+        if engine not in catalog.ENGINE_CODES:
+            raise ValueError("Unknown engine: {ENGINE}".format(ENGINE=engine))
+    for head_shape in arguments.head_shapes:
+        if head_shape not in mda.HEAD_SHAPES:
+            raise ValueError("Unknown head shape: {SHAPE}".format(SHAPE=head_shape))
+
+    space = {"stage_counts": arguments.stages, "engine_types": arguments.engine_types,
+             "engine_counts": arguments.engine_counts, "head_shapes": arguments.head_shapes,
+             "types_per_stage": arguments.types_per_stage}
+    statistics = {}
+    rejections = [] if arguments.rejections else None
+    architectures = enumerate_architectures(statistics=statistics, rejections=rejections, **space)
+
+    if arguments.command == "write":
+        reference = mda.read_design(arguments.reference) if arguments.reference else None
+        paths = write_batches(architectures, arguments.prefix, arguments.batch_size, reference,
+                              max(arguments.stages))
+        print("{COUNT} design tables written".format(COUNT=len(paths)))
+    else:
+        for _ in architectures:
+            pass
+
+    report(statistics, space_size(**space))
+    for architecture, name, reason in rejections or []:
+        print("{LABEL}: {RULE}, {REASON}".format(LABEL=label(architecture), RULE=name, REASON=reason))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Atmospheric model shared by the trajectory and structural constraint tools. The density of the standard
+atmosphere (ambiance) is tabulated once between 0 and 80 km and interpolated, which is much faster than
+building an ambiance Atmosphere object at every call. The logarithm of the density is interpolated linearly,
+as the density varies exponentially with the altitude inside each atmospheric layer. The relative error
+against ambiance is below 1e-4 (see accuracy)."""
+
+import math
+import numpy as np
+from ambiance import Atmosphere
+
+ALTITUDE_MAX = 80000    # Altitudes out of (0, ALTITUDE_MAX) take the density at ALTITUDE_MAX
+TABLE_STEP = 10    # Altitude spacing of the density table in m
+
+altitudes_table = np.arange(0, ALTITUDE_MAX + TABLE_STEP, TABLE_STEP, dtype=float)
+log_density_table = np.log(Atmosphere(altitudes_table).density)
+rho_clamped = math.exp(log_density_table[-1])
+
+_log_density_list = log_density_table.tolist()    # Faster than array indexing for scalar calls
+
+
+def density(x, model="table"):
+    """Air density in kg/m^3 at the altitude x in m. x can be a scalar (a float is returned) or an array.
+    The model is either "table" (interpolated table) or "ambiance" (exact standard atmosphere)."""
+
+    if model == "ambiance":
+        return exact_density(x)
+    elif model != "table":
+        raise ValueError("Unknown atmosphere model: {MODEL}".format(MODEL=model))
+
+    if isinstance(x, (float, int)) or np.ndim(x) == 0:
+        if not 0 < x < ALTITUDE_MAX:
+            return rho_clamped
+        position = x / TABLE_STEP
+        index = int(position)
+        log_rho = _log_density_list[index] + (position - index) * (_log_density_list[index + 1] -
+                                                                    _log_density_list[index])
+        return math.exp(log_rho)
+
+    x = np.asarray(x, dtype=float)
+    rho = np.exp(np.interp(x, altitudes_table, log_density_table))
+
+    return np.where((x > 0) & (x < ALTITUDE_MAX), rho, rho_clamped)
+
+
+def log_density_slope(x):
+    """Derivative of the logarithm of the table density with respect to the altitude (1/m) at the scalar
+    altitude x. It is zero out of (0, ALTITUDE_MAX), where the density is constant."""
+
+    if not 0 < x < ALTITUDE_MAX:
+        return 0.0
+    index = int(x / TABLE_STEP)
+
+    return (_log_density_list[index + 1] - _log_density_list[index]) / TABLE_STEP
+
+
+def exact_density(x):
+    """Air density from ambiance, with the same clamping as the table."""
+
+    if np.ndim(x) == 0:
+        if not 0 < x < ALTITUDE_MAX:
+            return rho_clamped
+        return float(Atmosphere(x).density[0])
+
+    x = np.asarray(x, dtype=float)
+    inside = (x > 0) & (x < ALTITUDE_MAX)
+    rho = np.full(x.shape, rho_clamped)
+    rho[inside] = Atmosphere(x[inside]).density
+
+    return rho
+
+
+def accuracy(samples=100000):
+    """Maximum relative error of the table against ambiance, evaluated at random altitudes in (0, 80 km)
+    and at the midpoints of the table, where the interpolation error is the largest."""
+
+    random_altitudes = np.random.default_rng(0).uniform(0, ALTITUDE_MAX, samples)
+    midpoints = altitudes_table[:-1] + TABLE_STEP / 2
+    x = np.concatenate((random_altitudes, midpoints))
+    x = x[x > 0]
+
+    relative_error = np.abs(density(x) / exact_density(x) - 1)
+
+    return float(np.max(relative_error))
+
+
+if __name__ == '__main__':
+    print("Maximum relative error of the density table: {ERROR:.2e}".format(ERROR=accuracy()))
@@ -0,0 +1,201 @@
+"""Batch evaluation of many launcher designs on a pool of processes. The designs are read from a table (CSV or
+.npz) with one design per row and the columns:
+
+- stage1_engine, stage1_engines, stage1_length, stage2_engine, ...: engine type (VULCAIN, RS68, SIVB, SRB, P80
+  or GEM60), number of engines and length of each stage. Stages with an empty engine or zero engines are not
+  used, so designs with different numbers of stages can share a table.
+- head_shape, cone_angle, l_ratio, l_d, max_q, payload_density.
+
+The designs are evaluated with launcher.mda.evaluate, each worker importing the tools (scipy, ambiance, lxml)
+once when it starts. Usage:
+
+    python batch.py designs.csv results.csv [--workers N] [--chunksize N] [--cache FILE]"""
+
+import argparse
+import csv
+import functools
+import os
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from launcher import profiling
+from launcher.result_cache import ResultCache
+
+DESIGN_COLUMNS = ("head_shape", "cone_angle", "l_ratio", "l_d", "max_q", "payload_density")
+RESULT_COLUMNS = ("payload", "cost", "structural_constraint", "payload_constraint", "error")
+
+
+def read_designs(path):
+    """List of design dictionaries (see launcher.mda) from a CSV or .npz table."""
+
+    return [design_from_row(row) for row in read_rows(path)]
+
+
+def read_rows(path):
+    """List of the rows (dictionaries of column values) of a CSV or .npz table."""
+
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            columns = {name: data[name].tolist() for name in data.files}
+        rows = [dict(zip(columns, values)) for values in zip(*columns.values())]
+    else:
+        with open(path, "r", newline="") as f:
+            rows = list(csv.DictReader(f))
+
+    return rows
+
+
+def design_from_row(row):
+    """Design dictionary from a row of the design table (a dictionary of column values)."""
+
+    stages = []
+    index = 1
+    while "stage{INDEX}_engine".format(INDEX=index) in row:
+        engine = str(row["stage{INDEX}_engine".format(INDEX=index)]).strip()
+        engines = int(float(row["stage{INDEX}_engines".format(INDEX=index)] or 0))
+        if engine and engines > 0:
+            stages.append({"engine": engine,
+                           "engines": engines,
+                           "length": float(row["stage{INDEX}_length".format(INDEX=index)])})
+        index = index + 1
+
+    design = {"stages": stages, "head_shape": str(row["head_shape"]).strip()}
+    for name in DESIGN_COLUMNS[1:]:
+        value = row.get(name, 0)
+        design[name] = float(value) if value not in ("", None) else 0.0
+
+    return design
+
+
+def row_from_design(design):
+    """Row of the design table (a dictionary of column values) of a design dictionary."""
+
+    row = {}
+    for index, stage in enumerate(design["stages"], start=1):
+        row["stage{INDEX}_engine".format(INDEX=index)] = stage["engine"]
+        row["stage{INDEX}_engines".format(INDEX=index)] = stage["engines"]
+        row["stage{INDEX}_length".format(INDEX=index)] = stage["length"]
+    for name in DESIGN_COLUMNS:
+        row[name] = design[name]
+
+    return row
+
+
+def warm_worker():
+    """Initializer of the worker processes. The tools and their dependencies are imported once per worker."""
+
+    from launcher import mda    # noqa: F401
+
+
+def evaluate_safe(design, **options):
+    """Evaluation of a design that does not raise. The outputs of the trajectory vectors and stages are
+    dropped, and a failure (for example an IndexError of a tool with an unexpected design) is returned as the
+    error text with NaN outputs. The design can also be a row of the design table, parsed here so that a
+    malformed row only fails its own evaluation."""
+
+    from launcher import mda
+
+    try:
+        if "stages" not in design:
+            design = design_from_row(design)
+        with profiling.span("mda.evaluate", "mda"):
+            results = mda.evaluate(design, **options)
+    except Exception as error:
+        traceback_text = traceback.format_exception_only(type(error), error)[-1].strip()
+        return {"payload": np.nan, "cost": np.nan, "structural_constraint": np.nan, "payload_constraint": np.nan,
+                "error": traceback_text}
+
+    return {"payload": results["payload"],
+            "cost": results["cost"],
+            "structural_constraint": results["structural_constraint"],
+            "payload_constraint": results["payload_constraint"],
+            "error": ""}
+
+
+def evaluate_batch(designs, workers=None, chunksize=None, **options):
+    """Generator with the results of the designs (dictionaries or rows of the design table, see evaluate_safe),
+    in the input order, as soon as they are available. The designs are sent to the workers in chunks (by
+    default about 4 chunks per worker, at most 64 designs each) to amortize the communication. The keyword
+    arguments are passed to launcher.mda.evaluate. With workers=1 the designs are evaluated in this process."""
+
+    designs = list(designs)
+    workers = workers if workers is not None else os.cpu_count()
+    evaluate = functools.partial(evaluate_safe, **options)
+
+    if workers == 1:
+        for design in designs:
+            yield evaluate(design)
+        return
+
+    if chunksize is None:
+        chunksize = max(1, min(64, len(designs) // (4 * workers)))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=warm_worker) as executor:
+        for results in executor.map(evaluate, designs, chunksize=chunksize):
+            yield results
+
+
+def evaluate_unordered(designs, workers=None, **options):
+    """Generator with the (index, results) of the designs in the order they finish, for the callers that save
+    each result as soon as it is available (launcher.doe): a slow design does not hold back the ones after
+    it. The designs are sent to the workers one by one, the others are as in evaluate_batch."""
+
+    designs = list(designs)
+    workers = workers if workers is not None else os.cpu_count()
+    evaluate = functools.partial(evaluate_safe, **options)
+
+    if workers == 1:
+        for index, design in enumerate(designs):
+            yield index, evaluate(design)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=warm_worker) as executor:
+        futures = {executor.submit(evaluate, design): index for index, design in enumerate(designs)}
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:    # Interrupted: the designs not started yet are dropped
+            for future in futures:
+                future.cancel()
+
+
+def write_results(path, results):
+    """Writes the results (an iterable, written as it is consumed) to a CSV file, one row per design. It
+    returns the number of designs written."""
+
+    count = 0
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=("design",) + RESULT_COLUMNS)
+        writer.writeheader()
+        for count, row in enumerate(results, start=1):
+            writer.writerow(dict(row, design=count - 1))
+
+    return count
+
+
+def main():
+    """Command line entry point."""
+
+    parser = argparse.ArgumentParser(description="Batch evaluation of launcher designs.")
+    parser.add_argument("designs", help="CSV or .npz table of designs")
+    parser.add_argument("results", help="CSV file for the results")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (all cores by default)")
+    parser.add_argument("--chunksize", type=int, default=None, help="designs sent to a worker at once")
+    parser.add_argument("--cache", default=None, help="result cache file (launcher.result_cache)")
+    arguments = parser.parse_args()
+
+    cache = ResultCache(arguments.cache) if arguments.cache else None
+    designs = read_rows(arguments.designs)
+    count = write_results(arguments.results, evaluate_batch(designs, arguments.workers, arguments.chunksize,
+                                                            cache=cache))
+    print("{COUNT} designs evaluated".format(COUNT=count))
+    if cache is not None:
+        print("Result cache: {STATISTICS}".format(STATISTICS=cache.statistics()["total"]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+"""Performance benchmark of the tools on the example architectures of "XML files", with a check of the results.
+
+For every architecture the read_input, calculate and write_output functions of each tool are timed, with the
+result file of the architecture as the tool input (it contains the inputs of all the tools). The tools of one
+stage (engines and masses) are timed on every stage, with an input file holding only that stage, as in the RCE
+workflow. The whole multidisciplinary analysis (launcher.mda.evaluate) is timed too.
+
+Every run checks the outputs of the analysis against "result files" within the GOLDEN_TOLERANCES of its mode, so
+a faster mode (payload search, atmosphere model, fidelity) cannot change the results unnoticed.
+
+The timings can be saved as a baseline (--save-baseline) and later runs with the same options compared with it
+(--baseline): a minimum time more than --threshold (relative) and 5 microseconds above the one of the baseline is
+reported as a slowdown. The timings of two runs on the same machine often differ by more than 30 %, and no
+baseline is valid on another machine, so the slowdowns only change the exit status with --fail-on-slowdown. The
+exit status is 1 if a result is out of tolerance (or a slowdown is found, with --fail-on-slowdown). Usage:
+
+    python benchmark.py [--repeats 5] [--output results.json] [--baseline FILE] [--save-baseline FILE]
+                        [--threshold 0.3] [--fail-on-slowdown] [--payload-search bracket]
+                        [--atmosphere-model table] [--fidelity ode]"""
+
+import argparse
+import copy
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+from lxml import etree
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from launcher import mda
+
+ARCHITECTURES = ("1stage", "2stages", "3stages")
+REPOSITORY_FOLDER = os.path.join(mda.TOOLS_FOLDER, os.pardir)
+
+# Tools in the order of the workflow and whether they run once per stage
+TOOLS = (("Geometry_calculator", mda.Geometry_calculator, False),
+         ("Engine_liquid", mda.Engine_liquid, True),
+         ("Engine_solid", mda.Engine_solid, True),
+         ("Mass_propellant", mda.Mass_propellant, True),
+         ("Mass_structure", mda.Mass_structure, True),
+         ("Trajectory", mda.Trajectory, False),
+         ("Structural_constraint", mda.Structural_constraint, False),
+         ("Payload", mda.Payload, False),
+         ("Cost", mda.Cost, False))
+
+# Allowed difference with the result files per mode (payload search, or the analytic fidelity): absolute +
+# relative * |reference|. The payload of the result files was found with a scan in 100 kg steps (see
+# launcher.mda.compare_examples). The bracket search is up to one step away from it (+90 kg, 1.2 %, for the 2
+# stages launcher), the smooth search and above all the coarse vectors of the analytic model further. The payload
+# constraint (payload / payload density - available volume) moves with the payload: +0.032 m3 (3.4 %) for the 2
+# stages launcher with the bracket search. That part is already checked with the payload, so the payload
+# constraint is checked after removing it, with a tight tolerance (see golden_check)
+GOLDEN_TOLERANCES = {"bracket": {"payload": (100, 0.001),
+                                 "cost": (0, 1e-9),
+                                 "structural_constraint": (0, 0.005),
+                                 "payload_constraint": (1e-6, 1e-6)},
+                     "smooth": {"payload": (150, 0.002),
+                                "cost": (0, 1e-9),
+                                "structural_constraint": (0, 0.01),
+                                "payload_constraint": (1e-6, 1e-6)},
+                     "analytic": {"payload": (250, 0.005),
+                                  "cost": (0, 1e-9),
+                                  "structural_constraint": (0, 0.15),
+                                  "payload_constraint": (1e-6, 1e-6)}}
+GOLDEN_TOLERANCES["scan"] = GOLDEN_TOLERANCES["bracket"]
+
+
+def measure(function, repeats=5, min_time=0.01):
+    """Statistics of the time of a call of a function (seconds). Each of the repeats calls it as many times as
+    needed to last at least min_time, as timeit does, so the fast functions are timed accurately."""
+
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 10000:
+            break
+        number = number * 10
+
+    samples = [elapsed / number]
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        samples.append((time.perf_counter() - start) / number)
+
+    return {"repeats": repeats,
+            "calls": number,
+            "min": min(samples),
+            "median": statistics.median(samples),
+            "mean": statistics.mean(samples),
+            "stdev": statistics.stdev(samples) if repeats > 1 else 0.0}
+
+
+def stage_input(result_path, stage_index, path):
+    """Writes the input file of a tool of one stage: the result file with only that stage."""
+
+    root = copy.deepcopy(etree.parse(result_path).getroot())
+    for index, stage in enumerate(root.xpath("Stage")):
+        if index != stage_index:
+            root.remove(stage)
+    etree.ElementTree(root).write(path)
+
+    return root.xpath("Stage")[0]
+
+
+def calculate_options(name, trajectory_options):
+    """Keyword arguments of the calculate function of a tool for the chosen trajectory options."""
+
+    if name == "Trajectory":
+        return dict(trajectory_options)
+    if name == "Structural_constraint":
+        return {"atmosphere_model": trajectory_options.get("atmosphere_model", "table")}
+    return {}
+
+
+def benchmark_tool(name, module, input_path, output_path, repeats, trajectory_options):
+    """Timings of the read_input, calculate and write_output functions of a tool."""
+
+    inputs = module.read_input(input_path)
+    options = calculate_options(name, trajectory_options)
+    outputs = module.calculate(*inputs, **options)
+    outputs = outputs[:3] if name == "Trajectory" else outputs    # The maximum dynamic pressure is optional
+    outputs = outputs if isinstance(outputs, tuple) else (outputs,)
+
+    return {"read_input": measure(lambda: module.read_input(input_path), repeats),
+            "calculate": measure(lambda: module.calculate(*inputs, **options), repeats),
+            "write_output": measure(lambda: module.write_output(output_path, *outputs), repeats)}
+
+
+def benchmark_architecture(name, repeats=5, **trajectory_options):
+    """Timings of the tools and of the analysis of an example architecture, and the outputs of the analysis."""
+
+    result_path = os.path.join(REPOSITORY_FOLDER, "result files", name + "_result.xml")
+    design = mda.read_design(os.path.join(REPOSITORY_FOLDER, "XML files", name + ".xml"))
+    n_stages = len(design["stages"])
+    timings = {}
+
+    with tempfile.TemporaryDirectory() as folder:
+        output_path = os.path.join(folder, "toolOutput.xml")
+        for tool, module, per_stage in TOOLS:
+            if not per_stage:
+                timings[tool] = benchmark_tool(tool, module, result_path, output_path, repeats, trajectory_options)
+                continue
+            for stage_index in range(n_stages):
+                input_path = os.path.join(folder, "stage{INDEX}.xml".format(INDEX=stage_index + 1))
+                stage = stage_input(result_path, stage_index, input_path)
+                if (tool == "Engine_liquid" and not stage.xpath("Engines/Liquid")) or \
+                        (tool == "Engine_solid" and not stage.xpath("Engines/Solid")):
+                    continue
+                timings["{TOOL}/stage_{INDEX}".format(TOOL=tool, INDEX=stage_index + 1)] = benchmark_tool(
+                    tool, module, input_path, output_path, repeats, trajectory_options)
+
+    results = mda.evaluate(design, **trajectory_options)
+    timings["MDA"] = {"evaluate": measure(lambda: mda.evaluate(design, **trajectory_options), repeats)}
+
+    return timings, results
+
+
+def golden_check(name, results, mode="bracket"):
+    """Comparison of the outputs of the analysis of an example architecture with its result file, within the
+    GOLDEN_TOLERANCES of a mode. The difference of the payload constraint is the one left after removing the
+    difference of the payload divided by the payload density."""
+
+    reference = mda.read_result(os.path.join(REPOSITORY_FOLDER, "result files", name + "_result.xml"))
+    design = mda.read_design(os.path.join(REPOSITORY_FOLDER, "XML files", name + ".xml"))
+    checks = {}
+    for output, value in reference.items():
+        absolute, relative = GOLDEN_TOLERANCES[mode][output]
+        tolerance = absolute + relative * abs(value)
+        difference = results[output] - value
+        if output == "payload_constraint":
+            difference = difference - (results["payload"] - reference["payload"]) / design["payload_density"]
+        checks[output] = {"value": results[output], "reference": value, "difference": difference,
+                          "tolerance": tolerance, "passed": bool(abs(difference) <= tolerance)}
+
+    return checks
+
+
+def slowdowns(timings, baseline, threshold=0.3, min_difference=5e-6):
+    """Timings whose minimum is more than threshold (relative) and min_difference (seconds) above the one of the
+    baseline. The minimum is the least noisy statistic of the short timings."""
+
+    found = []
+    for architecture, tools in timings.items():
+        for tool, phases in tools.items():
+            for phase, stats in phases.items():
+                try:
+                    reference = baseline["timings"][architecture][tool][phase]["min"]
+                except KeyError:    # Not in the baseline
+                    continue
+                ratio = stats["min"] / reference
+                if ratio > 1 + threshold and stats["min"] - reference > min_difference:
+                    found.append({"timing": "/".join((architecture, tool, phase)), "min": stats["min"],
+                                  "baseline": reference, "ratio": ratio})
+
+    return found
+
+
+def run_benchmark(architectures=ARCHITECTURES, repeats=5, baseline=None, threshold=0.3, **trajectory_options):
+    """Benchmark of the example architectures. It returns a JSON serializable report with the machine, the
+    options, the timings, the golden checks and the slowdowns with respect to a baseline report (if given and
+    obtained with the same options)."""
+
+    report = {"date": datetime.datetime.now().isoformat(timespec="seconds"),
+              "machine": {"platform": platform.platform(), "processor": platform.processor(),
+                          "cpus": os.cpu_count(), "python": platform.python_version(), "numpy": np.__version__},
+              "options": trajectory_options,
+              "timings": {},
+              "golden": {}}
+
+    if trajectory_options.get("fidelity", "ode") == "analytic":
+        mode = "analytic"
+    else:
+        mode = trajectory_options.get("payload_search", "bracket")
+
+    for name in architectures:
+        timings, results = benchmark_architecture(name, repeats, **trajectory_options)
+        report["timings"][name] = timings
+        report["golden"][name] = golden_check(name, results, mode)
+
+    report["golden_passed"] = all(check["passed"] for checks in report["golden"].values()
+                                  for check in checks.values())
+    report["slowdowns"] = []
+    if baseline is not None and baseline["options"] == trajectory_options:
+        report["slowdowns"] = slowdowns(report["timings"], baseline, threshold)
+
+    return report
+
+
+def summary(report):
+    """Text summary of a benchmark report."""
+
+    lines = []
+    for architecture, tools in report["timings"].items():
+        lines.append(architecture)
+        for tool, phases in tools.items():
+            lines.append("    {TOOL:<32}".format(TOOL=tool) + "  ".join(
+                "{PHASE} {TIME:9.3f} ms".format(PHASE=phase, TIME=stats["median"] * 1000)
+                for phase, stats in phases.items()))
+        for output, check in report["golden"][architecture].items():
+            if not check["passed"]:
+                lines.append("    FAILED {OUTPUT}: {VALUE:.6g} (reference {REFERENCE:.6g}, tolerance {TOLERANCE:.3g})"
+                             .format(OUTPUT=output, VALUE=check["value"], REFERENCE=check["reference"],
+                                     TOLERANCE=check["tolerance"]))
+    for slowdown in report["slowdowns"]:
+        lines.append("SLOWDOWN {TIMING}: {RATIO:.2f} x baseline".format(TIMING=slowdown["timing"],
+                                                                       RATIO=slowdown["ratio"]))
+    lines.append("Golden checks {RESULT}, {COUNT} slowdowns".format(
+        RESULT="passed" if report["golden_passed"] else "FAILED", COUNT=len(report["slowdowns"])))
+
+    return "\n".join(lines)
+
+
+def main():
+    """Command line entry point."""
+
+    parser = argparse.ArgumentParser(description="Benchmark of the tools on the example architectures.")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--architectures", nargs="+", default=list(ARCHITECTURES), choices=ARCHITECTURES)
+    parser.add_argument("--output", default=None, help="JSON file for the report")
+    parser.add_argument("--baseline", default=None, help="JSON report used as baseline, saved on this machine")
+    parser.add_argument("--save-baseline", default=None, help="JSON file to save the report as a baseline")
+    parser.add_argument("--threshold", type=float, default=0.3, help="relative slowdown reported")
+    parser.add_argument("--fail-on-slowdown", action="store_true", help="exit status 1 if a slowdown is found")
+    parser.add_argument("--payload-search", choices=("bracket", "scan", "smooth"), default="bracket")
+    parser.add_argument("--atmosphere-model", choices=("table", "ambiance"), default="table")
+    parser.add_argument("--fidelity", choices=("ode", "analytic"), default="ode")
+    arguments = parser.parse_args()
+
+    baseline = None
+    if arguments.baseline is not None:
+        with open(arguments.baseline, "r") as f:
+            baseline = json.load(f)
+
+    report = run_benchmark(arguments.architectures, arguments.repeats, baseline, arguments.threshold,
+                           payload_search=arguments.payload_search, atmosphere_model=arguments.atmosphere_model,
+                           fidelity=arguments.fidelity)
+    print(summary(report))
+
+    for path in (arguments.output, arguments.save_baseline):
+        if path is not None:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+
+    sys.exit(0 if report["golden_passed"] and not (arguments.fail_on_slowdown and report["slowdowns"]) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""Catalog of the engines and propellants shared by the tools. Every engine and propellant is a row of a table
+and is identified by its integer code (its row), and each property is a column indexed by the codes, for
+example THRUST[RS68]. Adding an engine only needs a new row of ENGINE_TABLE (its tag in the XML files is its
+name).
+
+The engines of the stages of the XML files are read by launcher.model."""
+
+# Propulsion types: tag of the engine group in the XML files, and engine production cost (TRANSCOST, page 125
+# for solid and 129 for liquid motors): COST_FACTOR * (engine mass) ** COST_EXPONENT in work-years per engine
+LIQUID, SOLID = 0, 1
+KIND_NAMES = ("Liquid", "Solid")
+COST_FACTOR = (5.16, 2.3)
+COST_EXPONENT = (0.45, 0.399)
+
+# Propellants: name, density (kg/m^3), correction for ullage volume and cost ($/kg)
+PBAN, HTPB1912, HTPB_APCP, LOX, LH2 = range(5)
+PROPELLANT_TABLE = [("PBAN", 1715, 1, 5),
+                    ("HTPB1912", 1810, 1, 5),
+                    ("HTPB_APCP", 1650, 1, 5),
+                    ("LOX", 1140, 0.94, 0.27),
+                    ("LH2", 71, 0.94, 6.1)]
+PROPELLANT_NAMES, DENSITY, ULLAGE_CORRECTION, PROPELLANT_COST = zip(*PROPELLANT_TABLE)
+
+# Engines: name, propulsion type, thrust (N), mass flow (kg/s), nozzle expansion ratio, fuel (or solid
+# propellant) and oxidizer (propellant codes, -1 if none), oxidizer to fuel mass ratio and reliability beta
+VULCAIN, RS68, SIVB, SRB, P80, GEM60 = range(6)
+ENGINE_TABLE = [("VULCAIN", LIQUID, 0.8e6, 188.33, 45, LH2, LOX, 7.937, 5),
+                ("RS68", LIQUID, 2.891e6, 807.39, 21.5, LH2, LOX, 7.937, 5),
+                ("SIVB", LIQUID, 0.486e6, 247, 28, LH2, LOX, 7.937, 5),
+                ("SRB", SOLID, 12.45e6, 5290, 0, PBAN, -1, 0, 8),
+                ("P80", SOLID, 2.1e6, 764, 0, HTPB1912, -1, 0, 8),
+                ("GEM60", SOLID, 1.245e6, 463.18, 0, HTPB_APCP, -1, 0, 8)]
+ENGINE_NAMES, KIND, THRUST, MDOT, EXPANSION_RATIO, FUEL, OXIDIZER, MIXTURE_RATIO, RELIABILITY_BETA = \
+    zip(*ENGINE_TABLE)
+
+ENGINE_CODES = {name: code for code, name in enumerate(ENGINE_NAMES)}
+LIQUID_ENGINES = tuple(code for code in range(len(ENGINE_NAMES)) if KIND[code] == LIQUID)
+SOLID_ENGINES = tuple(code for code in range(len(ENGINE_NAMES)) if KIND[code] == SOLID)
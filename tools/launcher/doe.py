@@ -0,0 +1,236 @@
+"""Design of experiments around an architecture of "XML files". The continuous variables (stage lengths, L_D and
+cone angle or ellipse length ratio) are sampled with a Latin hypercube or a Sobol sequence, and the discrete
+choices (engine type and number of engines of each stage, head shape) are combined in a full factorial, each
+combination with all the continuous samples.
+
+The samples are written first to a plan file (the design table of launcher.batch plus a sample column). The
+run evaluates the plan in parallel and appends every finished sample to the results file, which is also the
+checkpoint: running it again evaluates only the samples that are not in the results file yet. Usage:
+
+    python doe.py plan "../../XML files/2stages.xml" plan.csv --samples 256 --method sobol [--engines 1 2]
+    python doe.py run plan.csv results.csv [--workers N] [--cache FILE]"""
+
+import argparse
+import csv
+import itertools
+import os
+import sys
+import time
+import numpy as np
+from scipy.stats import qmc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from launcher import batch
+from launcher.mda import read_design
+from launcher.result_cache import ResultCache
+
+
+def design_space(design, spread=0.2, engines=None, engine_types=None, head_shapes=None):
+    """Base row of the design table and variables of a design of experiments around a design.
+
+    - continuous: {column: (low, high)}, the stage lengths, L_D and head parameter within +-spread (relative).
+    - discrete: {column: choices}, the number of engines (engines) and engine types (engine_types) of every
+      stage and the head shapes, if given."""
+
+    base = batch.row_from_design(design)
+    continuous = {}
+    discrete = {}
+
+    for index in range(1, len(design["stages"]) + 1):
+        length = base["stage{INDEX}_length".format(INDEX=index)]
+        continuous["stage{INDEX}_length".format(INDEX=index)] = (length * (1 - spread), length * (1 + spread))
+        if engines is not None:
+            discrete["stage{INDEX}_engines".format(INDEX=index)] = list(engines)
+        if engine_types is not None:
+            discrete["stage{INDEX}_engine".format(INDEX=index)] = list(engine_types)
+
+    continuous["l_d"] = (base["l_d"] * (1 - spread), base["l_d"] * (1 + spread))
+
+    shapes = head_shapes if head_shapes is not None else [design["head_shape"]]
+    if head_shapes is not None:
+        discrete["head_shape"] = list(head_shapes)
+    if "Cone" in shapes:
+        cone_angle = base["cone_angle"] if base["cone_angle"] > 0 else 20
+        continuous["cone_angle"] = (cone_angle * (1 - spread), cone_angle * (1 + spread))
+    if "Elliptical" in shapes:
+        l_ratio = base["l_ratio"] if base["l_ratio"] > 0 else 0.15
+        continuous["l_ratio"] = (l_ratio * (1 - spread), l_ratio * (1 + spread))
+
+    return base, continuous, discrete
+
+
+def unit_samples(samples, dimensions, method="lhs", seed=0):
+    """Samples in the unit hypercube with a Latin hypercube ("lhs") or a scrambled Sobol sequence ("sobol")."""
+
+    if method == "lhs":
+        return qmc.LatinHypercube(d=dimensions, seed=seed).random(samples)
+    elif method == "sobol":
+        sampler = qmc.Sobol(d=dimensions, seed=seed)
+        exponent = int(np.log2(samples))
+        if 2 ** exponent == samples:    # Balanced sequence
+            return sampler.random_base2(exponent)
+        return sampler.random(samples)
+    else:
+        raise ValueError("Unknown sampling method: {METHOD}".format(METHOD=method))
+
+
+def generate_plan(base, continuous, discrete, samples, method="lhs", seed=0):
+    """Rows of the design table of the experiments: every combination of the discrete choices with the same
+    samples of the continuous variables."""
+
+    names = list(continuous)
+    if names:
+        unit = unit_samples(samples, len(names), method, seed)
+        low = np.array([continuous[name][0] for name in names])
+        high = np.array([continuous[name][1] for name in names])
+        values = qmc.scale(unit, low, high)
+    else:
+        values = np.zeros((1, 0))
+
+    rows = []
+    for combination in itertools.product(*discrete.values()):
+        for point in values:
+            row = dict(base)
+            row.update(zip(discrete, combination))
+            row.update(zip(names, point.tolist()))
+            row["sample"] = len(rows)
+            rows.append(row)
+
+    return rows
+
+
+def write_plan(path, rows):
+    """Writes the plan rows to a CSV file."""
+
+    if not rows:
+        raise ValueError("The plan has no samples: {PATH}".format(PATH=path))
+
+    columns = ["sample"] + [name for name in rows[0] if name != "sample"]
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def read_table(path):
+    """Rows of a plan or results CSV file. An incomplete last line (the run was killed while writing it) is
+    removed from the file."""
+
+    if not os.path.exists(path):
+        return []
+
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+    with open(path, "r", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def run_plan(plan_path, results_path, workers=None, cache=None, report_every=10, stream=sys.stdout, **options):
+    """Evaluation of the samples of a plan file that are not in the results file yet. The results are
+    appended (and flushed to disk) in the order they finish, with the throughput and estimated time to finish
+    the plan reported every report_every samples. The keyword arguments are passed to launcher.mda.evaluate.
+    It returns the number of samples evaluated."""
+
+    plan = read_table(plan_path)
+    if not plan:
+        raise ValueError("The plan file is missing or has no samples: {PATH}".format(PATH=plan_path))
+    finished = {row["sample"] for row in read_table(results_path)}
+    pending = [row for row in plan if row["sample"] not in finished]
+
+    columns = list(plan[0]) + list(batch.RESULT_COLUMNS)
+    new_file = not os.path.exists(results_path) or os.path.getsize(results_path) == 0
+
+    stream.write("{DONE}/{TOTAL} samples already evaluated\n".format(DONE=len(plan) - len(pending),
+                                                                    TOTAL=len(plan)))
+    start = time.time()
+
+    with open(results_path, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        if new_file:
+            writer.writeheader()
+
+        results = batch.evaluate_unordered(pending, workers, cache=cache, **options)
+        for count, (index, result) in enumerate(results, start=1):
+            writer.writerow(dict(pending[index], **result))
+            f.flush()
+            os.fsync(f.fileno())
+
+            if count % report_every == 0 or count == len(pending):
+                elapsed = time.time() - start
+                rate = count / elapsed
+                stream.write("{DONE}/{TOTAL} samples, {RATE:.2f} samples/s, ETA {ETA:.0f} s\n".format(
+                    DONE=len(plan) - len(pending) + count, TOTAL=len(plan), RATE=rate,
+                    ETA=(len(pending) - count) / rate))
+                stream.flush()
+
+    return len(pending)
+
+
+def results_columns(results_path, npz_path=None):
+    """Columns of a results file as arrays (numbers as floats, in the order of the samples), optionally saved
+    to a .npz file."""
+
+    rows = sorted(read_table(results_path), key=lambda row: int(row["sample"]))
+    columns = {}
+    for name in rows[0]:
+        values = [row[name] for row in rows]
+        try:
+            numbers = [float(value) if value != "" else np.nan for value in values]
+        except ValueError:
+            numbers = None
+        if numbers is None or all(value == "" for value in values):    # Text column (engines, errors...)
+            columns[name] = np.array(values)
+        else:
+            columns[name] = np.array(numbers)
+
+    if npz_path is not None:
+        np.savez(npz_path, **columns)
+
+    return columns
+
+
+def main():
+    """Command line entry point."""
+
+    parser = argparse.ArgumentParser(description="Design of experiments around a launcher architecture.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    plan_parser = commands.add_parser("plan", help="generate the plan of samples")
+    plan_parser.add_argument("architecture", help="input XML file of the base architecture")
+    plan_parser.add_argument("plan", help="CSV file for the plan")
+    plan_parser.add_argument("--samples", type=int, default=64, help="continuous samples per discrete combination")
+    plan_parser.add_argument("--method", choices=("lhs", "sobol"), default="lhs")
+    plan_parser.add_argument("--seed", type=int, default=0)
+    plan_parser.add_argument("--spread", type=float, default=0.2, help="relative range of the continuous variables")
+    plan_parser.add_argument("--engines", type=int, nargs="+", default=None, help="numbers of engines per stage")
+    plan_parser.add_argument("--engine-types", nargs="+", default=None, help="engine types of every stage")
+    plan_parser.add_argument("--head-shapes", nargs="+", default=None, help="head shapes")
+
+    run_parser = commands.add_parser("run", help="evaluate (or resume) a plan")
+    run_parser.add_argument("plan", help="CSV file of the plan")
+    run_parser.add_argument("results", help="CSV file of the results (appended)")
+    run_parser.add_argument("--workers", type=int, default=None)
+    run_parser.add_argument("--cache", default=None, help="result cache file (launcher.result_cache)")
+    run_parser.add_argument("--npz", default=None, help="also save the results columns to this .npz file")
+
+    arguments = parser.parse_args()
+
+    if arguments.command == "plan":
+        base, continuous, discrete = design_space(read_design(arguments.architecture), arguments.spread,
+                                                  arguments.engines, arguments.engine_types, arguments.head_shapes)
+        rows = generate_plan(base, continuous, discrete, arguments.samples, arguments.method, arguments.seed)
+        write_plan(arguments.plan, rows)
+        print("{COUNT} samples written".format(COUNT=len(rows)))
+    else:
+        cache = ResultCache(arguments.cache) if arguments.cache else None
+        run_plan(arguments.plan, arguments.results, arguments.workers, cache)
+        if arguments.npz is not None:
+            results_columns(arguments.results, arguments.npz)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,354 @@
+"""In-process multidisciplinary analysis of a launcher. The calculate functions of the tools are chained in memory
+with the data flow of the RCE workflow (RCE file/Space.wf), without processes or XML files in between:
+
+geometry -> engines of each stage (liquid or solid) -> propellant mass of each stage -> structural mass of each
+stage -> trajectory -> structural constraint, payload constraint and cost.
+
+A design is a dictionary with the contents of an input XML file (see read_design):
+
+    {"stages": [{"engine": "VULCAIN", "engines": 1, "length": 20.37}, ...],
+     "head_shape": "Sphere", "cone_angle": 0, "l_ratio": 0, "l_d": 11.32, "max_q": 50000.0,
+     "payload_density": 2810.0}
+
+evaluate_model runs the same analysis on a launcher.model read from an XML file, the tools reading their
+inputs from the model and writing their outputs to it. evaluate_sizing_batch is the vectorized version of the
+algebraic part of the analysis (everything but the trajectory and the constraints) for many designs at once,
+and evaluate_vectorized the whole analysis of a list of designs with the batched tools.
+
+The tool calculations can be memoized in a launcher.result_cache.ResultCache, and are profiled as spans when
+launcher.profiling is enabled.
+
+Running this module evaluates the example architectures of "XML files" and compares them with "result files"."""
+
+import os
+import sys
+import numpy as np
+
+TOOLS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+for tool_folder in ("Geometry_calculator", "Engine_liquid_Space", "Engine_solid_Space", "Mass_propellant_space",
+                    "Mass_structure", "Trajectory", "Structural_constraint", "Payload", "Cost"):
+    sys.path.append(os.path.join(TOOLS_FOLDER, tool_folder))
+
+import Geometry_calculator
+import Engine_liquid
+import Engine_solid
+import Mass_propellant
+import Mass_structure
+import Trajectory
+import Structural_constraint
+import Payload
+import Cost
+from launcher import catalog
+from launcher import model
+from launcher import profiling
+
+ENGINES = catalog.ENGINE_NAMES    # Engine of each code of launcher.catalog
+LIQUID_ENGINES = tuple(ENGINES[code] for code in catalog.LIQUID_ENGINES)
+SOLID_ENGINES = tuple(ENGINES[code] for code in catalog.SOLID_ENGINES)
+HEAD_SHAPES = Geometry_calculator.HEAD_SHAPES
+
+
+def read_design(path):
+    """Design dictionary from an input XML file, such as the ones of "XML files"."""
+
+    return design_from_model(model.read(path))
+
+
+def design_from_model(launcher):
+    """Design dictionary of a launcher model (launcher.model)."""
+
+    stages = [{"engine": catalog.ENGINE_NAMES[stage.engine], "engines": stage.engines, "length": stage.length}
+              for stage in launcher.stages]
+
+    return {"stages": stages,
+            "head_shape": launcher.head_shape,
+            "cone_angle": launcher.cone_angle if launcher.cone_angle is not None else 0,
+            "l_ratio": launcher.l_ratio if launcher.l_ratio is not None else 0,
+            "l_d": launcher.l_d,
+            "max_q": launcher.max_q,
+            "payload_density": launcher.payload_density}
+
+
+def engine_counts(stage, engine_names):
+    """Number of engines of each of the given types in a stage."""
+
+    return [stage["engines"] if stage["engine"] == name else 0 for name in engine_names]
+
+
+def call(cache, tool, function, *args, **kwargs):
+    """Calculation of a tool, through the result cache if there is one."""
+
+    with profiling.span(tool + ".calculate", "mda"):
+        if cache is None:
+            return function(*args, **kwargs)
+
+        return cache.call(tool, function, *args, **kwargs)
+
+
+def evaluate(design, cache=None, **trajectory_options):
+    """Evaluation of a design. The keyword arguments are passed to Trajectory.calculate (payload_search,
+    atmosphere_model, hint_cache, fidelity...). The structural constraint uses the same atmosphere model as
+    the trajectory. If a ResultCache is given, the results of the geometry, engines, masses, trajectory and
+    cost calculations are taken from it when their inputs were already calculated.
+
+    It returns a dictionary with the payload mass, total cost, structural and payload constraints, diameter,
+    the height and velocity vectors and the properties of each stage (thrust, mdot, expansion_ratio,
+    propellant, hydrogen, lox, casing, tanks, insulation, pumps and structure masses)."""
+
+    stages = design["stages"]
+    n_stages = len(stages)
+    atmosphere_model = trajectory_options.get("atmosphere_model", "table")
+
+    # Geometry
+    engines_stages = [catalog.ENGINE_CODES[stage["engine"]] for stage in stages]
+    diameter, surface_tip, volume_available, stages_volume, fuel_volumes, oxidizer_volumes, fuel_surfaces, \
+        oxidizer_surfaces = call(cache, "Geometry_calculator", Geometry_calculator.calculate, design["l_d"],
+                                 [stage["length"] for stage in stages], design["head_shape"], design["cone_angle"],
+                                 design["l_ratio"], engines_stages)
+
+    stage_results = []
+    for index, stage in enumerate(stages):
+        vulcain, rs68, s_ivb = engine_counts(stage, ("VULCAIN", "RS68", "SIVB"))
+        srb, p80, gem60 = engine_counts(stage, ("SRB", "P80", "GEM60"))
+
+        # Engines
+        if stage["engine"] in LIQUID_ENGINES:
+            thrust, expansion_ratio, mdot = call(cache, "Engine_liquid", Engine_liquid.calculate, vulcain, rs68, s_ivb)
+        else:
+            thrust, mdot = call(cache, "Engine_solid", Engine_solid.calculate, srb, p80, gem60)
+            expansion_ratio = 0
+
+        # Propellant mass
+        propellant_mass, h2_mass, lox_mass = call(cache, "Mass_propellant", Mass_propellant.calculate, srb, p80, gem60,
+                                                  stages_volume[index], fuel_volumes[index], oxidizer_volumes[index])
+
+        # Structural mass. The head structure is carried by the last stage
+        head_surface = surface_tip if index == n_stages - 1 else 0
+        mass_casing, mass_tank, mass_insulation, pumps_mass, structure_mass = call(
+            cache, "Mass_structure", Mass_structure.calculate, propellant_mass, thrust, expansion_ratio,
+            oxidizer_volumes[index], fuel_volumes[index], oxidizer_surfaces[index], fuel_surfaces[index], srb, p80,
+            gem60, vulcain, rs68, s_ivb, head_surface)
+
+        stage_results.append({"thrust": thrust, "mdot": mdot, "expansion_ratio": expansion_ratio,
+                              "propellant": propellant_mass, "hydrogen": h2_mass, "lox": lox_mass,
+                              "casing": mass_casing, "tanks": mass_tank, "insulation": mass_insulation,
+                              "pumps": pumps_mass, "structure": structure_mass})
+
+    # Trajectory
+    if design["head_shape"] == "Cone":
+        cone_angle, length_ratio = design["cone_angle"], 0
+    elif design["head_shape"] == "Elliptical":
+        cone_angle, length_ratio = 0, design["l_ratio"]
+    else:
+        cone_angle, length_ratio = 0, 0
+
+    mpay, h_vector, v_vector = call(
+        cache, "Trajectory", Trajectory.calculate, cone_angle, length_ratio, diameter,
+        [stage["thrust"] for stage in stage_results],
+        [stage["casing"] + stage["tanks"] + stage["insulation"] + stage["pumps"] + stage["structure"]
+         for stage in stage_results],
+        [stage["propellant"] + stage["hydrogen"] + stage["lox"] for stage in stage_results],
+        [stage["mdot"] for stage in stage_results], **trajectory_options)[:3]
+
+    # Constraints and cost
+    structural_constraint = Structural_constraint.calculate(design["max_q"], h_vector, v_vector, atmosphere_model)
+    payload_constraint = Payload.calculate(volume_available, mpay, design["payload_density"])
+    total_cost = call(cache, "Cost", Cost.calculate, [stage["engines"] for stage in stages],
+                      [stage["casing"] + stage["tanks"] + stage["insulation"] + stage["pumps"]
+                       for stage in stage_results],
+                      [stage["propellant"] for stage in stage_results], [stage["hydrogen"] for stage in stage_results],
+                      [stage["lox"] for stage in stage_results], [stage["structure"] for stage in stage_results])
+
+    return {"payload": float(mpay),
+            "cost": float(total_cost),
+            "structural_constraint": float(structural_constraint),
+            "payload_constraint": float(payload_constraint),
+            "diameter": diameter,
+            "height": h_vector,
+            "velocity": v_vector,
+            "stages": stage_results}
+
+
+def evaluate_model(launcher, cache=None, **trajectory_options):
+    """Evaluation of a launcher model (launcher.model) read from an input XML file. The tools read their inputs
+    from the model and write their outputs to it, in the order of the RCE workflow, so the file is parsed once
+    and the model ends with the contents of a result file (see launcher.model.write). The keyword arguments
+    and the result cache are the ones of evaluate. The peak dynamic pressure of the trajectory is not tracked,
+    so the structural constraint is calculated from the trajectory vectors as in evaluate."""
+
+    atmosphere_model = trajectory_options.get("atmosphere_model", "table")
+
+    Geometry_calculator.write_model(launcher, *call(cache, "Geometry_calculator", Geometry_calculator.calculate,
+                                                    *Geometry_calculator.read_model(launcher)))
+
+    for stage in launcher.stages:
+        if catalog.KIND[stage.engine] == catalog.LIQUID:
+            Engine_liquid.write_model(stage, *call(cache, "Engine_liquid", Engine_liquid.calculate,
+                                                   *Engine_liquid.read_model(stage)))
+        else:
+            Engine_solid.write_model(stage, *call(cache, "Engine_solid", Engine_solid.calculate,
+                                                  *Engine_solid.read_model(stage)))
+        Mass_propellant.write_model(stage, *call(cache, "Mass_propellant", Mass_propellant.calculate,
+                                                 *Mass_propellant.read_model(stage)))
+        Mass_structure.write_model(stage, *call(cache, "Mass_structure", Mass_structure.calculate,
+                                                *Mass_structure.read_model(stage)))
+
+    Trajectory.write_model(launcher, *call(cache, "Trajectory", Trajectory.calculate, *Trajectory.read_model(launcher),
+                                           **trajectory_options)[:3])
+    Structural_constraint.write_model(launcher, Structural_constraint.calculate(
+        *Structural_constraint.read_model(launcher), atmosphere_model))
+    Payload.write_model(launcher, Payload.calculate(*Payload.read_model(launcher)))
+    Cost.write_model(launcher, call(cache, "Cost", Cost.calculate, *Cost.read_model(launcher)))
+
+    return launcher
+
+
+def evaluate_sizing_batch(engine, engines, lengths, head_shape, cone_angle, l_ratio, l_d):
+    """Vectorized evaluation of the geometry, engines, propellant and structural masses and cost of N designs
+    of up to S stages, with the calculate_batch functions of the tools:
+
+    - engine: integer codes (N, S) of ENGINES. engines: numbers of engines (N, S), zero for the stages a design
+      does not have (its stages come first). lengths: stage lengths (N, S).
+    - head_shape: integer codes (N,) of HEAD_SHAPES. cone_angle, l_ratio, l_d: arrays (N,).
+
+    It returns a dictionary of arrays: diameter, surface_tip, volume_available and cost (N,), the stage
+    properties of evaluate (N, S, zero for the missing stages), and the structural and propellant masses of
+    the stages used by the trajectory (m_structural and m_propellant, (N, S))."""
+
+    engine = np.asarray(engine)
+    engines = np.asarray(engines)
+    present = engines > 0
+    engine = np.where(present, engine, -1)
+    counts = {name: np.where(engine == code, engines, 0) for code, name in enumerate(ENGINES)}
+    liquid = present & (np.asarray(catalog.KIND)[np.where(present, engine, 0)] == catalog.LIQUID)
+    lengths = np.where(present, lengths, 0.0)
+
+    # Geometry
+    diameter, surface_tip, volume_available, stages_volume, fuel_volumes, oxidizer_volumes, fuel_surfaces, \
+        oxidizer_surfaces = Geometry_calculator.calculate_batch(l_d, lengths, head_shape, cone_angle, l_ratio,
+                                                                engine)
+
+    # Engines
+    thrust_liquid, expansion_ratio, mdot_liquid = Engine_liquid.calculate_batch(counts["VULCAIN"], counts["RS68"],
+                                                                                counts["SIVB"])
+    thrust_solid, mdot_solid = Engine_solid.calculate_batch(counts["SRB"], counts["P80"], counts["GEM60"])
+    thrust = np.where(liquid, thrust_liquid, thrust_solid)
+    mdot = np.where(liquid, mdot_liquid, mdot_solid)
+
+    # Propellant and structural masses. The head structure is carried by the last stage
+    propellant, hydrogen, lox = Mass_propellant.calculate_batch(counts["SRB"], counts["P80"], counts["GEM60"],
+                                                                stages_volume, fuel_volumes, oxidizer_volumes)
+    last_stage = np.arange(engines.shape[1]) == present.sum(axis=1)[:, None] - 1
+    head_surface = np.where(last_stage, surface_tip[:, None], 0)
+    casing, tanks, insulation, pumps, structure = Mass_structure.calculate_batch(
+        propellant, thrust, expansion_ratio, oxidizer_volumes, fuel_volumes, oxidizer_surfaces, fuel_surfaces,
+        counts["SRB"], counts["P80"], counts["GEM60"], counts["VULCAIN"], counts["RS68"], counts["SIVB"],
+        head_surface)
+
+    # Cost
+    cost = Cost.calculate_batch(np.where(present, engines, 0), casing + tanks + insulation + pumps, propellant,
+                                hydrogen, lox, structure)
+
+    return {"diameter": diameter, "surface_tip": surface_tip, "volume_available": volume_available, "cost": cost,
+            "thrust": thrust, "mdot": mdot, "expansion_ratio": expansion_ratio, "propellant": propellant,
+            "hydrogen": hydrogen, "lox": lox, "casing": casing, "tanks": tanks, "insulation": insulation,
+            "pumps": pumps, "structure": structure,
+            "m_structural": casing + tanks + insulation + pumps + structure,
+            "m_propellant": propellant + hydrogen + lox}
+
+
+def design_arrays(designs):
+    """Arguments of evaluate_sizing_batch (engine, engines, lengths, head_shape, cone_angle, l_ratio and l_d
+    arrays) of a list of designs."""
+
+    n_designs = len(designs)
+    n_stages = max(len(design["stages"]) for design in designs)
+    engine = np.full((n_designs, n_stages), -1)
+    engines = np.zeros((n_designs, n_stages), dtype=int)
+    lengths = np.zeros((n_designs, n_stages))
+    for row, design in enumerate(designs):
+        for index, stage in enumerate(design["stages"]):
+            engine[row, index] = catalog.ENGINE_CODES[stage["engine"]]
+            engines[row, index] = stage["engines"]
+            lengths[row, index] = stage["length"]
+
+    return (engine, engines, lengths, np.array([HEAD_SHAPES.index(design["head_shape"]) for design in designs]),
+            np.array([design["cone_angle"] for design in designs], dtype=float),
+            np.array([design["l_ratio"] for design in designs], dtype=float),
+            np.array([design["l_d"] for design in designs], dtype=float))
+
+
+def design_trajectory_inputs(design, sizing, row):
+    """Inputs of Trajectory.calculate of a design (cone_angle, length_ratio, diameter, T_stages,
+    m_structural_stages, mp_stages and mdot_stages, with the head parameters of evaluate), from its row of the
+    evaluate_sizing_batch results."""
+
+    n_stages = len(design["stages"])
+    cone_angle = design["cone_angle"] if design["head_shape"] == "Cone" else 0
+    length_ratio = design["l_ratio"] if design["head_shape"] == "Elliptical" else 0
+
+    return (cone_angle, length_ratio, sizing["diameter"][row], sizing["thrust"][row, :n_stages],
+            sizing["m_structural"][row, :n_stages], sizing["m_propellant"][row, :n_stages],
+            sizing["mdot"][row, :n_stages])
+
+
+def evaluate_vectorized(designs, payload_tolerance=1.0, fidelity="ode", atmosphere_model="table"):
+    """Evaluation of a list of designs at once: evaluate_sizing_batch, then the batched trajectory
+    (Trajectory.calculate_batch, with its fidelity) and the batched structural constraint. It returns a list
+    with the payload, cost, structural and payload constraints of each design. The payloads match the ones of
+    evaluate within 0.2 % (see Trajectory.calculate_batch)."""
+
+    sizing = evaluate_sizing_batch(*design_arrays(designs))
+
+    # Trajectory, with the head parameters of evaluate
+    trajectory_inputs = [design_trajectory_inputs(design, sizing, row) for row, design in enumerate(designs)]
+    trajectories = Trajectory.calculate_batch(trajectory_inputs, payload_tolerance, fidelity=fidelity)
+
+    structural_constraints = Structural_constraint.calculate_batch(
+        [design["max_q"] for design in designs], [trajectory[1] for trajectory in trajectories],
+        [trajectory[2] for trajectory in trajectories], atmosphere_model=atmosphere_model)
+
+    return [{"payload": float(mpay),
+             "cost": float(sizing["cost"][row]),
+             "structural_constraint": float(structural_constraints[row]),
+             "payload_constraint": float(Payload.calculate(sizing["volume_available"][row], mpay,
+                                                           designs[row]["payload_density"]))}
+            for row, (mpay, _, _) in enumerate(trajectories)]
+
+
+def read_result(path):
+    """Payload, cost and constraints of a result file of the RCE workflow."""
+
+    launcher = model.read(path)
+
+    return {"payload": launcher.payload,
+            "cost": launcher.cost,
+            "structural_constraint": launcher.structural_constraint,
+            "payload_constraint": launcher.payload_constraint}
+
+
+def compare_examples(**trajectory_options):
+    """Evaluation of the example architectures and relative difference of each output with the result files.
+    The result files were obtained with payload_search="scan" and atmosphere_model="ambiance". With the scan
+    search the payload, payload constraint and cost are matched exactly, and the structural constraint within
+    0.2 % (the solver steps are now bounded, see MIN_SOLVER_STEPS in Trajectory). The exception is the payload
+    of the 3 stages launcher, one scan step (100 kg) higher: the original integration stepped over an
+    altitude crossing of the 57800 kg trajectory."""
+
+    repository_folder = os.path.join(TOOLS_FOLDER, os.pardir)
+    differences = {}
+
+    for name in ("1stage", "2stages", "3stages"):
+        design = read_design(os.path.join(repository_folder, "XML files", name + ".xml"))
+        reference = read_result(os.path.join(repository_folder, "result files", name + "_result.xml"))
+        results = evaluate(design, **trajectory_options)
+        differences[name] = {output: abs(results[output] - value) / max(abs(value), 1e-12)
+                             for output, value in reference.items()}
+
+    return differences
+
+
+if __name__ == '__main__':
+    for architecture, output_differences in compare_examples(payload_search="scan").items():
+        print(architecture, " ".join("{OUTPUT}: {DIFFERENCE:.1e}".format(OUTPUT=output, DIFFERENCE=difference)
+                                     for output, difference in output_differences.items()))
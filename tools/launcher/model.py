@@ -0,0 +1,207 @@
+"""Typed in-memory model of a launcher, with the contents of the XML files of the workflow (input, tool input,
+tool output and result files, see "result files"). It is read in one streaming pass over the file (read) and
+written back with the same layout (write), so a whole analysis can parse its file once: every tool reads its
+inputs from the model (read_model) and writes its outputs to it (write_model), see launcher.mda.evaluate_model.
+
+The values are attributes of a Launcher and of its Stage objects, None when the file does not have them. The
+engines of a stage are the list of their codes in launcher.catalog (engine_codes), in the order of the file; an
+engine that is not in the catalog is an error. The elements not described by STAGE_LAYOUT and LAUNCHER_LAYOUT
+are ignored."""
+
+from lxml import etree
+
+from launcher import catalog
+from launcher import trajectory_encoding
+
+# Elements of a stage in the order of the files: group, and tag and attribute of each value
+STAGE_LAYOUT = (("Engines", (("Thrust", "thrust"),
+                             ("Expansion_ratio", "expansion_ratio"),
+                             ("mdot", "mdot"))),
+                ("Geometry", (("Length", "length"),
+                              ("Stage_volume", "stage_volume"),
+                              ("Oxidizer_tank_volume", "oxidizer_tank_volume"),
+                              ("Fuel_tank_volume", "fuel_tank_volume"),
+                              ("Oxidizer_tank_surface", "oxidizer_tank_surface"),
+                              ("Fuel_tank_surface", "fuel_tank_surface"),
+                              ("Head_surface", "head_surface"))),
+                ("Mass", (("Propellant", "propellant"),
+                          ("Casing", "casing"),
+                          ("Hydrogen", "hydrogen"),
+                          ("LOX", "lox"),
+                          ("Tanks", "tanks"),
+                          ("Insulation", "insulation"),
+                          ("Pumps", "pumps"),
+                          ("Structure", "structure"))))
+
+# Elements of the launcher after the stages. Head_shape is text, Height and Velocity are the trajectory vectors
+# (launcher.trajectory_encoding) and Max_dynamic_pressure holds the peak dynamic pressure, its altitude and time
+LAUNCHER_LAYOUT = (("Geometry", (("Head_shape", "head_shape"),
+                                 ("Cone_angle", "cone_angle"),
+                                 ("L_ratio_ellipse", "l_ratio"),
+                                 ("L_D", "l_d"),
+                                 ("Diameter", "diameter"))),
+                   ("Structure", (("Max_q", "max_q"),
+                                  ("Constraint", "structural_constraint"))),
+                   ("Payload", (("Density", "payload_density"),
+                                ("Available_volume", "available_volume"),
+                                ("Mass", "payload"),
+                                ("Constraint", "payload_constraint"))),
+                   ("Trajectory", (("Height", "height"),
+                                   ("Velocity", "velocity"))),
+                   ("Cost", (("Total_cost", "cost"),)))
+MAX_DYNAMIC_PRESSURE_TAGS = ("Value", "Altitude", "Time")
+
+_STAGE_FIELDS = {(group, tag): name for group, fields in STAGE_LAYOUT for tag, name in fields}
+_LAUNCHER_FIELDS = {(group, tag): name for group, fields in LAUNCHER_LAYOUT for tag, name in fields}
+
+
+class Stage:
+    """Stage of a launcher: its engines and the values of STAGE_LAYOUT."""
+
+    __slots__ = ("uid", "engine_codes") + tuple(name for _, fields in STAGE_LAYOUT for _, name in fields)
+
+    def __init__(self, uid=None, engine_codes=()):
+
+        self.uid = uid    # UID attribute of the Stage element ("stage_1"...)
+        self.engine_codes = list(engine_codes)
+        for _, fields in STAGE_LAYOUT:
+            for _, name in fields:
+                setattr(self, name, None)
+
+    @property
+    def engine(self):
+        """Code of the engine of the stage, or -1 if the stage has no engines. With several engine types it is
+        the one the tools always chose: a liquid engine before a solid one, and the last code of its kind."""
+
+        if not self.engine_codes:
+            return -1
+
+        return max(self.engine_codes, key=lambda code: (catalog.KIND[code] == catalog.LIQUID, code))
+
+    @property
+    def engines(self):
+        """Number of engines."""
+
+        return len(self.engine_codes)
+
+    def engine_counts(self):
+        """Number of engines of each code (a list indexed by the engine codes)."""
+
+        counts = [0] * len(catalog.ENGINE_NAMES)
+        for code in self.engine_codes:
+            counts[code] = counts[code] + 1
+
+        return counts
+
+
+class Launcher:
+    """Launcher: its stages (a list of Stage) and the values of LAUNCHER_LAYOUT, and max_dynamic_pressure, the
+    (value, altitude, time) of the peak dynamic pressure of the trajectory."""
+
+    __slots__ = ("stages", "max_dynamic_pressure") + \
+        tuple(name for _, fields in LAUNCHER_LAYOUT for _, name in fields)
+
+    def __init__(self, stages=()):
+
+        self.stages = list(stages)
+        self.max_dynamic_pressure = None
+        for _, fields in LAUNCHER_LAYOUT:
+            for _, name in fields:
+                setattr(self, name, None)
+
+
+def read(path):
+    """Launcher model of an XML file, read in one streaming pass. Each top-level element is freed once read."""
+
+    launcher = Launcher()
+    stage = None
+    tags = []    # Tags from the root to the current element
+
+    for event, element in etree.iterparse(path, events=("start", "end")):
+        if event == "start":
+            tags.append(element.tag)
+            if len(tags) == 2 and element.tag == "Stage":
+                stage = Stage(element.get("UID"))
+                launcher.stages.append(stage)
+            continue
+
+        depth = len(tags)
+        if depth > 2 and tags[1] == "Stage":
+            if depth == 4 and (tags[2], tags[3]) in _STAGE_FIELDS:
+                setattr(stage, _STAGE_FIELDS[tags[2], tags[3]], float(element.text))
+            elif depth == 5 and tags[2] == "Engines" and tags[3] in catalog.KIND_NAMES:
+                if element.tag not in catalog.ENGINE_CODES:
+                    raise ValueError("Unknown engine: {ENGINE}".format(ENGINE=element.tag))
+                stage.engine_codes.append(catalog.ENGINE_CODES[element.tag])
+        elif depth == 3 and (tags[1], tags[2]) in _LAUNCHER_FIELDS:
+            name = _LAUNCHER_FIELDS[tags[1], tags[2]]
+            if name == "head_shape":
+                value = element.text.strip()
+            elif tags[1] == "Trajectory":
+                value = trajectory_encoding.decode(element, path)
+            else:
+                value = float(element.text)
+            setattr(launcher, name, value)
+        elif depth == 4 and tags[1:3] == ["Trajectory", "Max_dynamic_pressure"] and \
+                element.tag in MAX_DYNAMIC_PRESSURE_TAGS:
+            values = list(launcher.max_dynamic_pressure or (None,) * len(MAX_DYNAMIC_PRESSURE_TAGS))
+            values[MAX_DYNAMIC_PRESSURE_TAGS.index(element.tag)] = float(element.text)
+            launcher.max_dynamic_pressure = tuple(values)
+
+        tags.pop()
+        if depth == 2:
+            element.clear()
+
+    return launcher
+
+
+def write(launcher, path, encoding="text"):
+    """Writes a launcher model to an XML file with the layout of the result files. The values that are None
+    and the empty groups are left out. encoding is the one of the trajectory vectors (see
+    launcher.trajectory_encoding)."""
+
+    root = etree.Element("Rocket")
+
+    for stage in launcher.stages:
+        stage_element = etree.SubElement(root, "Stage")
+        if stage.uid is not None:
+            stage_element.set("UID", stage.uid)
+        for group, fields in STAGE_LAYOUT:
+            group_element = etree.SubElement(stage_element, group)
+            if group == "Engines":
+                kinds = {}    # Element of each propulsion type, in the order of the engines
+                for code in stage.engine_codes:
+                    kind = catalog.KIND_NAMES[catalog.KIND[code]]
+                    if kind not in kinds:
+                        kinds[kind] = etree.SubElement(group_element, kind)
+                    etree.SubElement(kinds[kind], catalog.ENGINE_NAMES[code])
+            write_fields(group_element, stage, fields)
+            if len(group_element) == 0:
+                stage_element.remove(group_element)
+
+    for group, fields in LAUNCHER_LAYOUT:
+        group_element = etree.SubElement(root, group)
+        if group == "Trajectory":
+            for tag, name in fields:
+                if getattr(launcher, name) is not None:
+                    trajectory_encoding.encode(etree.SubElement(group_element, tag), getattr(launcher, name),
+                                               encoding, path)
+            if launcher.max_dynamic_pressure is not None:
+                dynamic_pressure_element = etree.SubElement(group_element, "Max_dynamic_pressure")
+                for tag, value in zip(MAX_DYNAMIC_PRESSURE_TAGS, launcher.max_dynamic_pressure):
+                    etree.SubElement(dynamic_pressure_element, tag).text = str(value)
+        else:
+            write_fields(group_element, launcher, fields)
+        if len(group_element) == 0:
+            root.remove(group_element)
+
+    etree.ElementTree(root).write(path, pretty_print=True)
+
+
+def write_fields(element, values, fields):
+    """Adds to an element a child with the text of each (tag, attribute) of fields whose value is not None."""
+
+    for tag, name in fields:
+        value = getattr(values, name)
+        if value is not None:
+            etree.SubElement(element, tag).text = str(value)
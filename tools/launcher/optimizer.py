@@ -0,0 +1,307 @@
+"""Multi-objective optimization of the launcher with NSGA-II: the payload mass is maximized and the total cost
+minimized, with the structural and payload constraints satisfied (negative). The design space is mixed:
+
+- number of stages (1 to MAX_STAGES) and head shape (Cone, Sphere, Elliptical),
+- engine type and number of engines of each stage,
+- stage lengths, L_D, cone angle and ellipse length ratio.
+
+Every design is a vector of real genes (VARIABLES); the discrete genes are rounded when decoded, so the usual
+simulated binary crossover and polynomial mutation apply to all of them. Each generation is evaluated in
+parallel with launcher.batch, and the state of the optimization (including the random generator) is saved
+after every generation, so a run can be resumed and is reproducible for a given seed. Usage:
+
+    python optimizer.py front.csv [--generations 30] [--population 40] [--seed 0] [--workers N]
+                        [--checkpoint FILE] [--cache FILE]"""
+
+import argparse
+import csv
+import os
+import pickle
+import sys
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from launcher import batch
+from launcher.mda import ENGINES, HEAD_SHAPES
+from launcher.result_cache import ResultCache
+
+MAX_STAGES = 3
+
+# Genes: name, lower bound, upper bound and whether it is discrete
+VARIABLES = [("n_stages", 1, MAX_STAGES, True), ("head_shape", 0, len(HEAD_SHAPES) - 1, True),
+             ("l_d", 6, 20, False), ("cone_angle", 10, 40, False), ("l_ratio", 0.1, 0.3, False)]
+for stage_index in range(1, MAX_STAGES + 1):
+    VARIABLES = VARIABLES + [("stage{INDEX}_engine".format(INDEX=stage_index), 0, len(ENGINES) - 1, True),
+                             ("stage{INDEX}_engines".format(INDEX=stage_index), 1, 4, True),
+                             ("stage{INDEX}_length".format(INDEX=stage_index), 3, 40, False)]
+
+LOWER = np.array([variable[1] for variable in VARIABLES], dtype=float)
+UPPER = np.array([variable[2] for variable in VARIABLES], dtype=float)
+DISCRETE = np.array([variable[3] for variable in VARIABLES])
+# Discrete genes are real numbers within +-0.5 of their integer values
+GENE_LOWER = np.where(DISCRETE, LOWER - 0.499, LOWER)
+GENE_UPPER = np.where(DISCRETE, UPPER + 0.499, UPPER)
+
+
+def decode(genes, max_q=50000.0, payload_density=2810.0):
+    """Design dictionary (see launcher.mda) of a gene vector."""
+
+    values = dict(zip([variable[0] for variable in VARIABLES], np.where(DISCRETE, np.round(genes), genes)))
+
+    stages = []
+    for index in range(1, int(values["n_stages"]) + 1):
+        stages.append({"engine": ENGINES[int(values["stage{INDEX}_engine".format(INDEX=index)])],
+                       "engines": int(values["stage{INDEX}_engines".format(INDEX=index)]),
+                       "length": float(values["stage{INDEX}_length".format(INDEX=index)])})
+
+    head_shape = HEAD_SHAPES[int(values["head_shape"])]
+
+    return {"stages": stages,
+            "head_shape": head_shape,
+            "cone_angle": float(values["cone_angle"]) if head_shape == "Cone" else 0,
+            "l_ratio": float(values["l_ratio"]) if head_shape == "Elliptical" else 0,
+            "l_d": float(values["l_d"]),
+            "max_q": max_q,
+            "payload_density": payload_density}
+
+
+def evaluate_population(population, workers=None, cache=None, max_q=50000.0, payload_density=2810.0):
+    """Objectives (-payload, cost) and constraint violation of every gene vector of a population. The
+    violation is the sum of the positive constraints, the structural one relative to max_q and the payload one
+    in m^3, plus 1 if the launcher does not reach the orbit (no payload); failed evaluations have an infinite
+    violation."""
+
+    designs = [decode(genes, max_q, payload_density) for genes in population]
+    results = list(batch.evaluate_batch(designs, workers, cache=cache))
+
+    objectives = np.array([[-result["payload"], result["cost"]] for result in results])
+    violation = np.array([max(result["structural_constraint"], 0) / max_q + max(result["payload_constraint"], 0)
+                          + (result["payload"] <= 0) for result in results])
+    failed = np.array([result["error"] != "" for result in results]) | np.isnan(objectives).any(axis=1)
+    objectives[failed] = np.inf
+    violation[failed] = np.inf
+
+    return objectives, violation, results
+
+
+def dominates(objectives_a, violation_a, objectives_b, violation_b):
+    """Constrained domination: a feasible design dominates an infeasible one, an infeasible design dominates
+    another one with a larger violation, and feasible designs are compared with Pareto domination."""
+
+    if violation_a > 0 or violation_b > 0:
+        return violation_a < violation_b
+    return bool(np.all(objectives_a <= objectives_b) and np.any(objectives_a < objectives_b))
+
+
+def non_dominated_sort(objectives, violation):
+    """Fronts of the population (lists of indices), the first one being the non-dominated designs."""
+
+    size = len(objectives)
+    dominated_by = [[] for _ in range(size)]
+    domination_count = np.zeros(size, dtype=int)
+
+    for i in range(size):
+        for j in range(i + 1, size):
+            if dominates(objectives[i], violation[i], objectives[j], violation[j]):
+                dominated_by[i].append(j)
+                domination_count[j] = domination_count[j] + 1
+            elif dominates(objectives[j], violation[j], objectives[i], violation[i]):
+                dominated_by[j].append(i)
+                domination_count[i] = domination_count[i] + 1
+
+    fronts = [[index for index in range(size) if domination_count[index] == 0]]
+    while fronts[-1]:
+        next_front = []
+        for i in fronts[-1]:
+            for j in dominated_by[i]:
+                domination_count[j] = domination_count[j] - 1
+                if domination_count[j] == 0:
+                    next_front.append(j)
+        fronts.append(next_front)
+
+    return fronts[:-1]
+
+
+def crowding_distance(objectives):
+    """Crowding distance of the designs of a front."""
+
+    size, n_objectives = objectives.shape
+    distance = np.zeros(size)
+    if size <= 2:
+        return np.full(size, np.inf)
+
+    for objective in range(n_objectives):
+        order = np.argsort(objectives[:, objective], kind="stable")
+        values = objectives[order, objective]
+        distance[order[0]] = np.inf
+        distance[order[-1]] = np.inf
+        span = values[-1] - values[0]
+        if span > 0 and np.isfinite(span):
+            distance[order[1:-1]] = distance[order[1:-1]] + (values[2:] - values[:-2]) / span
+
+    return distance
+
+
+def rank_population(objectives, violation):
+    """Rank (front index) and crowding distance of every design."""
+
+    rank = np.zeros(len(objectives), dtype=int)
+    crowding = np.zeros(len(objectives))
+    for front_index, front in enumerate(non_dominated_sort(objectives, violation)):
+        rank[front] = front_index
+        crowding[front] = crowding_distance(np.where(np.isfinite(objectives[front]), objectives[front], 1e300))
+
+    return rank, crowding
+
+
+def tournament(rng, rank, crowding, count):
+    """Indices of the parents chosen by binary tournaments (lower rank, then larger crowding distance)."""
+
+    candidates = rng.integers(0, len(rank), size=(count, 2))
+    first, second = candidates[:, 0], candidates[:, 1]
+    first_wins = (rank[first] < rank[second]) | ((rank[first] == rank[second]) & (crowding[first] >= crowding[second]))
+
+    return np.where(first_wins, first, second)
+
+
+def crossover(rng, parent_a, parent_b, probability=0.9, eta=15):
+    """Simulated binary crossover of two gene vectors."""
+
+    child_a, child_b = parent_a.copy(), parent_b.copy()
+    if rng.random() > probability:
+        return child_a, child_b
+
+    u = rng.random(len(parent_a))
+    beta = np.where(u <= 0.5, (2 * u) ** (1 / (eta + 1)), (1 / (2 * (1 - u))) ** (1 / (eta + 1)))
+    swap = rng.random(len(parent_a)) < 0.5    # Genes crossed over
+    child_a = np.where(swap, 0.5 * ((1 + beta) * parent_a + (1 - beta) * parent_b), parent_a)
+    child_b = np.where(swap, 0.5 * ((1 - beta) * parent_a + (1 + beta) * parent_b), parent_b)
+
+    return np.clip(child_a, GENE_LOWER, GENE_UPPER), np.clip(child_b, GENE_LOWER, GENE_UPPER)
+
+
+def mutate(rng, genes, eta=20):
+    """Polynomial mutation, each gene with probability 1 / number of genes."""
+
+    mutated = rng.random(len(genes)) < 1 / len(genes)
+    u = rng.random(len(genes))
+    delta = np.where(u < 0.5, (2 * u) ** (1 / (eta + 1)) - 1, 1 - (2 * (1 - u)) ** (1 / (eta + 1)))
+    genes = np.where(mutated, genes + delta * (GENE_UPPER - GENE_LOWER), genes)
+
+    return np.clip(genes, GENE_LOWER, GENE_UPPER)
+
+
+def save_state(path, state):
+    """Writes the optimization state atomically, so an interrupted run keeps the previous generation."""
+
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        pickle.dump(state, f)
+    os.replace(temporary_path, path)
+
+
+def optimize(generations=30, population_size=40, seed=0, workers=None, checkpoint=None, cache=None,
+             max_q=50000.0, payload_density=2810.0, stream=sys.stdout):
+    """NSGA-II optimization. If the checkpoint file exists the optimization continues from the generation saved
+    in it, and the state is saved to it after every generation. It returns the final state: a dictionary with
+    the genes, objectives, violations and results of the population."""
+
+    if checkpoint is not None and os.path.exists(checkpoint):
+        with open(checkpoint, "rb") as f:
+            state = pickle.load(f)
+        rng = np.random.default_rng()
+        rng.bit_generator.state = state["rng"]
+        stream.write("Resumed at generation {GENERATION}\n".format(GENERATION=state["generation"]))
+    else:
+        rng = np.random.default_rng(seed)
+        genes = GENE_LOWER + rng.random((population_size, len(VARIABLES))) * (GENE_UPPER - GENE_LOWER)
+        objectives, violation, results = evaluate_population(genes, workers, cache, max_q, payload_density)
+        state = {"generation": 0, "genes": genes, "objectives": objectives, "violation": violation,
+                 "results": results}
+
+    while state["generation"] < generations:
+        genes, objectives, violation = state["genes"], state["objectives"], state["violation"]
+        rank, crowding = rank_population(objectives, violation)
+
+        # Offspring
+        parents = tournament(rng, rank, crowding, len(genes))
+        children = []
+        for index in range(0, len(parents), 2):
+            child_a, child_b = crossover(rng, genes[parents[index]], genes[parents[(index + 1) % len(parents)]])
+            children.extend([mutate(rng, child_a), mutate(rng, child_b)])
+        children = np.array(children[:len(genes)])
+        children_objectives, children_violation, children_results = evaluate_population(
+            children, workers, cache, max_q, payload_density)
+
+        # Survivors of parents and offspring
+        all_genes = np.vstack((genes, children))
+        all_objectives = np.vstack((objectives, children_objectives))
+        all_violation = np.concatenate((violation, children_violation))
+        all_results = state["results"] + children_results
+        rank, crowding = rank_population(all_objectives, all_violation)
+        survivors = np.lexsort((-crowding, rank))[:len(genes)]
+
+        state = {"generation": state["generation"] + 1,
+                 "genes": all_genes[survivors],
+                 "objectives": all_objectives[survivors],
+                 "violation": all_violation[survivors],
+                 "results": [all_results[index] for index in survivors],
+                 "rng": rng.bit_generator.state}
+        if checkpoint is not None:
+            save_state(checkpoint, state)
+
+        feasible = state["violation"] == 0
+        best_payload = -state["objectives"][feasible, 0].min() if feasible.any() else np.nan
+        stream.write("Generation {GENERATION}: {FEASIBLE} feasible designs, maximum payload {PAYLOAD:.0f} kg\n".format(
+            GENERATION=state["generation"], FEASIBLE=int(feasible.sum()), PAYLOAD=best_payload))
+        stream.flush()
+
+    return state
+
+
+def pareto_front(state, max_q=50000.0, payload_density=2810.0):
+    """Feasible non-dominated designs of a state, as rows of the design table with their results, sorted by
+    payload."""
+
+    fronts = non_dominated_sort(state["objectives"], state["violation"])
+    rows = []
+    for index in fronts[0] if fronts else []:
+        if state["violation"][index] == 0:
+            row = batch.row_from_design(decode(state["genes"][index], max_q, payload_density))
+            row.update(state["results"][index])
+            rows.append(row)
+
+    return sorted(rows, key=lambda row: row["payload"])
+
+
+def main():
+    """Command line entry point."""
+
+    parser = argparse.ArgumentParser(description="NSGA-II optimization of the launcher (payload and cost).")
+    parser.add_argument("front", help="CSV file for the Pareto front")
+    parser.add_argument("--generations", type=int, default=30)
+    parser.add_argument("--population", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--checkpoint", default=None, help="state file, saved every generation and resumed")
+    parser.add_argument("--cache", default=None, help="result cache file (launcher.result_cache)")
+    arguments = parser.parse_args()
+
+    cache = ResultCache(arguments.cache) if arguments.cache else None
+    state = optimize(arguments.generations, arguments.population, arguments.seed, arguments.workers,
+                     arguments.checkpoint, cache)
+
+    rows = pareto_front(state)
+    columns = []
+    for row in rows:
+        columns.extend(name for name in row if name not in columns)
+    with open(arguments.front, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    print("{COUNT} designs in the Pareto front".format(COUNT=len(rows)))
+
+
+if __name__ == '__main__':
+    main()
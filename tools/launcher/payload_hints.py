@@ -0,0 +1,206 @@
+"""Warm start of the trajectory payload search. In an optimization the same architecture (number of stages,
+engines and head shape) is evaluated many times with small changes of the continuous variables, and the
+maximum payload changes little between these designs. The cache stores the converged payload of each design
+and gives a starting bracket around it to the next search of the same architecture with nearby continuous
+variables.
+
+The designs are the inputs of Trajectory.calculate (cone_angle, length_ratio, diameter, T_stages,
+m_structural_stages, mp_stages, mdot_stages). The architecture signature is the head shape plus the thrust
+and mass flow of every stage (given by the engines and their number), and the continuous variables (diameter,
+head parameter and stage masses) are quantized in logarithmic bins."""
+
+import json
+import math
+import os
+from collections import OrderedDict
+
+
+class PayloadHintCache:
+    """Bounded LRU cache of converged payloads, optionally persisted in a JSON file.
+
+    - resolution: relative width of the bins of the continuous variables.
+    - neighbourhood: maximum distance in bins (on any variable) for a stored design to be used as hint when
+      the bin of the design has no entry.
+    - bracket_width: relative half-width of the starting bracket around the stored payload."""
+
+    def __init__(self, path=None, max_entries=10000, resolution=0.02, neighbourhood=2, bracket_width=0.03):
+
+        self.path = path
+        self.max_entries = max_entries
+        self.resolution = resolution
+        self.neighbourhood = neighbourhood
+        self.bracket_width = bracket_width
+
+        self.entries = OrderedDict()    # (signature, bins): [payload, low, high], least recently used first
+        self.bins_per_signature = {}
+
+        # Statistics
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.cold_searches = 0
+        self.cold_integrations = 0
+        self.warm_searches = 0
+        self.warm_integrations = 0
+
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def key(self, design):
+        """Architecture signature and bins of the continuous variables of a design."""
+
+        cone_angle, length_ratio, diameter, T_stages, m_structural_stages, mp_stages, mdot_stages = design
+
+        if cone_angle > 0:
+            head_shape = "Cone"
+        elif length_ratio > 0:
+            head_shape = "Elliptical"
+        else:
+            head_shape = "Sphere"
+
+        signature = (head_shape,) + tuple((float(T), float(mdot)) for T, mdot in zip(T_stages, mdot_stages))
+        continuous = [diameter, cone_angle + length_ratio] + list(m_structural_stages) + list(mp_stages)
+        bins = tuple(self.quantize(value) for value in continuous)
+
+        return signature, bins
+
+    def quantize(self, value):
+        """Logarithmic bin of a positive value (zero and negative values share the bin None)."""
+
+        if value <= 0:
+            return None
+        return int(round(math.log(value) / math.log(1 + self.resolution)))
+
+    def lookup(self, design):
+        """Starting bracket (low, high) for the payload search of a design, or None if no stored design is
+        close enough. The stored designs without payload are not used: their bracket (0, 0) would not narrow
+        the search."""
+
+        signature, bins = self.key(design)
+
+        entry = self.entries.get((signature, bins))
+        if entry is not None and entry[0] > 0:
+            self.hits = self.hits + 1
+            self.entries.move_to_end((signature, bins))
+            return entry[1], entry[2]
+
+        nearest = None
+        nearest_distance = self.neighbourhood + 1
+        for stored_bins in self.bins_per_signature.get(signature, ()):
+            distance = bins_distance(bins, stored_bins)
+            if distance < nearest_distance and self.entries[(signature, stored_bins)][0] > 0:
+                nearest = stored_bins
+                nearest_distance = distance
+
+        if nearest is None:
+            self.misses = self.misses + 1
+            return None
+
+        self.near_hits = self.near_hits + 1
+        self.entries.move_to_end((signature, nearest))
+        entry = self.entries[(signature, nearest)]
+
+        return entry[1], entry[2]
+
+    def store(self, design, payload, integrations, warm):
+        """Stores the converged payload of a design. integrations is the number of trajectory integrations of
+        its search, and warm tells if the search was started from a hint."""
+
+        if warm:
+            self.warm_searches = self.warm_searches + 1
+            self.warm_integrations = self.warm_integrations + integrations
+        else:
+            self.cold_searches = self.cold_searches + 1
+            self.cold_integrations = self.cold_integrations + integrations
+
+        signature, bins = self.key(design)
+        payload = float(payload)
+        bracket = [payload * (1 - self.bracket_width), payload * (1 + self.bracket_width)]
+
+        self.add((signature, bins), [payload] + bracket)
+
+    def add(self, key, entry):
+        """Adds an entry, evicting the least recently used ones above max_entries."""
+
+        signature, bins = key
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        self.bins_per_signature.setdefault(signature, set()).add(bins)
+
+        while len(self.entries) > self.max_entries:
+            (old_signature, old_bins), old_entry = self.entries.popitem(last=False)
+            self.bins_per_signature[old_signature].discard(old_bins)
+            if not self.bins_per_signature[old_signature]:
+                del self.bins_per_signature[old_signature]
+
+    def statistics(self):
+        """Hit rate of the lookups and trajectory integrations saved by the warm searches, estimated with the
+        average number of integrations of the cold searches."""
+
+        lookups = self.hits + self.near_hits + self.misses
+        hit_rate = (self.hits + self.near_hits) / lookups if lookups > 0 else 0
+        if self.cold_searches > 0:
+            cold_average = self.cold_integrations / self.cold_searches
+            integrations_saved = cold_average * self.warm_searches - self.warm_integrations
+        else:
+            integrations_saved = 0
+
+        return {"entries": len(self.entries),
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "hit_rate": hit_rate,
+                "cold_searches": self.cold_searches,
+                "cold_integrations": self.cold_integrations,
+                "warm_searches": self.warm_searches,
+                "warm_integrations": self.warm_integrations,
+                "integrations_saved": integrations_saved}
+
+    def save(self, path=None):
+        """Writes the entries (in LRU order) and the statistics to a JSON file. The file is replaced
+        atomically, so an interrupted run does not leave it corrupted."""
+
+        path = self.path if path is None else path
+
+        data = {"resolution": self.resolution,
+                "entries": [[list(signature), list(bins), entry] for (signature, bins), entry in self.entries.items()],
+                "statistics": self.statistics()}
+
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(data, f)
+        os.replace(temporary_path, path)
+
+    def load(self, path):
+        """Reads the entries of a JSON file written by save. Entries quantized with a different resolution are
+        discarded."""
+
+        with open(path, "r") as f:
+            data = json.load(f)
+
+        if data.get("resolution") != self.resolution:
+            return
+
+        for signature, bins, entry in data["entries"]:
+            signature = (signature[0],) + tuple(tuple(stage) for stage in signature[1:])
+            self.add((signature, tuple(bins)), entry)
+
+        statistics = data.get("statistics", {})
+        for name in ("hits", "near_hits", "misses", "cold_searches", "cold_integrations", "warm_searches",
+                     "warm_integrations"):
+            setattr(self, name, statistics.get(name, 0))
+
+
+def bins_distance(bins_a, bins_b):
+    """Largest bin difference between two designs. Designs with a zero variable where the other one is not
+    zero are infinitely far."""
+
+    distance = 0
+    for bin_a, bin_b in zip(bins_a, bins_b):
+        if bin_a is None or bin_b is None:
+            if bin_a != bin_b:
+                return math.inf
+        else:
+            distance = max(distance, abs(bin_a - bin_b))
+
+    return distance
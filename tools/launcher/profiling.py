@@ -0,0 +1,255 @@
+"""Opt-in profiling of the tools. When it is enabled the tools record the wall time of their phases (read_input,
+calculate, write_output, and the integrations of the trajectory) as spans, and counters such as the solve_ivp
+calls, right-hand side evaluations, atmosphere lookups and payload search simulations of the trajectory.
+
+It is enabled with the environment variable LAUNCHER_PROFILE or with enable(path):
+
+- a path ending with .json is a trace file. The events of the process are added to the ones already in it, so
+  the tools of a workflow run one after the other can share it (use an absolute path, as RCE runs every tool
+  in its own folder).
+- any other path is a folder where each process writes its own trace-<pid>.json, for parallel runs (launcher
+  batch, doe, optimizer). They are merged with "python profiling.py merge folder trace.json".
+
+The traces are in the Trace Event Format of chrome://tracing and Perfetto (ui.perfetto.dev), written when the
+process exits. The events are appended to the trace files in its JSON array format (an unterminated array, one
+event per line) with a single write in append mode, so processes writing the same file at the same time do not
+lose events. When profiling is disabled span returns a shared empty context manager and count returns at
+once, and counted returns the function itself, so the tools run as fast as without instrumentation. Usage:
+
+    python profiling.py merge folder trace.json
+    python profiling.py summary trace.json"""
+
+import argparse
+import atexit
+import contextlib
+import glob
+import json
+import multiprocessing.util
+import os
+import threading
+import time
+
+_NULL_SPAN = contextlib.nullcontext()
+
+_path = None    # Trace file or folder, None if disabled
+_pid = None    # Process of the recorded events (a forked process starts with none)
+_events = []
+_counters = {}
+
+
+def enabled():
+    """Whether profiling is enabled."""
+
+    return _path is not None
+
+
+def enable(path):
+    """Enables profiling, with the trace written to path (a .json file or a folder) when the process exits."""
+
+    global _path, _pid, _events, _counters
+
+    if _path is None:
+        atexit.register(write)
+        multiprocessing.util.Finalize(None, write, exitpriority=10)    # Worker processes do not run atexit
+    _path = path
+    _pid = os.getpid()
+    _events = []
+    _counters = {}
+
+
+def _check_process():
+    """Discards the events inherited from the parent process in a forked process, which writes its own ones
+    when it exits."""
+
+    global _pid, _events, _counters
+
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _events = []
+        _counters = {}
+        multiprocessing.util.Finalize(None, write, exitpriority=10)
+
+
+class _Span:
+    """Context manager recording a complete event ("X") of the trace."""
+
+    def __init__(self, name, category, args):
+
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+
+        self.timestamp = time.time_ns() / 1000
+        self.start = time.perf_counter()
+
+        return self
+
+    def __exit__(self, *exception):
+
+        duration = (time.perf_counter() - self.start) * 1e6
+        _check_process()
+        _events.append({"name": self.name, "cat": self.category, "ph": "X", "ts": self.timestamp, "dur": duration,
+                        "pid": _pid, "tid": threading.get_ident(), "args": self.args})
+
+
+def span(name, category="tool", **args):
+    """Context manager timing a block as a span of the trace, with optional arguments shown by the viewers."""
+
+    if _path is None:
+        return _NULL_SPAN
+
+    return _Span(name, category, args)
+
+
+def count(name, value=1):
+    """Adds value to a counter."""
+
+    if _path is None:
+        return
+
+    _check_process()
+    _counters[name] = _counters.get(name, 0) + value
+
+
+def counted(function, name):
+    """Function counting its calls in a counter if profiling is enabled, or the function itself otherwise."""
+
+    if _path is None:
+        return function
+
+    def counted_function(*args, **kwargs):
+        count(name)
+        return function(*args, **kwargs)
+
+    return counted_function
+
+
+def write():
+    """Writes the events and counters recorded since the last write, with a counter event ("C") per counter."""
+
+    global _events, _counters
+
+    if _path is None:
+        return
+    _check_process()
+    if not _events and not _counters:
+        return
+
+    events = _events + [{"name": name, "ph": "C", "ts": time.time_ns() / 1000, "pid": _pid,
+                         "args": {"value": value}} for name, value in sorted(_counters.items())]
+    if _path.endswith(".json"):
+        path = _path
+    else:
+        os.makedirs(_path, exist_ok=True)
+        path = os.path.join(_path, "trace-{PID}.json".format(PID=_pid))
+
+    if not os.path.exists(path):
+        create(path, "[\n")
+    append(path, "".join(json.dumps(event) + ",\n" for event in events))
+
+    _events = []
+    _counters = {}
+
+
+def create(path, text):
+    """Creates a file with its text at once, unless it exists (for example created by another process): the
+    text is written to a temporary file which is then linked to path, which fails if it exists."""
+
+    temporary_path = "{PATH}.{PID}.tmp".format(PATH=path, PID=os.getpid())
+    with open(temporary_path, "w") as f:
+        f.write(text)
+    try:
+        os.link(temporary_path, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(temporary_path)
+
+
+def append(path, text):
+    """Appends text to a file with a single write in append mode, which the writes of other processes do not
+    interleave."""
+
+    descriptor = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(descriptor, text.encode())
+    finally:
+        os.close(descriptor)
+
+
+def read_trace(path):
+    """Trace of a file, in the JSON object format or in the JSON array format of write."""
+
+    with open(path, "r") as f:
+        text = f.read().strip()
+
+    if text.startswith("["):
+        return {"traceEvents": json.loads(text.rstrip(",]").rstrip() + "]")}
+
+    return json.loads(text)
+
+
+def merge(folder, path):
+    """Merges the trace files of a folder into one trace file."""
+
+    events = []
+    for trace_path in sorted(glob.glob(os.path.join(folder, "*.json"))):
+        events.extend(read_trace(trace_path)["traceEvents"])
+
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    return len(events)
+
+
+def summary(trace):
+    """Total time (seconds) and number of calls of every span (name and arguments, such as the phase and stage
+    of the trajectory integrations), and total of every counter, of a trace."""
+
+    spans = {}
+    counters = {}
+    for event in trace["traceEvents"]:
+        if event["ph"] == "X":
+            name = " ".join([event["name"]] + ["{KEY}={VALUE}".format(KEY=key, VALUE=value)
+                                               for key, value in sorted(event.get("args", {}).items())])
+            total, calls = spans.get(name, (0.0, 0))
+            spans[name] = (total + event["dur"] / 1e6, calls + 1)
+        elif event["ph"] == "C":
+            counters[event["name"]] = counters.get(event["name"], 0) + event["args"]["value"]
+
+    return spans, counters
+
+
+def main():
+    """Command line entry point."""
+
+    parser = argparse.ArgumentParser(description="Profiling traces of the tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    merge_parser = commands.add_parser("merge", help="merge the trace files of a folder")
+    merge_parser.add_argument("folder")
+    merge_parser.add_argument("trace", help="merged trace file")
+
+    summary_parser = commands.add_parser("summary", help="time per span and counters of a trace")
+    summary_parser.add_argument("trace")
+
+    arguments = parser.parse_args()
+
+    if arguments.command == "merge":
+        print("{COUNT} events merged".format(COUNT=merge(arguments.folder, arguments.trace)))
+    else:
+        spans, counters = summary(read_trace(arguments.trace))
+        for name, (total, calls) in sorted(spans.items(), key=lambda item: -item[1][0]):
+            print("{NAME:<48} {TOTAL:10.4f} s {CALLS:8d} calls".format(NAME=name, TOTAL=total, CALLS=calls))
+        for name, value in sorted(counters.items()):
+            print("{NAME:<48} {VALUE:12g}".format(NAME=name, VALUE=value))
+
+
+if os.environ.get("LAUNCHER_PROFILE"):
+    enable(os.environ["LAUNCHER_PROFILE"])
+
+
+if __name__ == '__main__':
+    main()
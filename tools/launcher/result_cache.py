@@ -0,0 +1,201 @@
+"""On-disk cache of the results of the tool calculations. The key of a result is a hash of the tool name, its
+model version and its canonical inputs (floats rounded to 12 significant digits, arrays and tuples as lists),
+so the same inputs sent again by an optimizer or a repeated design of experiments skip the calculation.
+
+The model version of a tool is MODEL_VERSION plus a hash of the source file of its calculate function and of
+the SHARED_MODULES of the launcher package that the tools use, so changing a tool or one of them invalidates
+its results. The store is a SQLite database, safe to share between concurrent processes, bounded in size with
+least recently used eviction.
+
+The analysis of launcher.mda memoizes every tool with a cache passed to it. When the tools are run one by one by
+RCE, only the run() of the trajectory tool uses the cache of LAUNCHER_RESULT_CACHE (from_environment). A lookup
+takes 0.2 to 4 ms (hashing the inputs and a SQLite query), while the calculations of the other tools take
+microseconds, and about 0.1 s for the trajectory."""
+
+import hashlib
+import inspect
+import json
+import math
+import os
+import pickle
+import sqlite3
+import time
+import numpy as np
+
+MODEL_VERSION = "1"
+FLOAT_DIGITS = 12
+UNKEYED_ARGUMENTS = ("hint_cache",)    # Keyword arguments that do not change the results, only the speed
+SHARED_MODULES = ("atmosphere.py", "catalog.py", "model.py", "trajectory_encoding.py")
+EVICTION_INTERVAL = 100    # Stored results between two checks of the store size
+
+
+def canonical(value):
+    """JSON serializable version of a value with normalized floats."""
+
+    if isinstance(value, (bool, str)) or value is None:
+        return value
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        value = float(value)
+        if not math.isfinite(value):
+            return repr(value)
+        return float("{VALUE:.{DIGITS}g}".format(VALUE=value, DIGITS=FLOAT_DIGITS)) + 0.0    # -0.0 -> 0.0
+    if isinstance(value, np.ndarray):
+        return [canonical(item) for item in value.tolist()]
+    if isinstance(value, (list, tuple)):
+        return [canonical(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): canonical(item) for key, item in sorted(value.items())}
+    raise TypeError("Value not supported in a cache key: {TYPE}".format(TYPE=type(value).__name__))
+
+
+_source_hashes = {}
+
+
+def model_version(function):
+    """Model version salt of a calculate function: MODEL_VERSION and the hash of its source file and of the
+    SHARED_MODULES."""
+
+    path = inspect.getsourcefile(function)
+    if path not in _source_hashes:
+        source_hash = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for source in [path] + [os.path.join(directory, module) for module in SHARED_MODULES]:
+            with open(source, "rb") as f:
+                source_hash.update(f.read())
+        _source_hashes[path] = source_hash.hexdigest()[:16]
+
+    return MODEL_VERSION + "-" + _source_hashes[path]
+
+
+class ResultCache:
+    """Size-bounded LRU store of tool results in a SQLite database (path). max_bytes bounds the size of the
+    stored results; when it is exceeded the least recently used ones are evicted down to 90 % of it. The size
+    is checked every EVICTION_INTERVAL stored results of each process, so it can exceed max_bytes by that many
+    results in between."""
+
+    def __init__(self, path, max_bytes=1024 ** 3):
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self._connection = None
+        self._pid = None
+        self._stored = 0    # Results stored by this process
+
+        self.hits = {}    # Per tool, for this process
+        self.misses = {}
+
+    def connection(self):
+        """SQLite connection of this process (a forked worker opens its own one)."""
+
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, tool TEXT, "
+                                     "value BLOB, size INTEGER, last_access REAL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS results_access ON results (last_access)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS statistics (tool TEXT PRIMARY KEY, hits INTEGER, "
+                                     "misses INTEGER)")
+            self._pid = os.getpid()
+
+        return self._connection
+
+    def __getstate__(self):    # The connection is not sent to other processes
+
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        state["_pid"] = None
+
+        return state
+
+    def key(self, tool, function, args, kwargs):
+        """Hash of the tool name, model version and canonical inputs (except UNKEYED_ARGUMENTS)."""
+
+        kwargs = {name: value for name, value in kwargs.items() if name not in UNKEYED_ARGUMENTS}
+        inputs = json.dumps([tool, model_version(function), canonical(list(args)), canonical(kwargs)],
+                            separators=(",", ":"))
+
+        return hashlib.sha256(inputs.encode()).hexdigest()
+
+    def call(self, tool, function, *args, **kwargs):
+        """Result of function(*args, **kwargs), from the store if the same tool was called with the same
+        inputs before. Otherwise the function is called and its result stored."""
+
+        key = self.key(tool, function, args, kwargs)
+        connection = self.connection()
+
+        row = connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            connection.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.count(tool, hit=True)
+            return pickle.loads(row[0])
+
+        self.count(tool, hit=False)
+        result = function(*args, **kwargs)
+        value = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                           (key, tool, value, len(value), time.time()))
+        self._stored = self._stored + 1
+        if self._stored % EVICTION_INTERVAL == 0:
+            self.evict()
+
+        return result
+
+    def count(self, tool, hit):
+        """Updates the hit and miss counters of a tool, in this process and in the store."""
+
+        counters = self.hits if hit else self.misses
+        counters[tool] = counters.get(tool, 0) + 1
+        self.connection().execute("INSERT INTO statistics VALUES (?, ?, ?) ON CONFLICT(tool) DO UPDATE SET "
+                                  "hits = hits + excluded.hits, misses = misses + excluded.misses",
+                                  (tool, int(hit), int(not hit)))
+
+    def evict(self):
+        """Deletes the least recently used results while the store is larger than max_bytes."""
+
+        connection = self.connection()
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        excess = total - 0.9 * self.max_bytes
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            freed = 0
+            for key, size in connection.execute("SELECT key, size FROM results ORDER BY last_access").fetchall():
+                if freed >= excess:
+                    break
+                connection.execute("DELETE FROM results WHERE key = ?", (key,))
+                freed = freed + size
+            connection.execute("COMMIT")
+        except sqlite3.Error:
+            connection.execute("ROLLBACK")
+            raise
+
+    def statistics(self):
+        """Hits and misses per tool, of this process ("session") and of all the processes that used the store
+        ("total"), and the number and size of the stored results."""
+
+        connection = self.connection()
+        entries, size = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        total = {tool: {"hits": hits, "misses": misses}
+                 for tool, hits, misses in connection.execute("SELECT tool, hits, misses FROM statistics")}
+        session = {tool: {"hits": self.hits.get(tool, 0), "misses": self.misses.get(tool, 0)}
+                   for tool in set(self.hits) | set(self.misses)}
+
+        return {"entries": entries, "bytes": size, "session": session, "total": total}
+
+    def clear(self):
+        """Deletes all the stored results and statistics."""
+
+        self.connection().execute("DELETE FROM results")
+        self.connection().execute("DELETE FROM statistics")
+
+
+def from_environment(variable="LAUNCHER_RESULT_CACHE"):
+    """ResultCache stored in the file given by an environment variable, or None if it is not set."""
+
+    path = os.environ.get(variable)
+
+    return ResultCache(path) if path else None
@@ -0,0 +1,195 @@
+"""Finite-difference sensitivities of a design, for the gradient-based refinement of a fixed architecture: the
+Jacobian of OUTPUTS (payload, cost, structural and payload constraints) with respect to its continuous design
+variables, named as the columns of the design tables (launcher.batch): the stage lengths (stage1_length,
+stage2_length...), l_d, cone_angle (cone heads) and l_ratio (elliptical heads).
+
+All the perturbed designs are built first and evaluated in parallel with launcher.batch.evaluate_batch, together
+with the unperturbed design unless its results are given. The designs whose analysis does not change (same
+trajectory inputs, cost and available volume, for example the cone angle of a spherical head) are evaluated once,
+and the tool calculations are memoized as usual when a ResultCache is given. The trajectory uses the smooth
+payload search of Trajectory.calculate by default: the payload of the bracketing search is only known within its
+tolerance, which would be noise in the differences.
+
+The methods are "forward" (one evaluation per variable), "central" (two, more accurate) and "complex": the
+complex step through the vectorized sizing (launcher.mda.evaluate_sizing_batch) for the cost and the available
+volume of the payload constraint, exact to machine precision, and central differences for the outputs of the
+trajectory. The step of a variable x is relative_step * max(|x|, 1). Usage:
+
+    python sensitivity.py design.xml [--method central] [--relative-step 1e-5] [--workers N] [--cache FILE]"""
+
+import argparse
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from launcher import batch
+from launcher import mda
+from launcher.result_cache import ResultCache
+
+OUTPUTS = ("payload", "cost", "structural_constraint", "payload_constraint")
+METHODS = ("forward", "central", "complex")
+HEAD_VARIABLES = ("l_d", "cone_angle", "l_ratio")
+COMPLEX_STEP = 1e-30    # Relative step of the complex-step derivatives, no subtraction so no round-off
+
+
+def design_variables(design):
+    """Continuous variables of a design: the stage lengths, l_d and the parameter of its head shape."""
+
+    variables = ["stage{INDEX}_length".format(INDEX=index) for index in range(1, len(design["stages"]) + 1)]
+    variables.append("l_d")
+    if design["head_shape"] == "Cone":
+        variables.append("cone_angle")
+    elif design["head_shape"] == "Elliptical":
+        variables.append("l_ratio")
+
+    return variables
+
+
+def stage_index(variable):
+    """Index of the stage of a stage length variable (stage1_length is 0), None for the other variables."""
+
+    if variable.startswith("stage") and variable.endswith("_length") and variable[5:-7].isdigit():
+        return int(variable[5:-7]) - 1
+
+    return None
+
+
+def variable_value(design, variable):
+    """Value of a design variable."""
+
+    index = stage_index(variable)
+    if index is not None and index < len(design["stages"]):
+        return design["stages"][index]["length"]
+    if variable in HEAD_VARIABLES:
+        return design[variable]
+
+    raise ValueError("Unknown design variable: {VARIABLE}".format(VARIABLE=variable))
+
+
+def with_variable(design, variable, value):
+    """Copy of a design with a new value of one of its variables."""
+
+    variable_value(design, variable)    # Validation
+    perturbed = dict(design, stages=[dict(stage) for stage in design["stages"]])
+    index = stage_index(variable)
+    if index is not None:
+        perturbed["stages"][index]["length"] = value
+    else:
+        perturbed[variable] = value
+
+    return perturbed
+
+
+def analysis_keys(designs):
+    """Key of the analysis of each design: its trajectory inputs, cost, available volume, maximum dynamic
+    pressure and payload density, from the vectorized sizing. Designs with the same key have the same results."""
+
+    sizing = mda.evaluate_sizing_batch(*mda.design_arrays(designs))
+    keys = []
+    for row, design in enumerate(designs):
+        inputs = np.hstack(mda.design_trajectory_inputs(design, sizing, row)).tolist()
+        keys.append(tuple(inputs) + (float(sizing["cost"][row]), float(sizing["volume_available"][row]),
+                                     design["max_q"], design["payload_density"]))
+
+    return keys
+
+
+def complex_step_sizing(design, variables):
+    """Derivatives of the cost and of the available volume with respect to the variables (two arrays), by
+    complex step through the vectorized sizing, one row per variable."""
+
+    engine, engines, lengths, head_shape, cone_angle, l_ratio, l_d = mda.design_arrays([design] * len(variables))
+    lengths = lengths.astype(complex)
+    head_values = {"l_d": l_d.astype(complex), "cone_angle": cone_angle.astype(complex),
+                   "l_ratio": l_ratio.astype(complex)}
+
+    steps = np.array([COMPLEX_STEP * max(abs(variable_value(design, variable)), 1.0) for variable in variables])
+    for row, (variable, step) in enumerate(zip(variables, steps)):
+        if stage_index(variable) is not None:
+            lengths[row, stage_index(variable)] += 1j * step
+        else:
+            head_values[variable][row] += 1j * step
+
+    sizing = mda.evaluate_sizing_batch(engine, engines, lengths, head_shape, head_values["cone_angle"],
+                                       head_values["l_ratio"], head_values["l_d"])
+
+    return sizing["cost"].imag / steps, sizing["volume_available"].imag / steps
+
+
+def jacobian(design, variables=None, method="central", relative_step=1e-5, base=None, workers=None, cache=None,
+             **options):
+    """Results and Jacobian of a design. variables are the names of the design variables (design_variables by
+    default). base can be the results of the unperturbed design, calculated with the same options, which are
+    then not evaluated again. The keyword arguments are passed to launcher.mda.evaluate, with
+    payload_search="smooth" by default.
+
+    It returns the results of the design (a dictionary with OUTPUTS and the error text, see
+    launcher.batch.evaluate_safe) and the Jacobian, an array (len(OUTPUTS), len(variables)). The derivatives
+    of a failed evaluation are NaN."""
+
+    if method not in METHODS:
+        raise ValueError("Unknown finite-difference method: {METHOD}".format(METHOD=method))
+
+    variables = design_variables(design) if variables is None else list(variables)
+    options = dict({"payload_search": "smooth"}, **options)
+    steps = np.array([relative_step * max(abs(variable_value(design, variable)), 1.0) for variable in variables])
+
+    # Unperturbed design and perturbed designs, +h for forward differences, +h and -h otherwise
+    signs = (1,) if method == "forward" else (1, -1)
+    designs = [design] + [with_variable(design, variable, variable_value(design, variable) + sign * step)
+                          for variable, step in zip(variables, steps) for sign in signs]
+
+    # Each different analysis is evaluated once, in parallel
+    keys = analysis_keys(designs)
+    results = {keys[0]: base} if base is not None else {}
+    pending = {}
+    for key, perturbed in zip(keys, designs):
+        if key not in results and key not in pending:
+            pending[key] = perturbed
+    results.update(zip(pending, batch.evaluate_batch(list(pending.values()), workers, cache=cache, **options)))
+
+    values = np.array([[results[key][output] for output in OUTPUTS] for key in keys], dtype=float)
+    if method == "forward":
+        derivatives = (values[1:] - values[0]) / steps[:, None]
+    else:
+        derivatives = (values[1::2] - values[2::2]) / (2 * steps[:, None])
+    derivatives = derivatives.T
+
+    if method == "complex":
+        cost_derivatives, volume_derivatives = complex_step_sizing(design, variables)
+        derivatives[OUTPUTS.index("cost")] = cost_derivatives
+        derivatives[OUTPUTS.index("payload_constraint")] = derivatives[OUTPUTS.index("payload")] / \
+            design["payload_density"] - volume_derivatives    # Payload.calculate: payload / density - volume
+
+    return results[keys[0]], derivatives
+
+
+def main():
+    """Command line entry point."""
+
+    parser = argparse.ArgumentParser(description="Finite-difference sensitivities of a launcher design.")
+    parser.add_argument("design", help="input XML file of the design")
+    parser.add_argument("--variables", nargs="+", default=None, help="design variables (all by default)")
+    parser.add_argument("--method", choices=METHODS, default="central")
+    parser.add_argument("--relative-step", type=float, default=1e-5)
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (all cores by default)")
+    parser.add_argument("--cache", default=None, help="result cache file (launcher.result_cache)")
+    arguments = parser.parse_args()
+
+    design = mda.read_design(arguments.design)
+    variables = arguments.variables or design_variables(design)
+    results, derivatives = jacobian(design, variables, arguments.method, arguments.relative_step,
+                                    workers=arguments.workers,
+                                    cache=ResultCache(arguments.cache) if arguments.cache else None)
+
+    print(" ".join("{OUTPUT}: {VALUE:.6g}".format(OUTPUT=output, VALUE=results[output]) for output in OUTPUTS))
+    print("{NAME:24s}".format(NAME="") + "".join("{OUTPUT:>24s}".format(OUTPUT=output) for output in OUTPUTS))
+    for variable, column in zip(variables, derivatives.T):
+        print("{NAME:24s}".format(NAME="d/d" + variable) +
+              "".join("{VALUE:24.8g}".format(VALUE=value) for value in column))
+
+
+if __name__ == '__main__':
+    main()
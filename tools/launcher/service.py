@@ -0,0 +1,432 @@
+"""Evaluation service shared by several optimizers. It is an asyncio HTTP server on a local TCP port or a Unix
+socket, which evaluates launcher designs sent as the JSON of a design dictionary (see launcher.mda), a row of
+a design table (see launcher.batch) or an input XML file (see "XML files"):
+
+    POST /evaluate    one design, or a JSON list of designs. Optional query parameter timeout (seconds)
+    GET /metrics      queue depth, latencies, batches, deduplicated, rejected and timed out requests
+
+The responses are JSON with the payload, cost, structural and payload constraints of each design (and the error
+text if the evaluation failed). The concurrent requests are queued and sent in micro-batches of up to max_batch
+designs, collected during batch_window seconds, to a pool of worker processes. A batch is evaluated with
+launcher.mda.evaluate design by design (mode="pool"), or all at once with launcher.mda.evaluate_vectorized
+(mode="vectorized", faster for large batches, payloads within 0.2 %). At most one batch per worker is in
+evaluation, so the batches grow when the workers are busy. Identical designs in evaluation are evaluated once.
+
+When the queue is full the requests are rejected (HTTP 503) instead of waiting, and a request not answered
+within its timeout gets HTTP 504. Request bodies larger than MAX_BODY_SIZE bytes are rejected (HTTP 413) without
+being read. EvaluationService can also be used in the same process, without the server
+(with workers=0 the designs are evaluated in a thread of this process). Usage:
+
+    python service.py ADDRESS [--workers N] [--mode pool] [--max-batch 16] [--batch-window 0.01]
+                              [--max-queue 1000] [--timeout 600] [--fidelity ode] [--allow-remote]
+
+ADDRESS is HOST:PORT or the path of a Unix socket. The service has no authentication, so a TCP address must be
+a loopback address unless --allow-remote is given."""
+
+import argparse
+import asyncio
+import collections
+import http.client
+import io
+import json
+import os
+import socket
+import statistics
+import sys
+import time
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from launcher import batch
+from launcher import catalog
+from launcher import model
+from launcher.result_cache import canonical
+from launcher.worker_client import is_loopback, tcp_address
+
+MODES = ("pool", "vectorized")
+HEAD_SHAPES = ("Cone", "Sphere", "Elliptical")    # Geometry_calculator.HEAD_SHAPES, not imported by the server
+LATENCY_WINDOW = 1000    # Requests of the latency statistics
+MAX_BODY_SIZE = 16 * 1024 * 1024    # Bytes of a request body
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 503: "Service Unavailable", 504: "Gateway Timeout"}
+
+
+class ServiceOverloaded(RuntimeError):
+    """The queue of the service is full."""
+
+
+def design_from_json(data):
+    """Design dictionary from the JSON of a design dictionary or of a row of a design table."""
+
+    if "stages" not in data:
+        return batch.design_from_row(data)
+
+    design = {"stages": [{"engine": str(stage["engine"]), "engines": int(stage["engines"]),
+                          "length": float(stage["length"])} for stage in data["stages"]],
+              "head_shape": str(data["head_shape"])}
+    for name in batch.DESIGN_COLUMNS[1:]:
+        design[name] = float(data.get(name, 0))
+
+    return design
+
+
+def design_from_xml(body):
+    """Design dictionary from the contents of an input XML file."""
+
+    from launcher import mda    # Only imported by the workers otherwise
+
+    return mda.design_from_model(model.read(io.BytesIO(body)))
+
+
+def validate(design):
+    """Raises a ValueError if a design cannot be evaluated."""
+
+    if not design["stages"]:
+        raise ValueError("The design has no stages")
+    for stage in design["stages"]:
+        if stage["engine"] not in catalog.ENGINE_CODES:
+            raise ValueError("Unknown engine: {ENGINE}".format(ENGINE=stage["engine"]))
+        if stage["engines"] < 1 or stage["length"] is None or stage["length"] <= 0:
+            raise ValueError("Invalid stage: {STAGE}".format(STAGE=stage))
+    if design["head_shape"] not in HEAD_SHAPES:
+        raise ValueError("Unknown head shape: {SHAPE}".format(SHAPE=design["head_shape"]))
+    if design["l_d"] is None or design["l_d"] <= 0:
+        raise ValueError("Invalid L_D: {L_D}".format(L_D=design["l_d"]))
+
+
+def design_key(design):
+    """Key of a design, equal for identical designs."""
+
+    return json.dumps(canonical(design), sort_keys=True)
+
+
+def evaluate_designs(designs, mode, options):
+    """Results of a batch of designs (run in a worker). If the vectorized evaluation fails, the designs are
+    evaluated one by one, so the error is only reported for the designs that cause it."""
+
+    if mode == "vectorized":
+        from launcher import mda
+        try:
+            return [dict(results, error="") for results in mda.evaluate_vectorized(designs, **options)]
+        except Exception:
+            options = {name: value for name, value in options.items() if name != "payload_tolerance"}
+    elif mode != "pool":
+        raise ValueError("Unknown evaluation mode: {MODE}".format(MODE=mode))
+
+    return [batch.evaluate_safe(design, **options) for design in designs]
+
+
+class EvaluationService:
+    """Queue of design evaluations, sent in micro-batches to a pool of workers (see the module documentation).
+    The keyword arguments are passed to the evaluation functions (fidelity, atmosphere_model...)."""
+
+    def __init__(self, workers=None, mode="pool", max_batch=16, batch_window=0.01, max_queue=1000, timeout=600.0,
+                 **options):
+
+        if mode not in MODES:
+            raise ValueError("Unknown evaluation mode: {MODE}".format(MODE=mode))
+
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.mode = mode
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.options = options
+
+        self.counters = collections.Counter()
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.batch_sizes = collections.deque(maxlen=LATENCY_WINDOW)
+        self.max_queue_depth = 0
+        self._queue = None
+        self._in_flight = {}    # Future of the results of each design key in evaluation
+        self._batches = set()
+
+    async def __aenter__(self):
+
+        await self.start()
+
+        return self
+
+    async def __aexit__(self, *exception):
+
+        await self.stop()
+
+    async def start(self):
+        """Starts the workers and the dispatch of the batches."""
+
+        self._queue = asyncio.Queue(self.max_queue)
+        if self.workers > 0:
+            self._executor = ProcessPoolExecutor(self.workers, initializer=batch.warm_worker)
+        else:
+            self._executor = ThreadPoolExecutor(1)
+        self._slots = asyncio.Semaphore(max(self.workers, 1))
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def stop(self):
+        """Stops the dispatch, waits for the batches in evaluation and shuts the workers down."""
+
+        self._dispatcher.cancel()
+        try:
+            await self._dispatcher
+        except asyncio.CancelledError:
+            pass
+        if self._batches:
+            await asyncio.wait(self._batches)
+        self._executor.shutdown()
+
+    async def evaluate(self, design, timeout=None):
+        """Results of a design (a dictionary with payload, cost, structural_constraint, payload_constraint and
+        error). It raises ServiceOverloaded if the queue is full and asyncio.TimeoutError if the results are not
+        available within timeout seconds (the timeout of the service by default)."""
+
+        validate(design)
+        start_time = time.perf_counter()
+        self.counters["requests"] += 1
+
+        key = design_key(design)
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.counters["deduplicated"] += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            try:
+                self._queue.put_nowait((key, design, future))
+            except asyncio.QueueFull:
+                self.counters["rejected"] += 1
+                raise ServiceOverloaded("The evaluation queue is full ({SIZE} designs)".format(SIZE=self.max_queue))
+            self._in_flight[key] = future
+            self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+
+        try:    # The evaluation goes on after a timeout, for the identical designs
+            results = await asyncio.wait_for(asyncio.shield(future), timeout if timeout is not None else self.timeout)
+        except asyncio.TimeoutError:
+            self.counters["timeouts"] += 1
+            raise
+        self.latencies.append(time.perf_counter() - start_time)
+
+        return dict(results)
+
+    async def _dispatch(self):
+        """Sends the queued designs to the workers in batches, when a worker is free."""
+
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._slots.acquire()
+            items = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(items) < self.max_batch:
+                if not self._queue.empty():
+                    items.append(self._queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            task = asyncio.create_task(self._evaluate_batch(items))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _evaluate_batch(self, items):
+        """Evaluates a batch in a worker and gives the results to the waiting requests."""
+
+        self.counters["batches"] += 1
+        self.batch_sizes.append(len(items))
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self._executor, evaluate_designs, [design for _, design, _ in items], self.mode, self.options)
+            for (_, _, future), design_results in zip(items, results):
+                self.counters["errors"] += bool(design_results["error"])
+                if not future.done():    # Not cancelled
+                    future.set_result(design_results)
+        except Exception as error:    # For example a worker process that died, or a malformed result
+            for _, _, future in items:
+                if not future.done():    # Not answered before the error
+                    future.set_exception(error)
+                    self.counters["errors"] += 1
+        finally:
+            for key, _, _ in items:
+                self._in_flight.pop(key, None)
+            self._slots.release()
+
+    def metrics(self):
+        """Counters and statistics of the service: queue depth (current and maximum), designs in evaluation,
+        latency of the answered requests (seconds, over the last LATENCY_WINDOW) and mean batch size."""
+
+        latencies = sorted(self.latencies)
+
+        def percentile(fraction):
+            return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] if latencies else None
+
+        return {"requests": self.counters["requests"],
+                "deduplicated": self.counters["deduplicated"],
+                "rejected": self.counters["rejected"],
+                "timeouts": self.counters["timeouts"],
+                "errors": self.counters["errors"],
+                "batches": self.counters["batches"],
+                "mean_batch_size": statistics.mean(self.batch_sizes) if self.batch_sizes else None,
+                "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+                "max_queue_depth": self.max_queue_depth,
+                "in_flight": len(self._in_flight),
+                "latency_p50": percentile(0.5),
+                "latency_p95": percentile(0.95),
+                "latency_max": latencies[-1] if latencies else None}
+
+
+async def handle_request(service, method, target, content_type, body):
+    """Answer (HTTP status and JSON serializable response) of a request to the service. It is the server
+    without the socket."""
+
+    path, _, query = target.partition("?")
+    parameters = urllib.parse.parse_qs(query)
+
+    if path == "/metrics":
+        return (200, service.metrics()) if method == "GET" else (405, {"error": "Use GET"})
+    if path != "/evaluate":
+        return 404, {"error": "Unknown path: {PATH}".format(PATH=path)}
+    if method != "POST":
+        return 405, {"error": "Use POST"}
+
+    try:
+        timeout = float(parameters["timeout"][0]) if "timeout" in parameters else None
+        several = False    # A list of designs, answered with a list of results
+        if "xml" in content_type or body.lstrip().startswith(b"<"):
+            designs = [design_from_xml(body)]
+        else:
+            data = json.loads(body)
+            several = isinstance(data, list)
+            designs = [design_from_json(item) for item in (data if several else [data])]
+        for design in designs:
+            validate(design)
+    except (ValueError, KeyError, TypeError, SyntaxError) as error:    # lxml errors are SyntaxError
+        return 400, {"error": "Invalid design: {ERROR}".format(ERROR=error)}
+
+    try:
+        results = await asyncio.gather(*(service.evaluate(design, timeout) for design in designs))
+    except ServiceOverloaded as error:
+        return 503, {"error": str(error)}
+    except asyncio.TimeoutError:
+        return 504, {"error": "The evaluation did not finish within the timeout"}
+
+    results = [{name: None if value != value else value for name, value in design_results.items()}
+               for design_results in results]    # NaN outputs of failed evaluations, not valid JSON
+
+    return 200, results if several else results[0]
+
+
+async def handle_connection(service, reader, writer):
+    """HTTP/1.1 connection: one request per connection."""
+
+    try:
+        method, target, _ = (await reader.readline()).decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        if length > MAX_BODY_SIZE:
+            status, response = 413, {"error": "The request body is larger than {SIZE} bytes".format(
+                SIZE=MAX_BODY_SIZE)}
+        else:
+            body = await reader.readexactly(length)
+            status, response = await handle_request(service, method, target, headers.get("content-type", ""),
+                                                    body)
+        content = json.dumps(response).encode()
+        writer.write("HTTP/1.1 {STATUS} {TEXT}\r\nContent-Type: application/json\r\nContent-Length: {LENGTH}\r\n"
+                     "Connection: close\r\n\r\n".format(STATUS=status, TEXT=STATUS_TEXT[status],
+                                                        LENGTH=len(content)).encode() + content)
+        await writer.drain()
+    except (ValueError, ConnectionError, asyncio.IncompleteReadError):    # Malformed request or client gone
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(address, allow_remote=False, **service_options):
+    """Runs the service on an address (HOST:PORT or Unix socket path) until cancelled. A TCP address must be a
+    loopback address unless allow_remote is True."""
+
+    if tcp_address(address) is not None and not allow_remote and not is_loopback(*tcp_address(address)):
+        raise ValueError("The service only listens on loopback addresses without allow_remote: {ADDRESS}".format(
+            ADDRESS=address))
+
+    async with EvaluationService(**service_options) as service:
+        def handler(reader, writer):
+            return handle_connection(service, reader, writer)
+
+        if tcp_address(address) is not None:
+            server = await asyncio.start_server(handler, *tcp_address(address))
+        else:
+            server = await asyncio.start_unix_server(handler, address)
+        async with server:
+            await server.serve_forever()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix socket."""
+
+    def __init__(self, path, timeout=None):
+
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def post(address, designs, timeout=None):
+    """Client of the service: status and response of the evaluation of a design dictionary or a list of them."""
+
+    if tcp_address(address) is not None:
+        connection = http.client.HTTPConnection(*tcp_address(address))
+    else:
+        connection = UnixHTTPConnection(address)
+    target = "/evaluate" + ("?timeout={TIMEOUT}".format(TIMEOUT=timeout) if timeout is not None else "")
+
+    try:
+        connection.request("POST", target, json.dumps(designs), {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def main():
+    """Command line entry point."""
+
+    parser = argparse.ArgumentParser(description="Evaluation service of launcher designs.")
+    parser.add_argument("address", help="HOST:PORT or Unix socket path")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (all cores by default)")
+    parser.add_argument("--mode", choices=MODES, default="pool")
+    parser.add_argument("--max-batch", type=int, default=16)
+    parser.add_argument("--batch-window", type=float, default=0.01, help="seconds")
+    parser.add_argument("--max-queue", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=600.0, help="default timeout of a request (seconds)")
+    parser.add_argument("--fidelity", choices=("ode", "analytic"), default="ode")
+    parser.add_argument("--atmosphere-model", choices=("table", "ambiance"), default="table")
+    parser.add_argument("--allow-remote", action="store_true", help="listen on a non-loopback TCP address")
+    arguments = parser.parse_args()
+
+    try:
+        asyncio.run(serve(arguments.address, allow_remote=arguments.allow_remote, workers=arguments.workers,
+                          mode=arguments.mode, max_batch=arguments.max_batch, batch_window=arguments.batch_window,
+                          max_queue=arguments.max_queue, timeout=arguments.timeout, fidelity=arguments.fidelity,
+                          atmosphere_model=arguments.atmosphere_model))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
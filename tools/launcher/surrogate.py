@@ -0,0 +1,406 @@
+"""Surrogate prescreening of launcher designs. The expensive part of an evaluation is the trajectory: the cost and
+the available volume of the head are given by the vectorized sizing (launcher.mda.evaluate_sizing_batch) for
+thousands of designs per second. The surrogate models the two outputs of the trajectory, the payload and the peak
+dynamic pressure (structural constraint + max_q), with one kriging model (Kriging) per architecture class: number
+of stages, engine type and number of engines of each stage and head shape. Its inputs are the continuous variables
+of the class (launcher.sensitivity.design_variables). The payload and structural constraints are then derived from
+the predictions as in the tools.
+
+The models are refitted as the true results arrive (Surrogate.add): the factor of the correlation matrix is
+extended with the new points, and the model is fitted again from scratch (length scale and input scaling) when
+its number of points has doubled. Each true result is predicted before it is added, so the prediction errors
+against these held-out evaluations are reported (Surrogate.report).
+
+Surrogate.screen ranks candidates and rejects the ones that are not worth evaluating, with the objectives of
+launcher.optimizer (maximum payload, minimum cost): the ones infeasible even with the optimistic bounds of the
+predictions (confidence standard deviations), and the ones whose optimistic payload and cost are dominated by an
+evaluated feasible design. explore is the active learning loop over a table of candidates: the best ranked ones
+are evaluated in batches, which refines the models where the good designs are, until every remaining candidate is
+rejected or the budget is spent. A random sample of the rejected candidates can be evaluated as an audit, to
+estimate how many good designs the rejections lose. Usage:
+
+    python surrogate.py candidates.csv results.csv [--budget N] [--batch-size 8] [--confidence 2]
+                        [--audit 0.05] [--workers N] [--cache FILE]"""
+
+import argparse
+import csv
+import math
+import os
+import sys
+import numpy as np
+from scipy.linalg import LinAlgError, cho_solve, cholesky, solve_triangular
+from scipy.spatial.distance import cdist
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from launcher import batch
+from launcher import mda
+from launcher.result_cache import ResultCache
+from launcher.sensitivity import design_variables, variable_value
+
+OUTPUTS = ("payload", "cost", "structural_constraint", "payload_constraint")
+MODELLED = ("payload", "max_dynamic_pressure")    # Outputs of the trajectory, modelled by the kriging models
+LENGTH_SCALES = (0.05, 0.1, 0.2, 0.5, 1.0, 2.0)    # Candidate length scales, inputs scaled to [0, 1]
+MIN_POINTS = 3    # Evaluated designs of a class before it has a model
+VARIANCE_FLOOR = 0.1    # Minimum standard deviation of a model, relative to the one of all the evaluated designs
+
+
+def architecture(design):
+    """Architecture class of a design: the engine type and number of engines of its stages and its head shape."""
+
+    stages = " / ".join("{ENGINES} {ENGINE}".format(ENGINES=stage["engines"], ENGINE=stage["engine"])
+                        for stage in design["stages"])
+
+    return "{STAGES} / {HEAD}".format(STAGES=stages, HEAD=design["head_shape"])
+
+
+def features(design):
+    """Continuous variables of a design, the inputs of the model of its class."""
+
+    return [variable_value(design, variable) for variable in design_variables(design)]
+
+
+class Kriging:
+    """Gaussian process regression (simple kriging) of several outputs sharing their inputs. The correlation is
+    Gaussian, with one length scale on the inputs scaled to [0, 1] by the range of the fitted points, chosen
+    among length_scales by the leave-one-out error. nugget is added to the diagonal for the conditioning. The
+    variance of the process is at least variance_floor (per output), so a model fitted to equal outputs (for
+    instance a class whose first designs do not reach the orbit) is not certain of its predictions."""
+
+    def __init__(self, length_scales=LENGTH_SCALES, nugget=1e-8, variance_floor=0.0):
+
+        self.length_scales = length_scales
+        self.nugget = nugget
+        self.variance_floor = variance_floor
+        self.length_scale = None
+        self.fitted_points = 0
+
+    def correlation(self, a, b):
+        """Correlation matrix between two sets of scaled inputs."""
+
+        return np.exp(-0.5 * cdist(a, b, "sqeuclidean") / self.length_scale ** 2)
+
+    def scale(self, x):
+        """Inputs scaled with the range of the fitted points."""
+
+        return (np.asarray(x, dtype=float) - self.low) / self.span
+
+    def fit(self, x, y):
+        """Fits the model to inputs x (n, d) and outputs y (n, k), choosing the length scale."""
+
+        x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.low = x.min(axis=0)
+        span = x.max(axis=0) - self.low
+        self.span = np.where(span > 0, span, 1.0)
+        self.x = self.scale(x)
+        self.mean = self.y.mean(axis=0)
+        output_scale = np.where(self.y.std(axis=0) > 0, self.y.std(axis=0), 1.0)
+
+        best_error = np.inf
+        for length_scale in self.length_scales:
+            self.length_scale = length_scale
+            try:
+                factor = cholesky(self.correlation(self.x, self.x) + self.nugget * np.eye(len(x)), lower=True)
+            except LinAlgError:
+                continue
+            alpha = cho_solve((factor, True), self.y - self.mean)
+            inverse_diagonal = (solve_triangular(factor, np.eye(len(x)), lower=True) ** 2).sum(axis=0)
+            error = np.mean((alpha / inverse_diagonal[:, None] / output_scale) ** 2)    # Leave-one-out residuals
+            if error < best_error:
+                best_error, best = error, (length_scale, factor)
+
+        if best_error == np.inf:
+            raise LinAlgError("The correlation matrix is not positive definite for any length scale")
+
+        self.length_scale, self.factor = best
+        self.fitted_points = len(x)
+        self.solve()
+
+    def add(self, x, y):
+        """Adds points to the model, extending the Cholesky factor of the correlation matrix."""
+
+        x_new = self.scale(x)
+        cross = solve_triangular(self.factor, self.correlation(self.x, x_new), lower=True)
+        corner = cholesky(self.correlation(x_new, x_new) + self.nugget * np.eye(len(x_new)) - cross.T @ cross,
+                          lower=True)
+        self.factor = np.block([[self.factor, np.zeros((len(self.x), len(x_new)))], [cross.T, corner]])
+        self.x = np.vstack((self.x, x_new))
+        self.y = np.vstack((self.y, np.asarray(y, dtype=float)))
+        self.solve()
+
+    def solve(self):
+        """Weights of the points and variance of the process, from the Cholesky factor."""
+
+        self.alpha = cho_solve((self.factor, True), self.y - self.mean)
+        self.variance = ((self.y - self.mean) * self.alpha).sum(axis=0) / len(self.y)
+
+    def predict(self, x):
+        """Mean and standard deviation (m, k) of the outputs at inputs x (m, d)."""
+
+        correlation = self.correlation(self.scale(x), self.x)
+        reduction = (solve_triangular(self.factor, correlation.T, lower=True) ** 2).sum(axis=0)
+        deviation = np.sqrt(np.maximum(1 + self.nugget - reduction, 0)[:, None] *
+                            np.maximum(self.variance, self.variance_floor))
+
+        return self.mean + correlation @ self.alpha, deviation
+
+
+class Surrogate:
+    """Kriging models of the payload and peak dynamic pressure of each architecture class, with the prediction
+    errors on the true results added after the model existed (held_out, pairs of prediction and result). The
+    variance floor of the models is given by the spread of the outputs of all the evaluated designs
+    (VARIANCE_FLOOR). Until the outputs differ, the models of the classes do not reject any design."""
+
+    def __init__(self, min_points=MIN_POINTS, length_scales=LENGTH_SCALES):
+
+        self.min_points = min_points
+        self.length_scales = length_scales
+        self.models = {}
+        self.pending = {}    # Inputs and outputs of the classes without a model yet
+        self.held_out = []
+        self.outputs = []    # Modelled outputs of all the evaluated designs
+
+    def add(self, designs, results):
+        """Adds true results (launcher.batch.evaluate_safe) of designs to the models. The failed evaluations
+        are left out."""
+
+        valid = [(design, result) for design, result in zip(designs, results)
+                 if not result.get("error") and all(math.isfinite(result[output]) for output in OUTPUTS)]
+        if not valid:
+            return
+
+        for (design, result), prediction in zip(valid, self.predict([design for design, _ in valid])):
+            if prediction["model"]:
+                self.held_out.append((prediction, result))
+
+        classes = {}
+        for design, result in valid:
+            x, y = classes.setdefault(architecture(design), ([], []))
+            x.append(features(design))
+            y.append([result["payload"], result["structural_constraint"] + design["max_q"]])
+            self.outputs.append(y[-1])
+
+        for name, (x, y) in classes.items():
+            model = self.models.get(name)
+            if model is not None and len(model.y) + len(y) < 2 * model.fitted_points:
+                try:
+                    model.add(x, y)
+                    continue
+                except LinAlgError:    # Points too close to the existing ones, the model is fitted again
+                    pass
+
+            if model is not None:    # Fitted again with all its points
+                x = np.vstack((model.x * model.span + model.low, x))
+                y = np.vstack((model.y, y))
+            else:
+                pending_x, pending_y = self.pending.setdefault(name, ([], []))
+                pending_x.extend(x)
+                pending_y.extend(y)
+                if len(pending_y) < self.min_points:
+                    continue
+                x, y = self.pending.pop(name)
+
+            model = Kriging(self.length_scales)
+            model.fit(x, y)
+            self.models[name] = model
+
+        variance_floor = (VARIANCE_FLOOR * np.std(self.outputs, axis=0)) ** 2
+        for model in self.models.values():
+            model.variance_floor = variance_floor
+
+    def bounded(self, name):
+        """Whether the predictions of the model of a class have confidence bounds, so it can reject designs."""
+
+        model = self.models.get(name)
+
+        return model is not None and bool(np.all(np.maximum(model.variance, model.variance_floor) > 0))
+
+    def predict(self, designs):
+        """Predictions for designs: a dictionary per design with OUTPUTS, the standard deviations of the
+        payload and structural constraint (payload_std, structural_constraint_std) and model, False for the
+        designs of a class without a model (their trajectory outputs are NaN) or whose model has no confidence
+        bounds yet (Surrogate.bounded). The cost and the available volume (payload constraint) are exact."""
+
+        if not designs:
+            return []
+
+        sizing = mda.evaluate_sizing_batch(*mda.design_arrays(designs))
+        mean = np.full((len(designs), len(MODELLED)), np.nan)
+        deviation = np.full((len(designs), len(MODELLED)), np.nan)
+
+        classes = {}
+        for row, design in enumerate(designs):
+            classes.setdefault(architecture(design), []).append(row)
+        for name, rows in classes.items():
+            if name in self.models:
+                mean[rows], deviation[rows] = self.models[name].predict([features(designs[row]) for row in rows])
+
+        return [{"payload": mean[row, 0],
+                 "cost": float(sizing["cost"][row]),
+                 "structural_constraint": mean[row, 1] - design["max_q"],
+                 "payload_constraint": mean[row, 0] / design["payload_density"] -
+                 float(sizing["volume_available"][row]),
+                 "payload_std": deviation[row, 0],
+                 "structural_constraint_std": deviation[row, 1],
+                 "model": self.bounded(architecture(design))}
+                for row, design in enumerate(designs)]
+
+    def screen(self, designs, confidence=2.0, front=()):
+        """Ranking and rejection of candidate designs. It returns the indices of the kept designs, best first,
+        and the indices of the rejected ones. A design is rejected if its optimistic bounds (prediction +-
+        confidence standard deviations) do not reach the orbit or violate a constraint, or if its optimistic
+        payload and its cost are dominated by one of front, the (payload, cost) of evaluated feasible designs.
+        The designs of classes without a model are kept first (they are needed to fit it), then the others by
+        increasing optimistic cost per kg of payload."""
+
+        front = np.asarray(front, dtype=float).reshape(-1, 2)
+        kept = []
+        rejected = []
+
+        for index, prediction in enumerate(self.predict(designs)):
+            if not prediction["model"]:
+                kept.append((-np.inf, index))
+                continue
+
+            payload_high = prediction["payload"] + confidence * prediction["payload_std"]
+            payload_low = prediction["payload"] - confidence * prediction["payload_std"]
+            structural_low = prediction["structural_constraint"] - confidence * prediction["structural_constraint_std"]
+            volume_low = prediction["payload_constraint"] - (prediction["payload"] - payload_low) / \
+                designs[index]["payload_density"]
+            dominated = np.any((front[:, 0] >= payload_high) & (front[:, 1] <= prediction["cost"]) &
+                               ((front[:, 0] > payload_high) | (front[:, 1] < prediction["cost"])))
+
+            if payload_high <= 0 or structural_low > 0 or volume_low > 0 or dominated:
+                rejected.append(index)
+            else:
+                kept.append((prediction["cost"] / payload_high, index))
+
+        return [index for _, index in sorted(kept)], rejected
+
+    def report(self):
+        """Errors of the predictions against the held-out true results, per output: number of results, mean
+        absolute, root mean square and maximum errors, mean relative error and the fraction of the true values
+        within two standard deviations of the predictions."""
+
+        report = {}
+        for output in OUTPUTS:
+            pairs = [(prediction[output], result[output], prediction.get(output + "_std"))
+                     for prediction, result in self.held_out]
+            if not pairs:
+                report[output] = {"count": 0}
+                continue
+            predicted, true, deviation = (np.array(values, dtype=float) for values in zip(*pairs))
+            errors = predicted - true
+            report[output] = {"count": len(pairs),
+                              "mean_absolute_error": float(np.mean(np.abs(errors))),
+                              "rms_error": float(np.sqrt(np.mean(errors ** 2))),
+                              "max_error": float(np.max(np.abs(errors))),
+                              "mean_relative_error": float(np.mean(np.abs(errors) /
+                                                                   np.maximum(np.abs(true), 1e-12)))}
+            if not np.isnan(deviation).all():
+                report[output]["coverage_2std"] = float(np.mean(np.abs(errors) <= 2 * deviation))
+
+        return report
+
+
+def feasible(result):
+    """Whether a true result reaches the orbit and satisfies the constraints."""
+
+    return not result.get("error") and result["payload"] > 0 and result["structural_constraint"] <= 0 and \
+        result["payload_constraint"] <= 0
+
+
+def explore(candidates, surrogate=None, budget=None, batch_size=8, confidence=2.0, audit=0.0, seed=0,
+            workers=None, **options):
+    """Active learning over a list of candidate designs. At each round the candidates not evaluated yet are
+    screened, and the batch_size best ranked ones are evaluated (launcher.batch.evaluate_batch, the keyword
+    arguments are passed to launcher.mda.evaluate) and added to the surrogate. It stops when every remaining
+    candidate is rejected or budget designs have been evaluated. Then a fraction audit of the rejected
+    candidates, chosen at random, is evaluated to count the feasible designs that the rejections miss, and
+    the ones that would be on the front of the evaluated designs.
+
+    It returns the results of the evaluated candidates ({index: results}, audit included) and a summary with
+    the numbers of candidates, evaluations, rejections, audited and missed designs and the prediction errors
+    (Surrogate.report)."""
+
+    surrogate = surrogate if surrogate is not None else Surrogate()
+    budget = budget if budget is not None else len(candidates)
+    evaluated = {}
+    rejected = []
+
+    while len(evaluated) < budget:
+        remaining = [index for index in range(len(candidates)) if index not in evaluated]
+        front = [(result["payload"], result["cost"]) for result in evaluated.values() if feasible(result)]
+        kept, rejected = surrogate.screen([candidates[index] for index in remaining], confidence, front)
+        rejected = [remaining[index] for index in rejected]
+        chosen = [remaining[index] for index in kept[:min(batch_size, budget - len(evaluated))]]
+        if not chosen:
+            break
+
+        results = list(batch.evaluate_batch([candidates[index] for index in chosen], workers, **options))
+        surrogate.add([candidates[index] for index in chosen], results)
+        evaluated.update(zip(chosen, results))
+
+    screened = len(evaluated)
+    audited = []
+    if audit > 0 and rejected:
+        audited = sorted(np.random.default_rng(seed).choice(rejected, max(1, round(audit * len(rejected))),
+                                                             replace=False).tolist())
+        evaluated.update(zip(audited, batch.evaluate_batch([candidates[index] for index in audited], workers,
+                                                           **options)))
+
+    front = [(evaluated[index]["payload"], evaluated[index]["cost"]) for index in evaluated
+             if index not in audited and feasible(evaluated[index])]
+    missed = [index for index in audited if feasible(evaluated[index])]
+    missed_front = [index for index in missed
+                    if not any(payload >= evaluated[index]["payload"] and cost <= evaluated[index]["cost"]
+                               for payload, cost in front)]
+
+    return evaluated, {"candidates": len(candidates),
+                       "evaluated": screened,
+                       "rejected": len(rejected),
+                       "not_evaluated": len(candidates) - screened,
+                       "audited": len(audited),
+                       "audit_feasible": len(missed),
+                       "audit_front": len(missed_front),
+                       "models": len(surrogate.models),
+                       "prediction_errors": surrogate.report()}
+
+
+def main():
+    """Command line entry point."""
+
+    parser = argparse.ArgumentParser(description="Surrogate prescreening of launcher designs.")
+    parser.add_argument("candidates", help="CSV or .npz table of candidate designs (launcher.batch)")
+    parser.add_argument("results", help="CSV file for the results of the evaluated candidates")
+    parser.add_argument("--budget", type=int, default=None, help="maximum number of screened evaluations")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--confidence", type=float, default=2.0, help="standard deviations of the bounds")
+    parser.add_argument("--audit", type=float, default=0.0, help="fraction of the rejected designs evaluated")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (all cores by default)")
+    parser.add_argument("--cache", default=None, help="result cache file (launcher.result_cache)")
+    arguments = parser.parse_args()
+
+    candidates = batch.read_designs(arguments.candidates)
+    evaluated, summary = explore(candidates, budget=arguments.budget, batch_size=arguments.batch_size,
+                                 confidence=arguments.confidence, audit=arguments.audit, seed=arguments.seed,
+                                 workers=arguments.workers,
+                                 cache=ResultCache(arguments.cache) if arguments.cache else None)
+
+    with open(arguments.results, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=("design",) + batch.RESULT_COLUMNS)
+        writer.writeheader()
+        for index in sorted(evaluated):
+            writer.writerow(dict(evaluated[index], design=index))
+
+    errors = summary.pop("prediction_errors")
+    print(" ".join("{NAME}: {VALUE}".format(NAME=name, VALUE=value) for name, value in summary.items()))
+    for output, statistics in errors.items():
+        print("{OUTPUT}: {STATISTICS}".format(OUTPUT=output, STATISTICS=", ".join(
+            "{NAME} {VALUE:.4g}".format(NAME=name, VALUE=value) for name, value in statistics.items())))
+
+
+if __name__ == '__main__':
+    main()
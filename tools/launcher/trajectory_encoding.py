@@ -0,0 +1,59 @@
+"""Encoding of the trajectory vectors (height and velocity) in the XML files. Originally the vectors are written
+as the text of a Python list, which is slow to write and parse and makes the result files large. They can also
+be written as:
+
+- "float64" / "float32": base64 of the little-endian binary values, with the dtype and shape as attributes of
+  the element.
+- "npy": the values are saved in a .npy file next to the XML file, whose name is given by the file attribute of
+  the element. Useful when the tools run in the same folder (the file is not transferred by RCE).
+
+The readers accept any of them, so files written with the text form are still readable."""
+
+import base64
+import os
+import numpy as np
+
+ENCODINGS = ("text", "float64", "float32", "npy")
+
+
+def encode(element, vector, encoding="text", path=None):
+    """Writes the vector in an XML element (lxml or ElementTree) with the given encoding. path is the XML file
+    the element is written to, required by the "npy" encoding to place the .npy file next to it."""
+
+    if encoding == "text":
+        element.text = str([float(value) for value in vector])
+    elif encoding in ("float64", "float32"):
+        values = np.ascontiguousarray(vector, dtype="<f8" if encoding == "float64" else "<f4")
+        element.set("encoding", "base64")
+        element.set("dtype", values.dtype.str)
+        element.set("shape", str(len(values)))
+        element.text = base64.b64encode(values.tobytes()).decode("ascii")
+    elif encoding == "npy":
+        if path is None:
+            raise ValueError("The npy encoding needs the path of the XML file")
+        name = "{XML}_{ELEMENT}.npy".format(XML=os.path.splitext(os.path.basename(path))[0], ELEMENT=element.tag)
+        np.save(os.path.join(os.path.dirname(os.path.abspath(path)), name), np.asarray(vector, dtype="<f8"))
+        element.set("encoding", "npy")
+        element.set("file", name)
+    else:
+        raise ValueError("Unknown trajectory encoding: {ENCODING}".format(ENCODING=encoding))
+
+
+def decode(element, path=None):
+    """Vector of an XML element written by encode, as a float array. The base64 values are read without copy
+    with np.frombuffer, so the array is read-only. path is the XML file the element was read from, used to find
+    the .npy file of the "npy" encoding (which is memory-mapped)."""
+
+    encoding = element.get("encoding")
+
+    if encoding is None:    # Text of a Python list, parsed by numpy (much faster than ast.literal_eval)
+        text = element.text.strip(" \n[]") if element.text else ""
+        return np.array(text.split(","), dtype=float) if text else np.zeros(0)
+    elif encoding == "base64":
+        values = np.frombuffer(base64.b64decode(element.text), dtype=element.get("dtype"))
+        return values.reshape(int(element.get("shape")))
+    elif encoding == "npy":
+        folder = os.path.dirname(os.path.abspath(path)) if path is not None else os.getcwd()
+        return np.load(os.path.join(folder, element.get("file")), mmap_mode="r")
+    else:
+        raise ValueError("Unknown trajectory encoding: {ENCODING}".format(ENCODING=encoding))
@@ -0,0 +1,198 @@
+"""Warm worker process for the tools. Under RCE every tool call starts a new Python interpreter that imports
+numpy, scipy, ambiance and lxml again, which takes longer than most calculations. The worker is a long-lived
+process with all the tools imported, which runs them for the tool processes:
+
+    python worker.py serve ADDRESS
+
+ADDRESS is the path of a Unix socket, or HOST:PORT for a local TCP socket (on Windows, which has no Unix
+sockets), which must be a loopback address. When the environment variable LAUNCHER_WORKER is set to the address,
+running a tool ("python Cost.py", the RCE command) only forwards its folder and the environment variables read
+by the tools (FORWARDED_VARIABLES) to the worker (launcher.worker_client, imported
+before the heavy modules). The worker runs the tool there, reading ToolInput and writing ToolOutput as the
+tool would, and sends back the output printed by the tool and its exit status. If no worker answers, the tool
+runs in its own process as usual, so the RCE integration does not change. With LAUNCHER_WORKER_AUTOSTART=1
+that first call also starts the worker in the background for the next ones.
+
+The worker runs one tool at a time, in the order of the requests. The environment variables read when the tools
+are imported (LAUNCHER_PROFILE) and all the others are the ones of the worker. A tool process waits at most
+worker_client.RUN_TIMEOUT seconds for the start of the run, and then runs the tool itself; a request whose
+deadline is past when the worker gets to it is dropped. The worker acknowledges the start of a run, after which
+the tool process waits for its end, so a tool is never run both by the worker and by the tool process. The
+worker has no authentication: anyone who can connect to it can run the tools on the files of their choice, so
+its socket must only be reachable by the user. Usage:
+
+    python worker.py serve ADDRESS
+    python worker.py status ADDRESS
+    python worker.py stop ADDRESS"""
+
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from launcher.worker_client import ADDRESS_VARIABLE, FORWARDED_VARIABLES, connect, is_loopback, request, tcp_address
+
+# Module and folder of each tool of the workflow
+TOOLS = {"Geometry_calculator": "Geometry_calculator",
+         "Engine_liquid": "Engine_liquid_Space",
+         "Engine_solid": "Engine_solid_Space",
+         "Mass_propellant": "Mass_propellant_space",
+         "Mass_structure": "Mass_structure",
+         "Trajectory": "Trajectory",
+         "Structural_constraint": "Structural_constraint",
+         "Payload": "Payload",
+         "Cost": "Cost"}
+TOOLS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+
+@contextlib.contextmanager
+def tool_context(folder, environment):
+    """Runs a block in the folder and with the FORWARDED_VARIABLES of a tool process (the other variables in
+    environment are ignored), restoring them after."""
+
+    previous_folder = os.getcwd()
+    previous_environment = dict(os.environ)
+    os.chdir(folder)
+    for name in FORWARDED_VARIABLES:
+        if name in environment:
+            os.environ[name] = environment[name]
+        else:
+            os.environ.pop(name, None)
+    try:
+        yield
+    finally:
+        os.chdir(previous_folder)
+        os.environ.clear()
+        os.environ.update(previous_environment)
+
+
+def run_tool(tool, folder, environment):
+    """Runs a tool as its script would in the given folder and environment. It returns the exit status and the
+    text printed to stdout and stderr (with the traceback of an exception)."""
+
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    status = 0
+
+    with tool_context(folder, environment), contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            importlib.import_module(tool).run()
+        except SystemExit as exit_request:
+            status = exit_request.code if isinstance(exit_request.code, int) else 1
+        except Exception:
+            traceback.print_exc()
+            status = 1
+
+    return status, stdout.getvalue(), stderr.getvalue()
+
+
+class WorkerHandler(socketserver.StreamRequestHandler):
+    """Handler of a request: one JSON line with the command, answered with one JSON line."""
+
+    def handle(self):
+
+        message = json.loads(self.rfile.readline())
+        server = self.server
+
+        if message["command"] == "run":
+            if message["tool"] not in TOOLS:
+                response = {"status": 1, "stdout": "",
+                            "stderr": "Unknown tool: {TOOL}\n".format(TOOL=message["tool"])}
+            elif message.get("deadline") is not None and time.time() > message["deadline"]:
+                response = {"expired": True}    # The tool process gave up waiting and ran the tool itself
+            else:
+                try:    # Start acknowledgement: the tool process no longer runs the tool itself
+                    self.wfile.write(json.dumps({"started": True}).encode() + b"\n")
+                except OSError:    # The tool process is gone
+                    return
+                start_time = time.perf_counter()
+                status, stdout, stderr = run_tool(message["tool"], message["folder"], message["environment"])
+                server.statistics["runs"] = server.statistics["runs"] + 1
+                server.statistics["failures"] = server.statistics["failures"] + (status != 0)
+                server.statistics["run_time"] = server.statistics["run_time"] + time.perf_counter() - start_time
+                response = {"status": status, "stdout": stdout, "stderr": stderr}
+        elif message["command"] == "status":
+            response = dict(server.statistics, pid=os.getpid(), uptime=time.time() - server.start_time)
+        elif message["command"] == "stop":
+            response = {"stopped": True}
+            threading.Thread(target=server.shutdown).start()    # It waits for the end of this request
+        else:
+            response = {"error": "Unknown command: {COMMAND}".format(COMMAND=message["command"])}
+
+        try:
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+        except OSError:    # The tool process is gone (it gave up before the start of the run)
+            pass
+
+
+class WorkerServer(socketserver.TCPServer):
+    """Server running the tools, one request at a time."""
+
+    request_queue_size = 128    # Tool processes waiting for the worker
+    allow_reuse_address = True
+
+    def __init__(self, address):
+
+        self.statistics = {"runs": 0, "failures": 0, "run_time": 0.0}
+        self.start_time = time.time()
+        if tcp_address(address) is None:
+            self.address_family = socket.AF_UNIX
+            if os.path.exists(address):
+                try:    # A socket left by a worker that did not stop cleanly
+                    connect(address, timeout=1).close()
+                    raise OSError("A worker is already running at {ADDRESS}".format(ADDRESS=address))
+                except ConnectionRefusedError:
+                    os.remove(address)
+            super().__init__(address, WorkerHandler)
+        else:
+            host, port = tcp_address(address)
+            if not is_loopback(host, port):
+                raise ValueError("The worker only listens on loopback addresses: {ADDRESS}".format(ADDRESS=address))
+            super().__init__((host, port), WorkerHandler)
+
+
+def serve(address):
+    """Imports all the tools and runs them for the tool processes until a stop request."""
+
+    for module, folder in TOOLS.items():
+        sys.path.append(os.path.join(TOOLS_FOLDER, folder))
+        importlib.import_module(module)
+
+    with WorkerServer(address) as server:
+        try:
+            server.serve_forever(poll_interval=0.1)
+        finally:
+            if server.address_family == socket.AF_UNIX and os.path.exists(address):
+                os.remove(address)
+
+
+def main():
+    """Command line entry point."""
+
+    parser = argparse.ArgumentParser(description="Warm worker process running the tools.")
+    parser.add_argument("command", choices=("serve", "status", "stop"))
+    parser.add_argument("address", nargs="?", default=os.environ.get(ADDRESS_VARIABLE),
+                        help="Unix socket path or HOST:PORT (LAUNCHER_WORKER by default)")
+    arguments = parser.parse_args()
+
+    if not arguments.address:
+        parser.error("no worker address given")
+
+    if arguments.command == "serve":
+        serve(arguments.address)
+    else:
+        print(json.dumps(request(arguments.address, {"command": arguments.command}, timeout=10)))
+
+
+if __name__ == '__main__':
+    main()
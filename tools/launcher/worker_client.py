@@ -0,0 +1,125 @@
+"""Client side of launcher.worker, imported by the tool scripts before their heavy imports, so it only uses
+light modules of the standard library."""
+
+import ipaddress
+import json
+import os
+import socket
+import sys
+import time
+
+ADDRESS_VARIABLE = "LAUNCHER_WORKER"
+AUTOSTART_VARIABLE = "LAUNCHER_WORKER_AUTOSTART"
+
+# Environment variables read by the tools when they run, the only ones forwarded to the worker
+FORWARDED_VARIABLES = ("LAUNCHER_RESULT_CACHE", "TRAJECTORY_HINT_CACHE", "TRAJECTORY_FIDELITY",
+                       "TRAJECTORY_ENCODING", "TRAJECTORY_OUTPUT_SAMPLING", "TRAJECTORY_MAX_Q")
+CONNECT_TIMEOUT = 5    # Seconds to connect to the worker
+RUN_TIMEOUT = 600    # Seconds to wait for the start of the tool run, queued behind the other requests
+
+
+def tcp_address(address):
+    """(host, port) of a HOST:PORT address, or None for a Unix socket path."""
+
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit() or "/" in host or "\\" in host:    # Path (C:\... on Windows)
+        return None
+
+    return host, int(port)
+
+
+def is_loopback(host, port):
+    """Whether all the addresses a host resolves to are loopback addresses."""
+
+    return all(ipaddress.ip_address(socket_address[0].split("%")[0]).is_loopback
+               for *_, socket_address in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP))
+
+
+def connect(address, timeout=None):
+    """Socket connected to a worker."""
+
+    if tcp_address(address) is not None:
+        return socket.create_connection(tcp_address(address), timeout=timeout)
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(timeout)
+    try:
+        connection.connect(address)
+    except OSError:
+        connection.close()
+        raise
+
+    return connection
+
+
+def request(address, message, timeout=None):
+    """Sends a request (a JSON serializable dictionary) to a worker and returns its response."""
+
+    with connect(address, timeout) as connection:
+        connection.sendall(json.dumps(message).encode() + b"\n")
+        with connection.makefile("rb") as f:
+            line = f.readline()
+
+    if not line:
+        raise ConnectionError("The worker closed the connection")
+
+    return json.loads(line)
+
+
+def start(address):
+    """Starts a worker in the background, detached from this process."""
+
+    import subprocess    # Only imported here, as it is slow to import
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")
+    subprocess.Popen([sys.executable, script, "serve", address], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, start_new_session=True)
+
+
+def forward(tool):
+    """Client mode of a tool, called by its script before the heavy imports. If LAUNCHER_WORKER is set and the
+    worker starts the run within RUN_TIMEOUT, the tool is run there, its output printed, and the process exits
+    with its status. Otherwise it returns and the tool runs in this process.
+
+    The worker acknowledges the start of the run, and only starts it before the deadline sent with the request,
+    which is earlier than the time this process gives up. Once the run has started, this process waits for its
+    end without a timeout, so a tool is never run twice."""
+
+    address = os.environ.get(ADDRESS_VARIABLE)
+    if not address:
+        return
+
+    environment = {name: os.environ[name] for name in FORWARDED_VARIABLES if name in os.environ}
+    message = {"command": "run", "tool": tool, "folder": os.getcwd(), "environment": environment,
+               "deadline": time.time() + RUN_TIMEOUT}
+    try:
+        connection = connect(address, CONNECT_TIMEOUT)
+    except OSError:    # No worker
+        if os.environ.get(AUTOSTART_VARIABLE) == "1":
+            start(address)
+        return
+
+    with connection, connection.makefile("rb") as f:
+        try:
+            connection.settimeout(RUN_TIMEOUT + CONNECT_TIMEOUT)    # The worker answers by the deadline
+            connection.sendall(json.dumps(message).encode() + b"\n")
+            response = json.loads(f.readline() or b"{}")
+        except OSError:    # Worker hung (it drops the request if it gets to it after the deadline) or gone
+            return
+        if not response or response.get("expired"):
+            return
+
+        if response.get("started"):
+            connection.settimeout(None)    # The tool is running in the worker: no fallback from here
+            try:
+                line = f.readline()
+            except OSError:
+                line = b""
+            if not line:
+                sys.stderr.write("The worker stopped during the run of {TOOL}\n".format(TOOL=tool))
+                sys.exit(1)
+            response = json.loads(line)
+
+    sys.stdout.write(response["stdout"])
+    sys.stderr.write(response["stderr"])
+    sys.exit(response["status"])